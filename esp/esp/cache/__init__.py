@@ -35,4 +35,4 @@ Learning Unlimited, Inc.
 
 # Convenience imports
 from esp.cache.argcache import cache_function
-from esp.cache.key_set import wildcard
+from esp.cache.key_set import wildcard, one_of
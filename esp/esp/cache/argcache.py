@@ -33,9 +33,16 @@ Learning Unlimited, Inc.
   Email: web-team@lists.learningu.org
 """
 
+import hashlib
 import random
+import time
 import types
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from django.core.cache import cache
 from django.dispatch import Signal
 from django.db.models import signals
@@ -47,13 +54,38 @@ from esp.cache.queued import WithDelayableMethods, delay_method
 from esp.cache.marinade import args_to_key, normalize_args
 from esp.cache.function import describe_func, get_uid
 from esp.cache.token import Token, SingleEntryToken
-from esp.cache.key_set import is_wildcard, specifies_key, token_list_for
+from esp.cache.key_set import is_wildcard, is_one_of, specifies_key, token_list_for, expand_key_set
 from esp.cache.registry import cache_by_uid, register_cache, all_caches
 from esp.cache.sad_face import warn_if_loaded
+from esp.cache.request_memo import memo_get, memo_set, memo_clear
+from esp.cache.batch import queue_delete, drop_pending, batched_invalidations
 from esp.cache.signals import m2m_added, m2m_removed
 
 __all__ = ['ArgCache', 'ArgCacheDecorator', 'cache_function']
 
+# A key_set with one_of() values is deleted one combination of values at a
+# time, unless there are more than this many combinations
+MAX_EXPANDED_KEY_SETS = 1000
+
+# Measure the pickled size of one in this many stored values
+VALUE_SIZE_SAMPLE_INTERVAL = 10
+
+# While one process recomputes a missing value of a cache_function with
+# use_leases=True, it holds a lease on it for at most lease_timeout seconds
+# (LEASE_TIMEOUT by default); anyone else who misses waits for the value to
+# show up, or for the lease to go away, before computing it too.  Nobody
+# waits longer than lease_max_wait seconds (LEASE_MAX_WAIT by default),
+# though: after that, they compute the value themselves, lease or no lease.
+LEASE_TIMEOUT = 300
+LEASE_MAX_WAIT = 5
+LEASE_POLL_INTERVAL = 0.05
+
+class NoneResult(object):
+    """ Stored in place of None by cache_functions with use_leases=True, so
+    that a function that returns None still looks cached to the processes
+    waiting on its lease. """
+    pass
+
 _delete_signal = Signal(providing_args=['key_set'])
 
 # XXX: For now, all functions must have known arity. No *args or
@@ -66,6 +98,10 @@ _delete_signal = Signal(providing_args=['key_set'])
 # avoid a ridiculous blowup in memory. This will make it about as memory
 # efficient as tiered caching. May be a performance hit though... not sure.
 #
+# (This is now available as the hash_tokens option, or CACHE_HASH_TOKENS to
+# turn it on everywhere. The tokens themselves still have to be fetched to
+# check the digest, so this saves space but not keys.)
+#
 # I think it's worth it though... this also has the side effect that caches
 # have tokens and then can be used as handles maybe? Kind of another way to
 # express 1-1 dependencies... but offloading work from set() to get(), which
@@ -127,15 +163,22 @@ _delete_signal = Signal(providing_args=['key_set'])
 # that we can extend this to more complex queries in the future. Perhaps each
 # token has a can_handle() thing that sees if it can handle each query. This
 # will likely depend on an asynchronous-cacher thing.
+#
+# (Finite sets of values, including ranges of ids, can be deleted exactly with
+# one_of(); see delete_key_set.)
 
 
 # TODO: Somehow collapse these duplicate reports... delay signals? Keep track
 # of when we last set?  problem... multiple processes... I suppose we could use
 # a "IPC" mechanism of the cache. Sigh.
+#
+# (Within one thread, esp.cache.batch now collapses them; see
+# batched_invalidations.)
 
 
-# TODO: Depend on external factors (a version cookie on each function when
-# needed) and the param signature
+# TODO: Depend on external factors and the param signature
+#
+# (There is now a version number in each cache's keys; see ArgCache.version.)
 
 
 # TODO: Properly handle things like staticmethod and classmethod (?)
@@ -183,9 +226,11 @@ class ArgCache(WithDelayableMethods):
             existing.locked = True
         return existing
 
-    def __init__(self, name, params, uid=None, cache=cache, *args, **kwargs):
+    def __init__(self, name, params, uid=None, cache=cache, hash_tokens=None, version=0, *args, **kwargs):
         if uid is None:
             uid = name
+        if hash_tokens is None:
+            hash_tokens = getattr(settings, 'CACHE_HASH_TOKENS', False)
         super(ArgCache, self).__init__(*args, **kwargs)
 
         if isinstance(params, list):
@@ -194,6 +239,12 @@ class ArgCache(WithDelayableMethods):
         self.params = params
         self.uid = uid
         self.cache = cache
+        # Store one digest of the token values with each value, rather than
+        # the token values themselves
+        self.hash_tokens = hash_tokens
+        # Part of every key; bump it when what the cache stores changes shape
+        # so that values pickled by older code are never read back
+        self.version = version
         self.tokens = []
         self.token_dict = {}
         self.locked = False
@@ -201,9 +252,20 @@ class ArgCache(WithDelayableMethods):
         # Mostly used to avoid recursion
         self.disabled = False
 
+        # Optional function that fills this cache in for a Program; see
+        # set_warmer()
+        self.warmer = None
+
         # Init stats
         self.hit_count = 0
         self.miss_count = 0
+        self.compute_time = 0.0     # seconds spent computing misses
+        self.cache_time = 0.0       # seconds spent talking to the cache backend
+        self.set_count = 0
+        self.value_size_total = 0   # over a sample of the values we store
+        self.value_size_samples = 0
+        self.invalidation_counts = {}   # dependency description -> count
+        self.lease_wait_count = 0   # misses that waited for another process
 
         # Be able to invert param mapping
         self.param_dict = {}
@@ -236,6 +298,39 @@ class ArgCache(WithDelayableMethods):
             self.disabled = old_disabled
         self.miss_count += 1
 
+    def _invalidation_hook(self, dependency):
+        self.invalidation_counts[dependency] = self.invalidation_counts.get(dependency, 0) + 1
+
+    def _store_hook(self, wrapped_value):
+        # Pickling big values isn't free, so only measure every so often
+        if self.set_count % VALUE_SIZE_SAMPLE_INTERVAL == 0:
+            try:
+                self.value_size_total += len(pickle.dumps(wrapped_value, pickle.HIGHEST_PROTOCOL))
+                self.value_size_samples += 1
+            except Exception:
+                pass
+        self.set_count += 1
+
+    def stats(self):
+        """ Returns a dictionary of statistics about this cache, for this
+        process since it started. """
+        if self.value_size_samples:
+            avg_value_size = self.value_size_total / self.value_size_samples
+        else:
+            avg_value_size = None
+        return {'name': self.name,
+                'pretty_name': self.pretty_name,
+                'uid': self.uid,
+                'version': self.version,
+                'hit_count': self.hit_count,
+                'miss_count': self.miss_count,
+                'compute_time': self.compute_time,
+                'cache_time': self.cache_time,
+                'avg_value_size': avg_value_size,
+                'invalidation_counts': self.invalidation_counts.copy(),
+                'invalidation_count': sum(self.invalidation_counts.values()),
+                'lease_wait_count': self.lease_wait_count}
+
     @property
     def pretty_name(self):
         return '%s(%s)' % (self.name, ', '.join(self.params))
@@ -257,6 +352,14 @@ class ArgCache(WithDelayableMethods):
         _delete_signal.send(sender=self, key_set=key_set)
     send.alters_data = True
 
+    def set_warmer(self, warmer):
+        """ Register warmer, a function that takes a Program and computes the
+        values of this cache that the program is going to need. The
+        warm_program_caches command uses this to fill the cache in before the
+        students arrive. """
+        self.warmer = warmer
+    set_warmer.alters_data = True
+
     def index_of_param(self, param):
         """ Should be internal, returns the index of a particular parameter. """
         if isinstance(param, int):
@@ -267,14 +370,24 @@ class ArgCache(WithDelayableMethods):
         return self.param_dict[param]
 
     def delete_all(self):
-        """ Dumps everything in this cache. """
+        """ Dumps everything in this cache. Every value is checked against the
+        global token, so this is a single delete no matter how big the cache
+        is. """
         self.global_token.delete_filt(())
     delete_all.alters_data = True
 
+    def bump_version(self):
+        """ Like delete_all, but increments the global token instead of
+        deleting it: a single atomic operation, after which no value stored
+        before it is valid. This is what the cache overview page's Flush
+        button does. """
+        self.global_token.bump_filt(())
+    bump_version.alters_data = True
+
     def key(self, arg_list):
         """ Returns a cache key, given a list of arguments. """
         from esp.cache.marinade import marinade_dish
-        return self.name + '|' + ':'.join([marinade_dish(arg) for arg in arg_list])
+        return '%s|v%d|%s' % (self.name, self.version, ':'.join([marinade_dish(arg) for arg in arg_list]))
 
     def _token_keys(self, arg_list):
         """ Returns a list of keys to grab for all the tokens. """
@@ -284,6 +397,30 @@ class ArgCache(WithDelayableMethods):
             token_keys.append(token.key(arg_list))
         return token_keys
 
+    @staticmethod
+    def _token_digest(token_values):
+        """ Hashes a list of token values together. """
+        return hashlib.md5(':'.join([str(tvalue) for tvalue in token_values])).digest()
+
+    def _wrap(self, value, token_values):
+        """ Returns what to store in the cache for value, given the current
+        values of all of its tokens (in the order of self.tokens). """
+        if self.hash_tokens:
+            return [value, self._token_digest(token_values)]
+        return [value] + list(token_values)
+
+    def _tokens_match(self, wrapped_value, token_keys, ans_dict):
+        """ Checks a stored value against the current token values in
+        ans_dict. May raise if wrapped_value is garbage. """
+        token_values = [ans_dict.get(tkey, None) for tkey in token_keys]
+        # a missing token means it was deleted since we saved
+        for tvalue in token_values:
+            if not tvalue:
+                return False
+        if self.hash_tokens:
+            return len(wrapped_value) == 2 and wrapped_value[1] == self._token_digest(token_values)
+        return list(wrapped_value[1:]) == token_values
+
     def add_token(self, token):
         """ Adds the given token to this cache. """
         self.tokens.append(token)
@@ -327,39 +464,64 @@ class ArgCache(WithDelayableMethods):
 
     def get(self, arg_list):
         """ Get the value of the cache at arg_list (which can be a tuple). """
+        return self.get_many([arg_list])[0]
+
+    def get_many(self, arg_lists):
+        """ Get the values of the cache at each of arg_lists, using a single
+        cache round trip. Returns a list, with None for each miss. """
         if self.disabled:
-            return None
+            return [None] * len(arg_lists)
 
-        key = self.key(arg_list)
+        results = [None] * len(arg_lists)
+        pending = []
+        keys_to_get = set()
 
-        # gather keys
-        keys_to_get = [key] + self._token_keys(arg_list)
+        for i, arg_list in enumerate(arg_lists):
+            key = self.key(arg_list)
 
-        # extract values
-        ans_dict = self.cache.get_many(keys_to_get)
+            # try the request-local memo first
+            retVal = memo_get(self.uid, key)
+            if retVal is not None:
+                self._hit_hook(arg_list)
+                results[i] = retVal
+                continue
+
+            # gather keys
+            token_keys = self._token_keys(arg_list)
+            pending.append((i, key, token_keys))
+            keys_to_get.add(key)
+            keys_to_get.update(token_keys)
+
+        if not pending:
+            return results
+
+        # extract values, ignoring anything we're about to delete
+        start = time.time()
+        ans_dict = drop_pending(self.cache, self.cache.get_many(list(keys_to_get)))
+        self.cache_time += time.time() - start
+        for i, key, token_keys in pending:
+            results[i] = self._unwrap(arg_lists[i], key, token_keys, ans_dict)
+        return results
+
+    def _unwrap(self, arg_list, key, token_keys, ans_dict):
+        """ Returns the value at key from the results of a get_many, or None
+        if it is missing or out of date. """
         wrapped_value = ans_dict.get(key, None)
         if wrapped_value is None:
             self._miss_hook(arg_list)
             return None
-        
+
         try:
             # check tokens
-            if len(wrapped_value) != len(keys_to_get):
+            if not self._tokens_match(wrapped_value, token_keys, ans_dict):
                 # shhhh... that value wasn't really there
-                self.cache.delete(key)
+                queue_delete(self.cache, key)
                 self._miss_hook(arg_list)
                 return None
-            for tvalue, tkey in zip(wrapped_value[1:], keys_to_get[1:]):
-                saved_value = ans_dict.get(tkey, None)
-                # token mismatch!
-                if not saved_value or saved_value != tvalue:
-                    # shhhh... that value wasn't really there
-                    self.cache.delete(key)
-                    self._miss_hook(arg_list)
-                    return None
 
             # okay, it's good
             self._hit_hook(arg_list)
+            memo_set(self.uid, key, wrapped_value[0])
             return wrapped_value[0]
 
         except Exception: # Don't die on errors, e.g. if wrapped_value is not a tuple/list
@@ -368,35 +530,55 @@ class ArgCache(WithDelayableMethods):
 
     def set(self, arg_list, value, timeout_seconds=None):
         """ Set the value of the cache at arg_list (which can be a tuple). """
-        if self.disabled:
-            return
+        self.set_many([(arg_list, value)], timeout_seconds)
+    set.alters_data = True
 
-        key = self.key(arg_list)
+    def set_many(self, items, timeout_seconds=None):
+        """ Set the value of the cache for each (arg_list, value) pair in
+        items, using one round trip to read tokens and one to write. """
+        if self.disabled or not items:
+            return
 
         # gather keys
-        token_keys = self._token_keys(arg_list)
+        token_keys_list = [self._token_keys(arg_list) for arg_list, value in items]
+        all_token_keys = set()
+        for token_keys in token_keys_list:
+            all_token_keys.update(token_keys)
 
         # extract what values we can
         #  we use get_many here to optimize the common case: all tokens already present
-        ans_dict = self.cache.get_many(token_keys)
-
-        # regenerate missing tokens
-        for tkey, token in zip(token_keys, self.tokens):
-            if not ans_dict.has_key(tkey):
-                ans_dict[tkey] = token.value_args(arg_list)
-
-        # gather token values
-        wrapped_value = [value]
-        for tkey in token_keys:
-            wrapped_value.append(ans_dict[tkey])
-            
-        self.cache.set(key, wrapped_value, timeout_seconds)
-    set.alters_data = True
+        start = time.time()
+        ans_dict = self.cache.get_many(list(all_token_keys))
+        self.cache_time += time.time() - start
+
+        to_set = {}
+        for (arg_list, value), token_keys in zip(items, token_keys_list):
+            # regenerate missing tokens
+            for tkey, token in zip(token_keys, self.tokens):
+                if not ans_dict.has_key(tkey):
+                    ans_dict[tkey] = token.value_args(arg_list)
+
+            # gather token values
+            wrapped_value = self._wrap(value, [ans_dict[tkey] for tkey in token_keys])
+            self._store_hook(wrapped_value)
+            to_set[self.key(arg_list)] = wrapped_value
+
+        start = time.time()
+        if len(to_set) == 1:
+            key, wrapped_value = to_set.items()[0]
+            self.cache.set(key, wrapped_value, timeout_seconds)
+        else:
+            self.cache.set_many(to_set, timeout_seconds)
+        self.cache_time += time.time() - start
+        for arg_list, value in items:
+            memo_set(self.uid, self.key(arg_list), value)
+    set_many.alters_data = True
 
     def delete(self, arg_list):
         """ Delete the value of the cache at arg_list (which can be a tuple). """
         key = self.key(arg_list)
-        self.cache.delete(key)
+        queue_delete(self.cache, key)
+        memo_clear(self.uid)
         key_set = {}
         for i,arg in enumerate(arg_list):
             key_set[self.params[i]] = arg
@@ -405,7 +587,21 @@ class ArgCache(WithDelayableMethods):
 
     # In case 'self' is a valid param, call this guy _self... :-D
     def delete_key_set(_self, **key_set):
-        """ Delete everything in this key_set, rounding up if necessary. """
+        """ Delete everything in this key_set, rounding up if necessary.
+
+        A parameter may be given a one_of() set of values, in which case each
+        combination is deleted separately, e.g.
+
+            cache.delete_key_set(self=one_of(teachers), program=program)
+
+        only needs a (self, program) token, where program=program alone would
+        need a (program) token or else round up to the whole cache. """
+
+        if any(is_one_of(val) for val in key_set.values()):
+            with batched_invalidations():
+                for sub_key_set in expand_key_set(key_set, MAX_EXPANDED_KEY_SETS):
+                    _self.delete_key_set(**sub_key_set)
+            return
 
         if settings.CACHE_DEBUG:
             print "Dumping from", _self.name, "keyset", key_set
@@ -467,7 +663,9 @@ class ArgCache(WithDelayableMethods):
         Model = handle_thunk(Model)
         if create_token:
             self.get_or_create_token(token_list_for(key_set))
+        dependency = 'model %s' % Model.__name__
         def delete_cb(sender, **kwargs):
+            self._invalidation_hook(dependency)
             self.delete_key_sets(key_set)
         signals.post_save.connect(delete_cb, sender=Model, weak=False)
         signals.pre_delete.connect(delete_cb, sender=Model, weak=False)
@@ -504,11 +702,13 @@ class ArgCache(WithDelayableMethods):
             # Make the token
             token = self.get_or_create_token((selector_str,))
 
+        dependency = 'row %s' % Model.__name__
         def delete_cb(sender, instance, **kwargs):
             if not filter(instance):
                 return None
             new_key_set = selector(instance)
             if new_key_set is not None:
+                self._invalidation_hook(dependency)
                 self.delete_key_sets(new_key_set)
         signals.post_save.connect(delete_cb, sender=Model, weak=False)
         signals.pre_delete.connect(delete_cb, sender=Model, weak=False)
@@ -535,11 +735,13 @@ class ArgCache(WithDelayableMethods):
         cache_obj = handle_thunk(cache_obj)
         if filter is None:
             filter = lambda **kwargs: True
+        dependency = 'cache %s' % cache_obj.name
         def delete_cb(sender, key_set, **kwargs):
             if not filter(**key_set):
                 return None
             new_key_set = mapping_func(**key_set)
             if new_key_set is not None:
+                self._invalidation_hook(dependency)
                 self.delete_key_sets(new_key_set)
         # TODO: Handle timeouts and take the min of a timeout
         cache_obj.connect(delete_cb)
@@ -566,6 +768,7 @@ class ArgCache(WithDelayableMethods):
             filter = lambda instance, object: True
         Model = handle_thunk(Model)
 
+        dependency = 'm2m %s.%s' % (Model.__name__, m2m_field)
         def add_cb(sender, instance, field, object, **kwargs):
             if field != m2m_field:
                 return None
@@ -573,6 +776,7 @@ class ArgCache(WithDelayableMethods):
                 return None
             new_key_set = add_func(instance, object)
             if new_key_set is not None:
+                self._invalidation_hook(dependency)
                 self.delete_key_sets(new_key_set)
         def rem_cb(sender, instance, field, object, **kwargs):
             if field != m2m_field:
@@ -581,6 +785,7 @@ class ArgCache(WithDelayableMethods):
                 return None
             new_key_set = rem_func(instance, object)
             if new_key_set is not None:
+                self._invalidation_hook(dependency)
                 self.delete_key_sets(new_key_set)
         m2m_added.connect(add_cb, sender=Model, weak=False)
         m2m_removed.connect(rem_cb, sender=Model, weak=False)
@@ -599,7 +804,13 @@ class ArgCacheDecorator(ArgCache):
         return ArgCache.check_for_instance(None, params, uid)
 
     def __init__(self, func, *args, **kwargs):
-        """ Wrap func in a ArgCache. """
+        """ Wrap func in a ArgCache. To change the version, e.g. after
+        changing what func returns, wrap it by hand:
+
+            def foo(self, program):
+                ...
+            foo = cache_function(foo, version=2)
+        """
 
         ## Keep the original function's name and docstring
         ## If the original function has any more-complicated attrs,
@@ -616,6 +827,12 @@ class ArgCacheDecorator(ArgCache):
         self.func = func
         params = self.argspec[0]
         extra_name = kwargs.pop('uid_extra', '')
+        # Only let one process at a time recompute a missing value.  This
+        # costs two extra round trips per miss, so it's only worth it for
+        # functions that are expensive to compute and popular.
+        self.use_leases = kwargs.pop('use_leases', False) and getattr(settings, 'CACHE_STAMPEDE_LEASES', True)
+        self.lease_timeout = kwargs.pop('lease_timeout', LEASE_TIMEOUT)
+        self.lease_max_wait = kwargs.pop('lease_max_wait', LEASE_MAX_WAIT)
         name = describe_func(func) + extra_name
         uid = get_uid(func) + extra_name
         if self.argspec[1] is not None:
@@ -639,17 +856,100 @@ class ArgCacheDecorator(ArgCache):
             arg_list = self.arg_list_from(args, kwargs)
             retVal = self.get(arg_list)
 
+            if isinstance(retVal, NoneResult):
+                return None
             if retVal is not None:
                 return retVal
 
             if not cache_only:
-                retVal = self.func(*args, **kwargs)
-                self.set(arg_list, retVal)
+                if self.use_leases:
+                    retVal = self._compute_with_lease(arg_list, args, kwargs)
+                else:
+                    retVal = self._compute(arg_list, args, kwargs)
         else:
             retVal = self.func(*args, **kwargs)
 
         return retVal
 
+    def _compute(self, arg_list, args, kwargs):
+        """ Call the function and store the result. """
+        start = time.time()
+        retVal = self.func(*args, **kwargs)
+        self.compute_time += time.time() - start
+        if retVal is None and self.use_leases:
+            self.set(arg_list, NoneResult())
+        else:
+            self.set(arg_list, retVal)
+        return retVal
+
+    def _lease_key(self, arg_list):
+        """ The key of the lease on the value at arg_list.  Hashed, since
+        prefixing the value's key could take it past memcached's limit. """
+        return 'lease|' + hashlib.md5(self.key(arg_list)).hexdigest()
+
+    def _compute_with_lease(self, arg_list, args, kwargs):
+        """ Like _compute, but when several processes miss on the same value
+        at once (e.g. the catalog right after it expires), only the first one
+        computes it; the rest wait for it to show up in the cache.
+
+        The lease is taken with cache.add(), which is atomic in memcached. If
+        the process holding the lease gives up without storing anything, the
+        next one to notice takes over; if it dies, the lease expires after
+        lease_timeout seconds and the next one takes over then.  Either way,
+        a process that has waited lease_max_wait seconds (say, because the
+        holder is stuck) stops waiting and computes the value itself. """
+        lease_key = self._lease_key(arg_list)
+        waited = False
+        deadline = time.time() + self.lease_max_wait
+        while True:
+            if self.cache.add(lease_key, 1, self.lease_timeout):
+                try:
+                    return self._compute(arg_list, args, kwargs)
+                finally:
+                    self.cache.delete(lease_key)
+
+            if not waited:
+                self.lease_wait_count += 1
+                waited = True
+            if time.time() >= deadline:
+                return self._compute(arg_list, args, kwargs)
+            time.sleep(LEASE_POLL_INTERVAL)
+            retVal = self.get(arg_list)
+            if isinstance(retVal, NoneResult):
+                return None
+            if retVal is not None:
+                return retVal
+
+    def call_many(self, args_list):
+        """ Call the function once for each tuple of positional arguments in
+        args_list, and return the list of results in the same order.
+
+        All of the cached results are fetched in one round trip, and only the
+        misses are computed (and then stored in one round trip). This is a
+        lot cheaper than calling the function in a loop, e.g.
+
+            capacities = ClassSection._get_capacity.call_many([(sec,) for sec in sections])
+        """
+        args_list = [tuple(args) for args in args_list]
+        arg_lists = [self.arg_list_from(args, {}) for args in args_list]
+        results = self.get_many(arg_lists)
+
+        to_set = []
+        for i, args in enumerate(args_list):
+            if isinstance(results[i], NoneResult):
+                results[i] = None
+            elif results[i] is None:
+                start = time.time()
+                results[i] = self.func(*args)
+                self.compute_time += time.time() - start
+                if results[i] is None and self.use_leases:
+                    to_set.append((arg_lists[i], NoneResult()))
+                else:
+                    to_set.append((arg_lists[i], results[i]))
+        self.set_many(to_set)
+
+        return results
+
     # make bound member functions work...
     def __get__(self, obj, objtype=None):
         """ Python member functions are such hacks... :-D """
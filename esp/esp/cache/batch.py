@@ -0,0 +1,152 @@
+""" Coalescing of cache invalidations. """
+__author__    = "Individual contributors (see AUTHORS file)"
+__date__      = "$DATE$"
+__rev__       = "$REV$"
+__license__   = "AGPL v.3"
+__copyright__ = """
+This file is part of the ESP Web Site
+Copyright (c) 2009 by the individual contributors
+  (see AUTHORS file)
+
+The ESP Web Site is free software; you can redistribute it and/or
+modify it under the terms of the GNU Affero General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public
+License along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Contact information:
+MIT Educational Studies Program
+  84 Massachusetts Ave W20-467, Cambridge, MA 02139
+  Phone: 617-253-4882
+  Email: esp-webmasters@mit.edu
+Learning Unlimited, Inc.
+  527 Franklin St, Cambridge, MA 02139
+  Phone: 617-379-0178
+  Email: web-team@lists.learningu.org
+"""
+
+import threading
+
+__all__ = ['batched_invalidations', 'start_batch', 'end_batch', 'discard_batch', 'queue_delete', 'queue_delete_many', 'queue_callback', 'drop_pending']
+
+# Bulk operations fire post_save for every row they touch, and each of those
+# makes every dependent ArgCache delete the same token over and over.  Inside
+# a batch, ArgCache instead remembers which keys it needs to delete, and
+# deletes each of them once, in one delete_many, when the outermost batch ends.
+#
+# Only the backend deletes are coalesced.  Each invalidation still clears the
+# request memo and signals the dependent caches, since a value may have been
+# recomputed (and memoized) since the last time the same key set was
+# invalidated.
+#
+# Until then, lookups treat the doomed keys as already gone, so code running
+# inside the batch never sees stale values.
+#
+# Things that should only be announced once the batch is over (e.g. to other
+# processes, which can't see the changes until they're committed) can be
+# queued with queue_callback(); the callbacks run, in order, after the deletes.
+#
+# Batches are per-thread and nest.  Wrap bulk operations in
+#
+#     with batched_invalidations():
+#         ...
+#
+# (the middleware in esp.middleware.batchinvalidationmiddleware does this for
+# each request, flushing after the transaction has been committed).
+
+_threading_local = threading.local()
+
+def _batch():
+    return getattr(_threading_local, 'batch', None)
+
+def start_batch():
+    """ Start (or nest) a batch of invalidations for the current thread. """
+    batch = _batch()
+    if batch is None:
+        batch = _threading_local.batch = {'depth': 0, 'pending': {}, 'callbacks': []}
+    batch['depth'] += 1
+
+def _flush(batch):
+    for cache, keys in batch['pending'].values():
+        if len(keys) == 1:
+            cache.delete(keys.pop())
+        else:
+            cache.delete_many(list(keys))
+    for func in batch['callbacks']:
+        func()
+
+def end_batch():
+    """ End a batch; if it was the outermost one, actually delete everything. """
+    batch = _batch()
+    if batch is None:
+        return
+    batch['depth'] -= 1
+    if batch['depth'] > 0:
+        return
+    _threading_local.batch = None
+    _flush(batch)
+
+def discard_batch():
+    """ Get rid of any batch left over on the current thread, whatever its
+    depth, so that the next start_batch() starts a fresh one.
+
+    For use at the start of a request, in case an earlier request's
+    end_batch() never happened.  The leftover keys are still deleted, since
+    their invalidations would otherwise be lost. """
+    batch = _batch()
+    if batch is None:
+        return
+    _threading_local.batch = None
+    _flush(batch)
+
+class batched_invalidations:
+    """ Context manager that coalesces the cache invalidations made inside it. """
+
+    def __enter__(self):
+        start_batch()
+
+    def __exit__(self, type, value, traceback):
+        # Flush even on errors; deleting too much is harmless.
+        end_batch()
+
+def queue_delete(cache, key):
+    """ Delete key from cache, now or at the end of the current batch. """
+    batch = _batch()
+    if batch is None:
+        cache.delete(key)
+    else:
+        batch['pending'].setdefault(id(cache), (cache, set()))[1].add(key)
+
+def queue_delete_many(cache, keys):
+    """ Delete keys from cache, now or at the end of the current batch. """
+    batch = _batch()
+    if batch is None:
+        cache.delete_many(keys)
+    else:
+        batch['pending'].setdefault(id(cache), (cache, set()))[1].update(keys)
+
+def queue_callback(func):
+    """ Call func now, or at the end of the current batch. """
+    batch = _batch()
+    if batch is None:
+        func()
+    else:
+        batch['callbacks'].append(func)
+
+def drop_pending(cache, ans_dict):
+    """ Remove the keys that are about to be deleted from the results of a
+    cache.get_many. """
+    batch = _batch()
+    if batch is None or id(cache) not in batch['pending']:
+        return ans_dict
+    for key in batch['pending'][id(cache)][1]:
+        ans_dict.pop(key, None)
+    return ans_dict
@@ -33,7 +33,7 @@ Learning Unlimited, Inc.
   Email: web-team@lists.learningu.org
 """
 
-__all__ = ['wildcard', 'is_wildcard']
+__all__ = ['wildcard', 'is_wildcard', 'one_of', 'is_one_of']
 
 class WildcardType(object):
     """
@@ -89,10 +89,33 @@ class WildcardType(object):
 
 wildcard = WildcardType()
 
+class OneOf(object):
+    """
+    Represents a finite set of values for one parameter of a key_set, e.g.
+    {'self': one_of(teachers), 'program': program}. The key_set is deleted one
+    value at a time, so each piece is handled by an exact token rather than
+    rounding up to a broader one.
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def __repr__(self):
+        return '<one of %r>' % (self.values,)
+
+def one_of(values):
+    """ Any of the given values, e.g. one_of(sections) or one_of(xrange(lo, hi))
+    for a range of ids. """
+    return OneOf(values)
+
 def is_wildcard(obj):
     """ Is the given object a wildcard? """
     return isinstance(obj, WildcardType)
 
+def is_one_of(obj):
+    """ Is the given object a set of values? """
+    return isinstance(obj, OneOf)
+
 def has_wildcard(lst):
     """ Does this given iterable contain a wildcard? """
     return any([is_wildcard(obj) for obj in lst])
@@ -104,3 +127,25 @@ def specifies_key(key_set, key):
 def token_list_for(key_set):
     """ Given me a list of interesting arguments for key_set. """
     return [key for key,val in key_set.items() if not is_wildcard(val)]
+
+def expand_key_set(key_set, limit=None):
+    """
+    Split a key_set containing one_of() values into plain key_sets, one for
+    each combination of values. If there would be more than limit of them,
+    the one_of() values are replaced by wildcards instead.
+    """
+    multi = [(key, val.values) for key,val in key_set.items() if is_one_of(val)]
+    if not multi:
+        return [key_set]
+    count = 1
+    for key, values in multi:
+        count *= len(values)
+    if limit is not None and count > limit:
+        rounded = dict(key_set)
+        for key, values in multi:
+            rounded[key] = wildcard
+        return [rounded]
+    key_sets = [dict(key_set)]
+    for key, values in multi:
+        key_sets = [dict(ks, **{key: val}) for ks in key_sets for val in values]
+    return key_sets
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from esp.cache.registry import warmable_caches
+from esp.program.models import Program
+
+import time
+
+
+class Command(BaseCommand):
+    args = '<program id or url>'
+    help = """Fill in the caches a program needs (catalog, section capacities
+and enrollments, timeslots, JSON data views, ...) ahead of time, e.g. when
+registration opens or after a deploy has flushed memcached.  Reports how long
+each one took."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--only', action='append', dest='only', default=[],
+                    help='Only warm caches whose name contains this string; may be given more than once.'),
+        make_option('--list', action='store_true', dest='list', default=False,
+                    help='List the caches that can be warmed, and exit.'),
+    )
+
+    def handle(self, *args, **options):
+        caches = warmable_caches()
+        if options['only']:
+            caches = [c for c in caches if any(s in c.name for s in options['only'])]
+
+        if options['list']:
+            for cache_obj in caches:
+                self.stdout.write('%s\n' % cache_obj.pretty_name)
+            return
+
+        if len(args) != 1:
+            raise CommandError('Please specify exactly one program, by id or url (e.g. Splash/2013_Fall).')
+        program = self.get_program(args[0])
+
+        total = 0.0
+        for cache_obj in caches:
+            start = time.time()
+            try:
+                cache_obj.warmer(program)
+            except Exception, e:
+                self.stderr.write('%-80s failed: %s\n' % (cache_obj.pretty_name, e))
+                continue
+            elapsed = time.time() - start
+            total += elapsed
+            self.stdout.write('%-80s %8.3fs\n' % (cache_obj.pretty_name, elapsed))
+        self.stdout.write('Warmed %d caches for %s in %.3fs\n' % (len(caches), program.niceName(), total))
+
+    def get_program(self, name):
+        try:
+            if name.isdigit():
+                return Program.objects.get(id=int(name))
+            return Program.objects.get(url=name)
+        except Program.DoesNotExist:
+            raise CommandError('No program found matching "%s".' % name)
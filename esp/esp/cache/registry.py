@@ -35,7 +35,7 @@ Learning Unlimited, Inc.
 
 from django.conf import settings
 
-__all__ = ['register_cache', 'cache_by_uid', 'dump_all_caches', 'caches_locked']
+__all__ = ['register_cache', 'cache_by_uid', 'dump_all_caches', 'caches_locked', 'warmable_caches']
 
 all_caches = {}
 
@@ -49,6 +49,10 @@ def dump_all_caches():
     for c in all_caches.values():
         c.delete_all()
 
+def warmable_caches():
+    """ Returns the caches that can be filled in for a program ahead of time. """
+    return sorted([c for c in all_caches.values() if c.warmer is not None], key=lambda c: c.name)
+
 def _finalize_caches():
     for c in all_caches.values():
         c.run_all_delayed()
@@ -0,0 +1,101 @@
+""" Request-local memo in front of ArgCache lookups. """
+__author__    = "Individual contributors (see AUTHORS file)"
+__date__      = "$DATE$"
+__rev__       = "$REV$"
+__license__   = "AGPL v.3"
+__copyright__ = """
+This file is part of the ESP Web Site
+Copyright (c) 2009 by the individual contributors
+  (see AUTHORS file)
+
+The ESP Web Site is free software; you can redistribute it and/or
+modify it under the terms of the GNU Affero General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public
+License along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Contact information:
+MIT Educational Studies Program
+  84 Massachusetts Ave W20-467, Cambridge, MA 02139
+  Phone: 617-253-4882
+  Email: esp-webmasters@mit.edu
+Learning Unlimited, Inc.
+  527 Franklin St, Cambridge, MA 02139
+  Phone: 617-379-0178
+  Email: web-team@lists.learningu.org
+"""
+
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+__all__ = ['start_request', 'end_request', 'memo_get', 'memo_set', 'memo_clear']
+
+# Within one request, the same cached function is often called with the same
+# arguments dozens of times (think ESPUser.getGrade or Tag.getTag while
+# rendering a catalog).  While a request is active, ArgCache remembers what
+# it read from or wrote to memcached here, so that repeated lookups don't
+# need a round trip.
+#
+# Values are kept pickled, so each lookup hands back a fresh copy, just as a
+# memcached lookup would; callers that modify the objects they get back won't
+# affect each other.
+#
+# Outside of a request (management commands, cron jobs, the shell), nothing is
+# memoized.
+
+_threading_local = threading.local()
+
+def _memo():
+    return getattr(_threading_local, 'memo', None)
+
+def start_request():
+    """ Start memoizing lookups for the current thread. """
+    _threading_local.memo = {}
+
+def end_request():
+    """ Throw away everything memoized for the current thread. """
+    _threading_local.memo = None
+
+def memo_get(uid, key):
+    """ Return the memoized value of key for the cache with this uid, or None. """
+    memo = _memo()
+    if memo is None:
+        return None
+    pickled = memo.get(uid, {}).get(key, None)
+    if pickled is None:
+        return None
+    return pickle.loads(pickled)
+
+def memo_set(uid, key, value):
+    """ Memoize value at key for the cache with this uid. """
+    memo = _memo()
+    if memo is None or value is None:
+        return
+    try:
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # Not worth failing over; we just won't memoize this one.
+        return
+    memo.setdefault(uid, {})[key] = pickled
+
+def memo_clear(uid):
+    """ Forget everything memoized for the cache with this uid.
+
+    We don't try to figure out exactly which keys an invalidation affects;
+    the memo only lives for one request, so dropping the whole cache's share
+    of it is cheap and obviously correct. """
+    memo = _memo()
+    if memo is not None:
+        memo.pop(uid, None)
@@ -0,0 +1,495 @@
+"""
+Test cases for the ArgCache machinery
+"""
+
+import random
+import string
+import threading
+import time
+import unittest
+
+from django.core.cache import get_cache
+
+from esp.cache import registry
+from esp.cache.argcache import ArgCache, cache_function
+from esp.cache.key_set import wildcard, one_of
+from esp.cache.request_memo import start_request, end_request
+from esp.cache.batch import batched_invalidations, start_batch, discard_batch, queue_callback
+
+class CountingCache(object):
+    """ Wraps a cache backend and counts the calls made to it. """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if not callable(attr):
+            return attr
+        def counted(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return attr(*args, **kwargs)
+        return counted
+
+    def count(self, name=None):
+        if name is None:
+            return sum(self.calls.values())
+        return self.calls.get(name, 0)
+
+    def reset(self):
+        self.calls = {}
+
+def unique_name(prefix):
+    return prefix + ''.join(random.sample(string.letters + string.digits, 16))
+
+def _make(cache_class, *args, **kwargs):
+    """ Make a new ArgCache over a private locmem backend.
+
+    Caches are normally created when the server starts up; ArgCache complains
+    (and flushes itself) if one shows up later, so we briefly pretend that
+    start-up hasn't finished yet. """
+    backend = CountingCache(get_cache('django.core.cache.backends.locmem.LocMemCache', LOCATION=unique_name('argcache_test_')))
+    old_locked = registry._caches_locked
+    registry._caches_locked = False
+    try:
+        cache_obj = cache_class(cache=backend, *args, **kwargs)
+    finally:
+        registry._caches_locked = old_locked
+    return cache_obj, backend
+
+def make_cache(params, **kwargs):
+    return _make(ArgCache, unique_name('test_cache_'), params, **kwargs)
+
+def make_cached_function(func, **kwargs):
+    return _make(cache_function, func, uid_extra=unique_name('_'), **kwargs)
+
+class RequestMemoTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_obj, self.backend = make_cache(('a', 'b'))
+        self.cache_obj.get_or_create_token(('a',))
+        start_request()
+
+    def tearDown(self):
+        end_request()
+
+    def test_repeated_get(self):
+        self.cache_obj.set((1, 2), [1, 2, 3])
+        self.backend.reset()
+        for i in range(10):
+            self.assertEqual(self.cache_obj.get((1, 2)), [1, 2, 3])
+        self.assertEqual(self.backend.count('get_many'), 0)
+
+    def test_copies(self):
+        self.cache_obj.set((1, 2), [1, 2, 3])
+        self.cache_obj.get((1, 2)).append(4)
+        self.assertEqual(self.cache_obj.get((1, 2)), [1, 2, 3])
+
+    def test_invalidation(self):
+        self.cache_obj.set((1, 2), 'x')
+        self.cache_obj.set((3, 4), 'y')
+        self.assertEqual(self.cache_obj.get((1, 2)), 'x')
+        self.cache_obj.delete_key_set(a=1)
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+        self.assertEqual(self.cache_obj.get((3, 4)), 'y')
+        self.cache_obj.delete((3, 4))
+        self.assertEqual(self.cache_obj.get((3, 4)), None)
+        self.cache_obj.set((3, 4), 'z')
+        self.cache_obj.delete_all()
+        self.assertEqual(self.cache_obj.get((3, 4)), None)
+
+    def test_outside_request(self):
+        end_request()
+        self.cache_obj.set((1, 2), 'x')
+        self.backend.reset()
+        self.assertEqual(self.cache_obj.get((1, 2)), 'x')
+        self.assertEqual(self.cache_obj.get((1, 2)), 'x')
+        self.assertEqual(self.backend.count('get_many'), 2)
+
+class HashTokensTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_obj, self.backend = make_cache(('a', 'b'), hash_tokens=True)
+        self.cache_obj.get_or_create_token(('a',))
+        self.cache_obj.get_or_create_token(('b',))
+
+    def test_stored_value(self):
+        self.cache_obj.set((1, 2), 'x')
+        wrapped_value = self.backend.get(self.cache_obj.key((1, 2)))
+        self.assertEqual(len(wrapped_value), 2)
+        self.assertEqual(wrapped_value[0], 'x')
+
+    def test_invalidation(self):
+        self.cache_obj.set((1, 2), 'x')
+        self.cache_obj.set((1, 3), 'y')
+        self.cache_obj.set((2, 3), 'z')
+        self.assertEqual(self.cache_obj.get((1, 2)), 'x')
+        self.cache_obj.delete_key_set(a=1)
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+        self.assertEqual(self.cache_obj.get((1, 3)), None)
+        self.assertEqual(self.cache_obj.get((2, 3)), 'z')
+        self.cache_obj.delete_key_set(b=3)
+        self.assertEqual(self.cache_obj.get((2, 3)), None)
+
+    def test_mode_change(self):
+        """ Values stored in one mode are never accepted by the other. """
+        self.cache_obj.set((1, 2), 'x')
+        self.cache_obj.hash_tokens = False
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+        self.cache_obj.set((1, 2), 'x')
+        self.cache_obj.hash_tokens = True
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+
+class VersionTest(unittest.TestCase):
+    def test_version(self):
+        """ Values stored under one version are never read by another. """
+        cache_obj, backend = make_cache(('a',), version=1)
+        cache_obj.set((1,), 'x')
+        cache_obj.version = 2
+        self.assertEqual(cache_obj.get((1,)), None)
+        cache_obj.set((1,), 'y')
+        cache_obj.version = 1
+        self.assertEqual(cache_obj.get((1,)), 'x')
+
+    def test_decorator(self):
+        func, backend = make_cached_function(lambda x: x, version=3)
+        self.assertEqual(func.version, 3)
+        self.assertTrue('|v3|' in func.key([1]))
+
+    def test_delete_all(self):
+        cache_obj, backend = make_cache(('a', 'b'))
+        cache_obj.get_or_create_token(('a',))
+        for i in range(10):
+            cache_obj.set((i, i), i)
+        backend.reset()
+        cache_obj.delete_all()
+        self.assertEqual(backend.count('delete') + backend.count('delete_many'), 1)
+        for i in range(10):
+            self.assertEqual(cache_obj.get((i, i)), None)
+
+    def test_bump_version(self):
+        cache_obj, backend = make_cache(('a', 'b'))
+        dependent, dependent_backend = make_cache(('c',))
+        dependent.depend_on_cache(cache_obj, lambda **kwargs: {})
+        dependent.run_all_delayed()
+        for i in range(10):
+            cache_obj.set((i, i), i)
+        dependent.set((1,), 'z')
+        backend.reset()
+        cache_obj.bump_version()
+        self.assertEqual(backend.count('incr'), 1)
+        self.assertEqual(backend.count('delete') + backend.count('delete_many'), 0)
+        for i in range(10):
+            self.assertEqual(cache_obj.get((i, i)), None)
+        self.assertEqual(dependent.get((1,)), None)
+
+        #   New values are good again
+        cache_obj.set((1, 1), 'x')
+        self.assertEqual(cache_obj.get((1, 1)), 'x')
+
+class CallManyTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def square(x, offset=0):
+            self.calls.append(x)
+            return x * x + offset
+        self.func, self.backend = make_cached_function(square)
+
+    def test_call_many(self):
+        self.assertEqual(self.func(2), 4)
+        self.assertEqual(self.func(3), 9)
+        self.calls = []
+        self.backend.reset()
+
+        self.assertEqual(self.func.call_many([(x,) for x in range(6)]), [0, 1, 4, 9, 16, 25])
+        self.assertEqual(sorted(self.calls), [0, 1, 4, 5])
+        self.assertEqual(self.backend.count('get_many'), 2) # one to look up, one to read tokens for the misses
+        self.assertEqual(self.backend.count('set_many'), 1)
+
+        #   Everything is cached now
+        self.calls = []
+        self.assertEqual(self.func.call_many([(x,) for x in range(6)]), [0, 1, 4, 9, 16, 25])
+        self.assertEqual(self.calls, [])
+
+    def test_defaults(self):
+        """ Results are shared with ordinary calls, filling in default arguments. """
+        self.func.call_many([(1,), (1, 10)])
+        self.calls = []
+        self.assertEqual(self.func(1), 1)
+        self.assertEqual(self.func(1, offset=10), 11)
+        self.assertEqual(self.calls, [])
+
+class BatchedInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_obj, self.backend = make_cache(('a', 'b'))
+        self.cache_obj.get_or_create_token(('a',))
+        self.dependent, self.dependent_backend = make_cache(('c',))
+        self.dependent.depend_on_cache(self.cache_obj, lambda a=wildcard, **kwargs: {'c': a})
+        self.dependent.run_all_delayed()
+
+    def test_coalesce(self):
+        self.cache_obj.set((1, 2), 'x')
+        self.cache_obj.set((2, 2), 'y')
+        self.dependent.set((1,), 'z')
+        self.backend.reset()
+        self.dependent_backend.reset()
+
+        with batched_invalidations():
+            for i in range(1000):
+                self.cache_obj.delete_key_set(a=1)
+            #   Nothing has been deleted yet, but lookups already miss
+            self.assertEqual(self.backend.count('delete') + self.backend.count('delete_many'), 0)
+            self.assertEqual(self.cache_obj.get((1, 2)), None)
+            self.assertEqual(self.dependent.get((1,)), None)
+            self.assertEqual(self.cache_obj.get((2, 2)), 'y')
+
+        self.assertEqual(self.backend.count('delete') + self.backend.count('delete_many'), 1)
+        self.assertEqual(self.dependent_backend.count('delete') + self.dependent_backend.count('delete_many'), 1)
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+        self.assertEqual(self.dependent.get((1,)), None)
+        self.assertEqual(self.cache_obj.get((2, 2)), 'y')
+
+    def test_many_keys(self):
+        for i in range(10):
+            self.cache_obj.set((i, 0), i)
+        self.backend.reset()
+
+        with batched_invalidations():
+            with batched_invalidations():
+                for i in range(10):
+                    self.cache_obj.delete_key_set(a=i)
+                    self.cache_obj.delete_key_set(a=i)
+            #   The inner batch doesn't flush
+            self.assertEqual(self.backend.count('delete_many'), 0)
+
+        self.assertEqual(self.backend.count('delete'), 0)
+        self.assertEqual(self.backend.count('delete_many'), 1)
+        for i in range(10):
+            self.assertEqual(self.cache_obj.get((i, 0)), None)
+
+    def test_set_inside_batch(self):
+        """ Values recomputed inside the batch are not trusted afterwards. """
+        self.cache_obj.set((1, 2), 'x')
+        with batched_invalidations():
+            self.cache_obj.delete_key_set(a=1)
+            self.cache_obj.set((1, 2), 'y')
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+
+    def test_repeated_invalidation_with_memo(self):
+        """ Invalidating the same key set twice in a batch still drops a value
+        recomputed (and memoized) in between. """
+        start_request()
+        try:
+            self.cache_obj.set((1, 2), 'x')
+            self.dependent.set((1,), 'z')
+            with batched_invalidations():
+                self.cache_obj.delete_key_set(a=1)
+                self.assertEqual(self.cache_obj.get((1, 2)), None)
+                self.assertEqual(self.dependent.get((1,)), None)
+                self.cache_obj.set((1, 2), 'y')
+                self.dependent.set((1,), 'w')
+                self.assertEqual(self.cache_obj.get((1, 2)), 'y')
+                self.assertEqual(self.dependent.get((1,)), 'w')
+                self.cache_obj.delete_key_set(a=1)
+                self.assertEqual(self.cache_obj.get((1, 2)), None)
+                self.assertEqual(self.dependent.get((1,)), None)
+        finally:
+            end_request()
+
+    def test_discard_leftover(self):
+        """ A batch whose end was never reached doesn't swallow later
+        invalidations. """
+        self.cache_obj.set((1, 2), 'x')
+        self.cache_obj.set((2, 2), 'y')
+        start_batch()
+        self.cache_obj.delete_key_set(a=1)
+        #   ... and end_batch() never gets called.
+        discard_batch()
+        self.assertEqual(self.cache_obj.get((1, 2)), None)
+        self.backend.reset()
+        self.cache_obj.delete_key_set(a=2)
+        self.assertEqual(self.backend.count('delete'), 1)
+        self.assertEqual(self.cache_obj.get((2, 2)), None)
+
+    def test_callbacks(self):
+        """ Callbacks run at the end of the batch, after its deletes. """
+        self.cache_obj.set((1, 2), 'x')
+        self.backend.reset()
+        calls = []
+        with batched_invalidations():
+            self.cache_obj.delete_key_set(a=1)
+            queue_callback(lambda: calls.append(self.backend.count('delete') + self.backend.count('delete_many')))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [1])
+        #   Outside a batch, they run right away
+        queue_callback(lambda: calls.append(2))
+        self.assertEqual(calls, [1, 2])
+
+class OneOfTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_obj, self.backend = make_cache(('a', 'b'))
+        self.cache_obj.get_or_create_token(('a', 'b'))
+        self.dependent, self.dependent_backend = make_cache(('c',))
+        self.dependent.get_or_create_token(('c',))
+        self.dependent.depend_on_cache(self.cache_obj, lambda a=wildcard, **kwargs: {'c': a})
+        self.dependent.run_all_delayed()
+        for i in range(5):
+            for j in range(5):
+                self.cache_obj.set((i, j), i * j)
+            self.dependent.set((i,), i)
+
+    def test_narrow(self):
+        """ Only the listed keys go, though there's no (b) token to use. """
+        self.cache_obj.delete_key_set(a=one_of([1, 3]), b=2)
+        for i in range(5):
+            for j in range(5):
+                if i in [1, 3] and j == 2:
+                    self.assertEqual(self.cache_obj.get((i, j)), None)
+                else:
+                    self.assertEqual(self.cache_obj.get((i, j)), i * j)
+        #   Dependents are told about each piece separately
+        self.assertEqual([self.dependent.get((i,)) for i in range(5)], [0, None, 2, None, 4])
+
+    def test_range(self):
+        self.cache_obj.delete_key_set(a=one_of(xrange(1, 4)), b=one_of(xrange(1, 4)))
+        remaining = [(i, j) for i in range(5) for j in range(5) if self.cache_obj.get((i, j)) is not None]
+        self.assertEqual(len(remaining), 25 - 9)
+
+    def test_empty(self):
+        self.cache_obj.delete_key_set(a=one_of([]), b=1)
+        self.assertEqual(self.cache_obj.get((1, 1)), 1)
+
+class StatsTest(unittest.TestCase):
+    def test_stats(self):
+        func, backend = make_cached_function(lambda x: range(x))
+        dependent, dependent_backend = make_cache(('y',))
+        dependent.depend_on_cache(func, lambda x=wildcard, **kwargs: {'y': x})
+        dependent.run_all_delayed()
+
+        for i in range(20):
+            func(100)
+        func.delete_key_set(x=100)
+        func.delete_key_set(x=5)
+
+        stats = func.stats()
+        self.assertEqual(stats['hit_count'], 19)
+        self.assertEqual(stats['miss_count'], 1)
+        self.assertTrue(stats['compute_time'] >= 0)
+        self.assertTrue(stats['cache_time'] > 0)
+        self.assertTrue(stats['avg_value_size'] > 100)
+
+        stats = dependent.stats()
+        self.assertEqual(stats['invalidation_counts'], {'cache %s' % func.name: 2})
+        self.assertEqual(stats['invalidation_count'], 2)
+
+class WarmerTest(unittest.TestCase):
+    def test_warmable_caches(self):
+        calls = []
+        def compute(program):
+            calls.append(program)
+            return program
+        func, backend = make_cached_function(compute)
+        self.assertFalse(func in registry.warmable_caches())
+        func.set_warmer(func)
+        self.assertTrue(func in registry.warmable_caches())
+
+        func.warmer(1)
+        func(1)
+        self.assertEqual(calls, [1])
+
+class StampedeTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+    def run_threads(self, func, n=8):
+        results = []
+        def call():
+            try:
+                results.append(func(1))
+            except ValueError:
+                pass
+        threads = [threading.Thread(target=call) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_computed_once(self):
+        def slow(x):
+            with self.calls_lock:
+                self.calls.append(x)
+            time.sleep(0.3)
+            return x + 1
+        func, backend = make_cached_function(slow, use_leases=True)
+
+        self.assertEqual(self.run_threads(func), [2] * 8)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(func.lease_wait_count, 7)
+        self.assertEqual(backend.get(func._lease_key([1])), None)
+
+    def test_none_computed_once(self):
+        """ A result of None is cached too, so waiters don't each compute it
+        again in turn. """
+        def slow_none(x):
+            with self.calls_lock:
+                self.calls.append(x)
+            time.sleep(0.3)
+            return None
+        func, backend = make_cached_function(slow_none, use_leases=True)
+
+        self.assertEqual(self.run_threads(func, n=4), [None] * 4)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(func(1), None)
+        self.assertEqual(func.call_many([(1,)]), [None])
+        self.assertEqual(self.calls, [1])
+
+    def test_holder_fails(self):
+        """ If the process holding the lease dies, someone else takes over
+        instead of everyone waiting out the lease. """
+        def flaky(x):
+            with self.calls_lock:
+                self.calls.append(x)
+                first = (len(self.calls) == 1)
+            time.sleep(0.1)
+            if first:
+                raise ValueError
+            return x + 1
+        func, backend = make_cached_function(flaky, use_leases=True)
+
+        start = time.time()
+        results = self.run_threads(func, n=4)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(results, [2] * 3)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_holder_stuck(self):
+        """ If the process holding the lease never finishes or releases it,
+        the others only wait lease_max_wait seconds before computing the
+        value themselves. """
+        def fast(x):
+            with self.calls_lock:
+                self.calls.append(x)
+            return x + 1
+        func, backend = make_cached_function(fast, use_leases=True, lease_max_wait=0.5)
+        backend.add(func._lease_key([1]), 1, func.lease_timeout)
+
+        start = time.time()
+        self.assertEqual(func(1), 2)
+        self.assertTrue(0.5 <= time.time() - start < 2)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(func.lease_wait_count, 1)
+        #   ... and the value it computed is cached for everyone else
+        self.assertEqual(func(1), 2)
+        self.assertEqual(self.calls, [1])
+
+    def test_without_leases(self):
+        def slow(x):
+            with self.calls_lock:
+                self.calls.append(x)
+            time.sleep(0.1)
+            return x + 1
+        func, backend = make_cached_function(slow)
+
+        self.assertEqual(self.run_threads(func, n=4), [2] * 4)
+        self.assertEqual(self.calls, [1] * 4)
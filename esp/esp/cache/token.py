@@ -41,6 +41,8 @@ from django.dispatch import Signal
 
 from esp.cache.marinade import marinade_dish
 from esp.cache.key_set import has_wildcard, wildcard, specifies_key
+from esp.cache.request_memo import memo_clear
+from esp.cache.batch import queue_delete
 from esp.middleware import ESPError
 
 __all__ = ['Token', 'ExternalToken']
@@ -117,13 +119,30 @@ class Token(object):
         # Check if this is a single item...
         if has_wildcard(filt):
             raise ESPError(), "Tried to delete an argument set with a wildcard."
-        self.cache.delete(self.key_filt(filt))
+        queue_delete(self.cache, self.key_filt(filt))
+        memo_clear(self.cache_obj.uid)
         # Send the signal...
         if send_signal:
             key_set = self.key_set_from_filt(filt)
             self.cache_obj.send(key_set=key_set)
     delete_filt.alters_data = True
 
+    def bump_filt(self, filt, send_signal=True):
+        """ Like delete_filt, but increments the token in place, so that there
+        is never a moment when it is missing and someone else recreates it. """
+        if has_wildcard(filt):
+            raise ESPError(), "Tried to bump an argument set with a wildcard."
+        try:
+            self.cache.incr(self.key_filt(filt))
+        except ValueError:
+            # No token, so nothing can have been stored against it
+            pass
+        memo_clear(self.cache_obj.uid)
+        if send_signal:
+            key_set = self.key_set_from_filt(filt)
+            self.cache_obj.send(key_set=key_set)
+    bump_filt.alters_data = True
+
     def value_args(self, args):
         """ Returns a token value, based on function arguments. """
         return self.value_filt(self._filter_args(args))
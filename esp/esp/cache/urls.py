@@ -2,5 +2,7 @@ from django.conf.urls.defaults import *
 
 urlpatterns = patterns('',
                         (r'^view_all/?$', 'esp.cache.views.view_all'),
+                        (r'^view_all\.json$', 'esp.cache.views.view_all_json'),
+                        (r'^flush$', 'esp.cache.views.flush'),
                         (r'^varnish_purge$', 'esp.cache.views.varnish_purge'),
                         )
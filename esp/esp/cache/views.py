@@ -33,18 +33,41 @@ Learning Unlimited, Inc.
   Email: web-team@lists.learningu.org
 """
 
-from esp.cache.registry import all_caches
+from esp.cache.registry import all_caches, cache_by_uid
 from esp.users.models import admin_required, ESPUser
 from esp.web.util.main import render_to_response
 from esp.cache.varnish import purge_page
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed, Http404
+import simplejson as json
+
+def _cache_stats():
+    caches = sorted(all_caches.values(), key=lambda c: c.name)
+    return [cache.stats() for cache in caches]
 
 @admin_required
 def view_all(request):
-    caches = sorted(all_caches.values(), key=lambda c: c.name)
-    cache_data = [{'pretty_name': cache.pretty_name, 'hit_count': cache.hit_count, 'miss_count': cache.miss_count} for cache in caches]
+    cache_data = _cache_stats()
+    for stats in cache_data:
+        stats['invalidation_counts'] = sorted(stats['invalidation_counts'].items())
     return render_to_response('cache/view_all.html', request, {'caches': cache_data})
 
+@admin_required
+def view_all_json(request):
+    """ The statistics shown by view_all, as JSON. """
+    return HttpResponse(json.dumps({'caches': _cache_stats()}), mimetype='application/json')
+
+@admin_required
+def flush(request):
+    """ Dump everything in one cache, given its uid, by bumping its global
+    token. """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    cache_obj = cache_by_uid(request.POST.get('uid', ''))
+    if cache_obj is None:
+        raise Http404
+    cache_obj.bump_version()
+    return HttpResponseRedirect('/cache/view_all')
+
 def varnish_purge(request):
     # Authenticate
     if (not request.user or not request.user.is_authenticated() or not ESPUser(request.user).isAdministrator()):
@@ -74,6 +74,15 @@ DISPLAYSQL = False
 TEMPLATE_DEBUG = False
 SHOW_TEMPLATE_ERRORS = False
 CACHE_DEBUG = False
+# Memoize ArgCache lookups for the duration of each request
+CACHE_REQUEST_MEMO = True
+# Store a single digest of an ArgCache entry's tokens instead of all of them
+CACHE_HASH_TOKENS = False
+# Coalesce the cache invalidations made while handling each request
+CACHE_BATCH_INVALIDATIONS = True
+# Let cache_functions with use_leases=True have only one process at a time
+# recompute a missing value
+CACHE_STAMPEDE_LEASES = True
 
 INTERNAL_IPS = (
     '127.0.0.1',
@@ -161,6 +170,8 @@ TEMPLATE_LOADERS = (
 # Set MIDDLEWARE_LOCAL in local_settings.py to configure this
 MIDDLEWARE_GLOBAL = [
     ( 100, 'esp.middleware.threadlocalrequest.ThreadLocals'),
+    ( 140, 'esp.middleware.batchinvalidationmiddleware.BatchInvalidationMiddleware'),
+    ( 150, 'esp.middleware.requestmemomiddleware.RequestMemoMiddleware'),
    #( 100, 'django.middleware.http.SetRemoteAddrFromForwardedFor'),
    #( 200, 'esp.queue.middleware.QueueMiddleware'),
     ( 300, 'esp.middleware.FixIEMiddleware'),
@@ -173,7 +184,7 @@ MIDDLEWARE_GLOBAL = [
     (1000, 'esp.middleware.espauthmiddleware.ESPAuthMiddleware'),
     (1050, 'django.middleware.csrf.CsrfViewMiddleware'),
     (1100, 'django.middleware.doc.XViewMiddleware'),
-    (1200, 'django.middleware.gzip.GZipMiddleware'),
+    (1200, 'esp.middleware.gzipmiddleware.ESPGZipMiddleware'),
     (1250, 'esp.middleware.espdebugtoolbarmiddleware.ESPDebugToolbarMiddleware'),
     (1300, 'esp.middleware.PrettyErrorEmailMiddleware'),
     (1400, 'esp.middleware.StripWhitespaceMiddleware'),
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from esp.cache.batch import start_batch, end_batch, discard_batch
+
+class BatchInvalidationMiddleware(object):
+    """
+    Coalesces the cache invalidations made while handling a request (see
+    esp.cache.batch), so that a view saving many rows deletes each affected
+    cache token once, in one delete_many, instead of once per row.
+
+    This should come before TransactionMiddleware, so that the invalidations
+    are flushed after the transaction has been committed.
+
+    Set CACHE_BATCH_INVALIDATIONS = False in local_settings.py to turn it off.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'CACHE_BATCH_INVALIDATIONS', True):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        #   Don't nest inside a batch left over from an earlier request whose
+        #   process_response never ran; it would never be flushed.
+        discard_batch()
+        start_batch()
+        request._batching_invalidations = True
+
+    def process_response(self, request, response):
+        #   Django calls this even if the view raised an exception, but may
+        #   also call it when process_request wasn't.
+        if getattr(request, '_batching_invalidations', False):
+            request._batching_invalidations = False
+            end_batch()
+        return response
@@ -0,0 +1,15 @@
+from django.middleware.gzip import GZipMiddleware
+
+class ESPGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware, except that it leaves streaming responses alone.
+
+    Django 1.4's GZipMiddleware reads response.content, which would build the
+    whole of a response that a view returns as an iterator before sending any
+    of it.  Views that want their responses streamed set response.streaming
+    = True, as StreamingHttpResponse does in later versions of Django.
+    """
+    def process_response(self, request, response):
+        if getattr(response, 'streaming', False):
+            return response
+        return super(ESPGZipMiddleware, self).process_response(request, response)
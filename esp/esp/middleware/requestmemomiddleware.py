@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from esp.cache.request_memo import start_request, end_request
+
+class RequestMemoMiddleware(object):
+    """
+    Keeps a per-request memo of ArgCache lookups (see esp.cache.request_memo),
+    so that calling the same cached function with the same arguments many
+    times while handling one request only costs one memcached round trip.
+
+    Set CACHE_REQUEST_MEMO = False in local_settings.py to turn it off.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'CACHE_REQUEST_MEMO', True):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        start_request()
+
+    def process_response(self, request, response):
+        end_request()
+        return response
+
+    def process_exception(self, request, exception):
+        end_request()
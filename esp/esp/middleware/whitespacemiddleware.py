@@ -8,6 +8,9 @@ class StripWhitespaceMiddleware:
     Strips leading and trailing whitespace from response content.
     """
     def process_response(self, request, response):
+        #   Don't build streaming responses (see ESPGZipMiddleware)
+        if getattr(response, 'streaming', False):
+            return response
         if("text" in response['Content-Type'] ):
             new_content = response.content.strip()
             response.content = new_content
@@ -1,556 +1,818 @@
-__author__    = "Individual contributors (see AUTHORS file)"
-__date__      = "$DATE$"
-__rev__       = "$REV$"
-__license__   = "AGPL v.3"
-__copyright__ = """
-This file is part of the ESP Web Site
-Copyright (c) 2012 by the individual contributors
-  (see AUTHORS file)
-
-The ESP Web Site is free software; you can redistribute it and/or
-modify it under the terms of the GNU Affero General Public License
-as published by the Free Software Foundation; either version 3
-of the License, or (at your option) any later version.
-
-This program is distributed in the hope that it will be useful,
-but WITHOUT ANY WARRANTY; without even the implied warranty of
-MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-GNU Affero General Public License for more details.
-
-You should have received a copy of the GNU Affero General Public
-License along with this program; if not, write to the Free Software
-Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
-
-Contact information:
-MIT Educational Studies Program
-  84 Massachusetts Ave W20-467, Cambridge, MA 02139
-  Phone: 617-253-4882
-  Email: esp-webmasters@mit.edu
-Learning Unlimited, Inc.
-  527 Franklin St, Cambridge, MA 02139
-  Phone: 617-379-0178
-  Email: web-team@lists.learningu.org
-"""
-
-import numpy
-assert numpy.version.short_version >= "1.7.0"
-
-import numpy.random
-
-from datetime import date, datetime
-
-from esp.cal.models import Event
-from esp.users.models import ESPUser, StudentInfo
-from esp.program.models import StudentRegistration, RegistrationType, RegistrationProfile, ClassSection
-from esp.program.models.class_ import ClassCategories
-from esp.mailman import add_list_member, remove_list_member, list_contents
-
-from django.conf import settings
-import os
-
-class LotteryAssignmentController(object):
-
-    default_options = {
-        'Kp': 1.2,
-        'Ki': 1.1,
-        'check_grade': True,
-        'stats_display': False,
-        'directory': os.getenv("HOME"),
-    }
-    
-    def __init__(self, program, **kwargs):
-        """ Set constant parameters for a lottery assignment. """
-        
-        if 'lotteried_students' not in program.students():
-            raise Exception('Cannot retrive lottery preferences for program, please ensure that it has the lottery module.')
-
-        self.program = program
-        self.num_timeslots = len(self.program.getTimeSlots())
-        self.num_students = self.program.students()['lotteried_students'].count()
-        self.num_sections = len(self.program.sections().filter(status__gt=0, registration_status=0))
-        
-        self.options = LotteryAssignmentController.default_options.copy()
-        self.options.update(kwargs)
-        
-        numpy.random.seed(datetime.now().microsecond)
-        
-        self.initialize()
-        
-        if self.options['stats_display']: 
-            print 'Initialized lottery assignment for %d students, %d sections, %d timeslots' % (self.num_students, self.num_sections, self.num_timeslots)
-        
-    def get_index_array(self, arr):
-        """ Given an array of arbitrary integers, create a new array that maps 
-            the values back to their indices.  Invalid entries are stored as -1.
-            For example:            arr = [1, 6, 5, 3]
-                -> get_index_array(arr) = [-1, 0, -1, 3, -1, 2, 1]
-        """
-        
-        max_index = numpy.max(arr)
-        index_arr = -numpy.ones((max_index + 1,), dtype=numpy.int32)
-        for i in range(arr.shape[0]):
-            index_arr[arr[i]] = i
-        return index_arr
-        
-    def get_ids(self, qs):
-        """ Get an array of the IDs of the objects stored in the QuerySet qs. """
-        
-        return numpy.array(qs.order_by('id').values_list('id', flat=True))
-        
-    def get_ids_and_indices(self, qs):
-        """ Get a tuple of the IDs and lookup indices of the objects stored in the QuerySet qs. """
-        
-        a1 = numpy.array(qs.order_by('id').values_list('id', flat=True))
-        a2 = self.get_index_array(a1)
-        return (a1, a2)
-        
-    def clear_assignments(self):
-        """ Reset the state of the controller so that new assignments may be computed,
-            but without fetching any information from the database. """
-            
-        self.student_schedules = numpy.zeros((self.num_students, self.num_timeslots), dtype=numpy.bool)
-        self.student_sections = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
-        self.student_weights = numpy.ones((self.num_students,))
-
-    def initialize(self):
-        """ Gather all of the information needed to run the lottery assignment.
-            This includes:
-            -   Students' interest (priority and interested bits)
-            -   Class schedules and capacities
-            -   Timeslots (incl. lunch periods for each day)
-        """
-        
-        self.interest = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
-        self.priority = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
-        self.section_schedules = numpy.zeros((self.num_sections, self.num_timeslots), dtype=numpy.bool)
-        self.section_capacities = numpy.zeros((self.num_sections,), dtype=numpy.uint32)
-        self.section_overlap = numpy.zeros((self.num_sections, self.num_sections), dtype=numpy.bool)
-        
-        # One array to keep track of the utility of each student
-        # (defined as hours of interested class + 1.5*hours of priority classes)
-        # and the other arrary to keep track of student weigths (defined as # of classes signed up for)
-        self.student_utility_weights = numpy.zeros((self.num_students, ), dtype=numpy.float)
-        self.student_utilities = numpy.zeros((self.num_students, ), dtype=numpy.float)
-
-        #   Get student, section, timeslot IDs and prepare lookup table
-        (self.student_ids, self.student_indices) = self.get_ids_and_indices(self.program.students()['lotteried_students'])
-        (self.section_ids, self.section_indices) = self.get_ids_and_indices(self.program.sections().filter(status__gt=0, registration_status=0))
-        (self.timeslot_ids, self.timeslot_indices) = self.get_ids_and_indices(self.program.getTimeSlots())
-        
-        #   Get IDs of timeslots allocated to lunch by day
-        #   (note: requires that this is constant across days)
-        self.lunch_schedule = numpy.zeros((self.num_timeslots,))
-        lunch_timeslots = Event.objects.filter(meeting_times__parent_class__parent_program=self.program, meeting_times__parent_class__category__category='Lunch').order_by('start').distinct()
-        #   Note: this code should not be necessary once lunch-constraints branch is merged (provides Program.dates())
-        dates = []
-        for ts in self.program.getTimeSlots():
-            ts_day = date(ts.start.year, ts.start.month, ts.start.day)
-            if ts_day not in dates:
-                dates.append(ts_day)
-        lunch_by_day = [[] for x in dates]
-        ts_count = 0
-        for ts in lunch_timeslots:
-            d = date(ts.start.year, ts.start.month, ts.start.day)
-            lunch_by_day[dates.index(d)].append(ts.id)
-            self.lunch_schedule[self.timeslot_indices[ts.id]] = True
-        for i in range(len(lunch_by_day)):
-            if len(lunch_by_day[i]) > ts_count:
-                ts_count = len(lunch_by_day[i])
-        self.lunch_timeslots = numpy.zeros((len(lunch_by_day), ts_count), dtype=numpy.int32)
-        for i in range(len(lunch_by_day)):
-            self.lunch_timeslots[i, :len(lunch_by_day[i])] = numpy.array(lunch_by_day[i])
-
-        #   Populate interest matrix
-        interest_regs = StudentRegistration.valid_objects().filter(section__parent_class__parent_program=self.program, relationship__name='Interested').values_list('user__id', 'section__id').distinct()
-        ira = numpy.array(interest_regs, dtype=numpy.uint32)
-        self.interest[self.student_indices[ira[:, 0]], self.section_indices[ira[:, 1]]] = True
-        
-        #   Populate priority matrix
-        priority_regs = StudentRegistration.valid_objects().filter(section__parent_class__parent_program=self.program, relationship__name='Priority/1').values_list('user__id', 'section__id').distinct()
-        pra = numpy.array(priority_regs, dtype=numpy.uint32)
-        self.priority[self.student_indices[pra[:, 0]], self.section_indices[pra[:, 1]]] = True
-        
-        #   Set student utility weights. Counts number of classes that students selected. Used only for computing the overall_utility stat
-        #   NOTE: Uses fixed (interest + priority) formula, needs attention when multiple priority levels are merged.
-        self.student_utility_weights = numpy.sum(self.interest.astype(float), 1) + numpy.sum(self.priority.astype(float), 1)
-
-        #   Populate section schedule
-        section_times = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).filter(meeting_times__id__isnull=False).distinct().values_list('id', 'meeting_times__id'))
-        self.section_schedules[self.section_indices[section_times[:, 0]], self.timeslot_indices[section_times[:, 1]]] = True
-        
-        #   Populate section overlap matrix
-        parent_classes = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).order_by('id').values_list('parent_class__id', flat=True))
-        for i in range(self.num_sections):
-            group_ids = numpy.nonzero(parent_classes == parent_classes[i])[0]
-            self.section_overlap[numpy.meshgrid(group_ids, group_ids)] = True
-
-        #   Populate section grade limits
-        self.section_grade_min = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).order_by('id').values_list('parent_class__grade_min', flat=True), dtype=numpy.uint32)
-        self.section_grade_max = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).order_by('id').values_list('parent_class__grade_max', flat=True), dtype=numpy.uint32)
-        
-        #   Populate student grades; grade will be assumed to be 0 if not entered on profile
-        self.student_grades = numpy.zeros((self.num_students,))
-        gradyear_pairs = numpy.array(RegistrationProfile.objects.filter(user__id__in=list(self.student_ids), most_recent_profile=True, student_info__graduation_year__isnull=False).values_list('user__id', 'student_info__graduation_year'), dtype=numpy.uint32)
-        self.student_grades[self.student_indices[gradyear_pairs[:, 0]]] = 12 + ESPUser.current_schoolyear() - gradyear_pairs[:, 1]
-        
-        #   Find section capacities (TODO: convert to single query)
-        for sec in self.program.sections().filter(status__gt=0, registration_status=0):
-            self.section_capacities[self.section_indices[sec.id]] = sec.capacity
-
-        # Populate section lengths (hours)
-        self.section_lengths = numpy.array([x.nonzero()[0].size for x in self.section_schedules])
-
-    
-    def fill_section(self, si, priority=False):
-        """ Assigns students to the section with index si.
-            Performs some checks along the way to make sure this didn't break anything. """
-        
-        timeslots = numpy.nonzero(self.section_schedules[si, :])[0]
-        
-        if self.options['stats_display']: print '-- Filling section %d (index %d, capacity %d, timeslots %s), priority=%s' % (self.section_ids[si], si, self.section_capacities[si], self.timeslot_ids[timeslots], priority)
-        
-        #   Compute number of spaces - exit if section or program is already full
-        num_spaces = self.section_capacities[si] - numpy.sum(self.student_sections[:, si])
-        if self.program.program_size_max:
-            program_spaces_remaining = self.program.program_size_max - numpy.sum((numpy.sum(self.student_schedules, 1) > 0))
-            num_spaces = min(num_spaces, program_spaces_remaining)
-            if num_spaces == 0:
-                if self.options['stats_display']: print '   Program was already full with %d students' % numpy.sum((numpy.sum(self.student_schedules, 1) > 0))
-                return True
-        else:
-            if num_spaces == 0:
-                if self.options['stats_display']: print '   Section was already full with %d students' % self.section_capacities[si]
-                return True
-        assert(num_spaces > 0)
-        
-        #   Assign the matrix of sign-up preferences depending on whether we are considering priority bits or not
-        if priority:
-            signup = self.priority
-            weight_factor = self.options['Kp']
-        else:
-            signup = self.interest
-            weight_factor = self.options['Ki']
-            
-        #   Check that there is at least one timeslot associated with this section
-        if timeslots.shape[0] == 0:
-            if self.options['stats_display']: print '   Section was not assigned to any timeslots, aborting'
-            return False
-            
-        #   Check that this section does not cover all lunch timeslots on any given day
-        lunch_overlap = self.lunch_schedule * self.section_schedules[si, :]
-        for i in range(self.lunch_timeslots.shape[0]):
-            if len(self.lunch_timeslots[i]) != 0 and numpy.sum(lunch_overlap[self.timeslot_indices[self.lunch_timeslots[i]]]) >= (self.lunch_timeslots.shape[1]):
-                if self.options['stats_display']: print '   Section covered all lunch timeslots %s on day %d, aborting' % (self.lunch_timeslots[i, :], i)
-                return False
-        
-        #   Get students who have indicated interest in the section
-        possible_students = numpy.copy(signup[:, si])
-        
-        #   Filter students by the section's grade limits
-        if self.options['check_grade']:
-            possible_students *= (self.student_grades >= self.section_grade_min[si])
-            possible_students *= (self.student_grades <= self.section_grade_max[si])
-            
-        #   Filter students by who has all of the section's timeslots available
-        for i in range(timeslots.shape[0]):
-            possible_students *= (True - self.student_schedules[:, timeslots[i]])
-            
-        #   Filter students by who is not already registered for a different section of the class
-        for sec_index in numpy.nonzero(self.section_overlap[:, si])[0]:
-            possible_students *= (True - self.student_sections[:, sec_index])
-            
-        #   Filter students by lunch constraint - if class overlaps with lunch period, student must have 1 additional free spot
-        #   NOTE: Currently only works with 2 lunch periods per day
-        for i in range(timeslots.shape[0]):
-            if numpy.sum(self.lunch_timeslots == self.timeslot_ids[timeslots[i]]) > 0:
-                lunch_day = numpy.nonzero(self.lunch_timeslots == self.timeslot_ids[timeslots[i]])[0][0]
-                for j in range(self.lunch_timeslots.shape[1]):
-                    timeslot_index = self.timeslot_indices[self.lunch_timeslots[lunch_day, j]]
-                    if timeslot_index != timeslots[i]:
-                        possible_students *= (True - self.student_schedules[:, timeslot_index])
-                        
-        candidate_students = numpy.nonzero(possible_students)[0]
-        if candidate_students.shape[0] <= num_spaces:
-            #   If the section has enough space for all students that applied, let them all in.
-            selected_students = candidate_students
-            section_filled = False
-        else:
-            #   If the section does not have enough space, select the students up to the maximum
-            #   capacity of the section, with the students' weight values serving as the probability
-            #   distribution to draw from.
-            weights = self.student_weights[candidate_students]
-            weights /= numpy.sum(weights)
-            selected_students = numpy.random.choice(candidate_students, num_spaces, replace=False, p=weights)
-            section_filled = True
-
-        #   Update student section assignments
-        #   Check that none of these students are already assigned to this section
-        assert(numpy.sum(self.student_sections[selected_students, si]) == 0)
-        self.student_sections[selected_students, si] = True
-        
-        #   Update student schedules
-        #   Check that none of the students are already occupied in those timeblocks
-        for i in range(timeslots.shape[0]):
-            assert(numpy.sum(self.student_schedules[selected_students, timeslots[i]]) == 0)
-            self.student_schedules[selected_students, timeslots[i]] = True
-
-            #   Update student utilies
-            if priority:
-                self.student_utilities[selected_students] += 1.5
-            else:
-                self.student_utilities[selected_students] += 1
-        
-        #   Update student weights
-        self.student_weights[selected_students] /= weight_factor
-        
-        if self.options['stats_display']: print '   Added %d/%d students (section filled: %s)' % (selected_students.shape[0], candidate_students.shape[0], section_filled)
-        
-        return section_filled
-
-    def compute_assignments(self, check_result=True):
-        """ Figure out what students should be assigned to what sections.
-            Doesn't actually store results in the database.
-            Can be run any number of times. """
-            
-        self.clear_assignments()
-        
-        #   Assign priority students to all sections in random order, grouped by duration
-        #   so that longer sections aren't disadvantaged by scheduling conflicts
-        random_section_indices = numpy.random.choice(self.num_sections, self.num_sections, replace=False)
-        random_section_indices = sorted(random_section_indices, key=lambda i : -self.section_lengths[i])
-        if self.options['stats_display']: print '\n== Assigning priority students'
-        for section_index in random_section_indices:
-            self.fill_section(section_index, priority=True)
-        
-        #   Sort sections in increasing order of number of interesting students
-        #   TODO: Check with Alex that this is the desired algorithm
-        interested_counts = numpy.sum(self.interest, 0)
-        sorted_section_indices = numpy.argsort(interested_counts.astype(numpy.float) / self.section_capacities)
-        if self.options['stats_display']: print '\n== Assigning interested students'
-        for section_index in sorted_section_indices:
-            self.fill_section(section_index, priority=False)
-        
-        if check_result:
-            self.check_assignments()
-    
-    def check_assignments(self):
-        """ Check the result for desired properties, before it is saved. """
-        
-        #   Check that no sections are overfilled
-        assert(numpy.sum(numpy.sum(self.student_sections, 0) > self.section_capacities) == 0)
-        
-        #   Check that no student's schedule violates the lunch constraints: 1 or more open lunch periods per day
-        for i in range(self.lunch_timeslots.shape[0]):
-            timeslots = numpy.array([]) if (self.lunch_timeslots[i].shape[0] == 0) else self.timeslot_indices[self.lunch_timeslots[i, :]]
-            if (timeslots.shape[0] == 0): continue
-            assert(numpy.sum(numpy.sum(self.student_schedules[:, timeslots] > self.lunch_timeslots.shape[1] - 1)) == 0)
-        
-        #   Check that each student's schedule is consistent with their assigned sections
-        for i in range(self.num_students):
-            assert(numpy.sum(self.student_schedules[i, :] != numpy.sum(self.section_schedules[numpy.nonzero(self.student_sections[i, :])[0], :], 0)) == 0)
-    
-    def compute_stats(self, display=True):
-        """ Compute statistics to provide feedback to the user about how well the
-            lottery assignment worked.  """
-
-        stats = {}
-
-        priority_matches = self.student_sections * self.priority
-        priority_assigned = numpy.sum(priority_matches, 1)
-        priority_requested = numpy.sum(self.priority, 1)
-        priority_fractions = numpy.nan_to_num(priority_assigned.astype(numpy.float) / priority_requested)
-
-        interest_matches = self.student_sections * self.interest
-        interest_assigned = numpy.sum(interest_matches, 1)
-        interest_requested = numpy.sum(self.interest, 1)
-        interest_fractions = numpy.nan_to_num(interest_assigned.astype(numpy.float) / interest_requested)
-
-        stats['priority_requested'] = priority_requested
-        stats['priority_assigned'] = priority_assigned
-        stats['interest_requested'] = interest_requested
-        stats['interest_assigned'] = interest_assigned
-        stats['student_ids'] = self.student_ids
-        stats['student_grades'] = self.student_grades
-        stats['num_sections'] = self.num_sections
-        stats['num_enrolled_students'] = numpy.sum((numpy.sum(self.student_schedules, 1) > 0))
-        stats['num_lottery_students'] = self.num_students
-        stats['overall_priority_ratio'] = float(numpy.sum(priority_assigned)) / numpy.sum(priority_requested)
-        stats['overall_interest_ratio'] = float(numpy.sum(interest_assigned)) / numpy.sum(interest_requested)
-        stats['num_registrations'] = numpy.sum(self.student_sections)
-        stats['num_full_classes'] = numpy.sum(self.section_capacities == numpy.sum(self.student_sections, 0))
-        stats['total_spaces'] = numpy.sum(self.section_capacities)
-
-        #   Compute histograms of assigned vs. requested classes
-        hist_priority = {}
-        for i in range(self.num_students):
-            key = (priority_assigned[i], priority_requested[i])
-            if key not in hist_priority:
-                hist_priority[key] = 0
-            hist_priority[key] += 1
-        stats['hist_priority'] = hist_priority
-
-        hist_interest = {}
-        for i in range(self.num_students):
-            key = (interest_assigned[i], interest_requested[i])
-            if key not in hist_interest:
-                hist_interest[key] = 0
-            hist_interest[key] += 1
-        stats['hist_interest'] = hist_interest
-
-        # Compute the overall utility of the current run.
-        # 1. Each student has a utility of sqrt(#hours of interested + 1.5 #hours of priority).
-        # This measures how happy the student will be with their classes
-        # 2. Each student gets a weight of sqrt(# classes regged for)
-        # This measures how much responsibility we take if the student gets a
-        # bad schedule (we care less if students regged for less classes).
-        # 3. We then sum weight*utility over all students and divide that
-        # by the sum of weights to get a weighted average utility.
-        #
-        # Also use the utility to get a list of screwed students,
-        # where the level of screwedness is defined by (1+utility)/(1+weight)
-        # So, people with low untilities and high weights (low screwedness scores)
-        # are considered screwed. This is pretty sketchy, so take it with a grain of salt.
-        weighted_overall_utility = 0.0
-        sum_of_weights=0.0
-        screwed_students=[]
-        for i in range(self.num_students):
-            utility = numpy.sqrt(self.student_utilities[i])
-            weight = numpy.sqrt((self.student_utility_weights[i]))
-            weighted_overall_utility += utility * weight
-            sum_of_weights += weight
-            screwed_students.append(((1+utility)/(1+weight), self.student_ids[i]))
-
-        overall_utility = weighted_overall_utility/sum_of_weights
-        screwed_students.sort()
-
-        stats['overall_utility'] = overall_utility
-        stats['students_by_screwedness'] = screwed_students
-
-        if self.options['stats_display'] or display:
-            self.display_stats(stats)
-
-        self.stats = stats
-        return stats
-
-    def display_stats(self, stats):
-        print 'Lottery results for %s' % self.program.niceName()
-        print '--------------------------------------'
-
-        print 'Counts:'
-        print '%6d students applied to the lottery' % stats['num_lottery_students']
-        print '%6d students were enrolled in at least 1 class' % stats['num_enrolled_students']
-        print '%6d total enrollments' % stats['num_registrations']
-        print '%6d available sections' % stats['num_sections']
-        print '%6d sections were filled to capacity' % stats['num_full_classes']
-
-        print 'Ratios:'
-        print '%2.2f%% of priority classes were enrolled' % (stats['overall_priority_ratio'] * 100.0)
-        print '%2.2f%% of interested classes were enrolled' % (stats['overall_interest_ratio'] * 100.0)
-        """
-        print 'Example results:'
-        no_pri_indices = numpy.nonzero(stats['priority_assigned'] == 0)[0]
-        print '1) First %d students who got none of their priority classes:' % min(5, no_pri_indices.shape[0])
-        for i in range(min(5, no_pri_indices.shape[0])):
-            sid = stats['student_ids'][no_pri_indices[i]]
-            student = ESPUser.objects.get(id=sid)
-            print '   Student: %s (grade %s)' % (student.name(), student.getGrade())
-            cs_ids = self.section_ids[numpy.nonzero(self.priority[no_pri_indices[i], :])[0]]
-            print '   - Priority classes: %s' % ClassSection.objects.filter(id__in=list(cs_ids))
-            cs_ids = self.section_ids[numpy.nonzero(self.interest[no_pri_indices[i], :])[0]]
-            print '   - Interested classes: %s' % ClassSection.objects.filter(id__in=list(cs_ids))
-            """
-
-    def get_computed_schedule(self, student_id, mode='assigned'):
-        #   mode can be 'assigned', 'interested', or 'priority'
-        if mode == 'assigned':
-            assignments = numpy.nonzero(self.student_sections[self.student_indices[student_id], :])[0]
-        elif mode == 'interested':
-            assignments = numpy.nonzero(self.interest[self.student_indices[student_id], :])[0]
-        elif mode == 'priority':
-            assignments = numpy.nonzero(self.priority[self.student_indices[student_id], :])[0]
-        result = []
-        for i in range(assignments.shape[0]):
-            result.append(ClassSection.objects.get(id=self.section_ids[assignments[i]]))
-        return result
-
-    def generate_screwed_csv(self, directory=None, n=None, stats=None):
-        """Generate a CSV file of the n most screwed students. Default: All of them.
-        Directory: string of what directory you like the information stored in.
-        This is also known as the script shulinye threw together while trying to run the Spark 2013 lottery.
-        You might want to crosscheck this file before accepting it."""
-        import csv
-
-        if directory == None:
-            directory = self.options['directory']
-
-        if stats == None:
-            stats = self.compute_stats(display=False) #Calculate stats if I didn't get any
-
-        studentlist = stats['students_by_screwedness']
-        if n != None: studentlist = studentlist[:n]
-        tday = datetime.today().strftime('%Y-%m-%d')
-        
-        fullfilename = directory + '/screwed_csv_' + tday + '.csv'
-        
-        csvfile = open(fullfilename, 'wb')
-        csvwriter = csv.writer(csvfile)
-        
-        csvwriter.writerow(["Student", "Student ID", "StudentScrewedScore", "#Classes"])
-
-        for s in studentlist:
-            csvwriter.writerow([ESPUser.objects.get(id=s[1]).name().encode('ascii', 'ignore'), s[1], s[0], len(self.get_computed_schedule(s[1]))])
-
-        csvfile.close()
-        print 'File can be found at: ' + fullfilename
-    
-    def save_assignments(self, debug_display=False, try_mailman=False):
-        """ Store lottery assignments in the database once they have been computed.
-            This is a fairly time consuming step compared to computing the assignments. """
-            
-        self.clear_saved_assignments()
-        
-        assignments = numpy.nonzero(self.student_sections)
-        student_ids = self.student_ids[assignments[0]]
-        section_ids = self.section_ids[assignments[1]]
-        
-        assert(student_ids.shape == section_ids.shape)
-        
-        relationship, created = RegistrationType.objects.get_or_create(name='Enrolled')
-        self.now = datetime.now()   # The time that all the registrations start at, in case all lottery registrations need to be manually reverted later
-        StudentRegistration.objects.bulk_create([StudentRegistration(user_id=student_ids[i], section_id=section_ids[i], relationship=relationship, start_date=self.now) for i in range(student_ids.shape[0])])
-        print "StudentRegistration enrollments all created to start at %s" % self.now
-        if debug_display:
-            print 'Created %d registrations' % student_ids.shape[0]
-        
-        #As mailman doesn't work, disable for now.
-        if try_mailman:
-            self.update_mailman_lists()
-    
-    def clear_saved_assignments(self, delete=False):
-        """ Expire/delete all previous StudentRegistration enrollments associated with the program. """
-        
-        old_registrations = StudentRegistration.objects.filter(section__parent_class__parent_program=self.program, relationship__name='Enrolled')
-        if delete:
-            old_registrations.delete()
-        else:
-            old_registrations.filter(StudentRegistration.is_valid_qobject()).update(end_date=datetime.now())
-        
-    def clear_mailman_list(self, list_name):
-        contents = list_contents(list_name)
-        for address in contents:
-            remove_list_member(list_name, address)
-        
-    def update_mailman_lists(self, delete=True):
-        if hasattr(settings, 'USE_MAILMAN') and settings.USE_MAILMAN:
-            self.clear_mailman_list("%s_%s-students" % (self.program.program_type, self.program.program_instance))
-            for i in range(self.num_sections):
-                section = ClassSection.objects.get(id=self.section_ids[i])
-                list_names = ["%s-%s" % (section.emailcode(), "students"), "%s-%s" % (section.parent_class.emailcode(), "students")]
-                for list_name in list_names:
-                    self.clear_mailman_list(list_name)
-                for j in range(self.num_students):
-                    student = ESPUser.objects.get(id=self.student_ids[i])
-                    for list_name in list_names:
-                        add_list_member(list_name, student.email)
-                    add_list_member("%s_%s-students" % (self.program.program_type, self.program.program_instance), student.email)
-        
+__author__    = "Individual contributors (see AUTHORS file)"
+__date__      = "$DATE$"
+__rev__       = "$REV$"
+__license__   = "AGPL v.3"
+__copyright__ = """
+This file is part of the ESP Web Site
+Copyright (c) 2012 by the individual contributors
+  (see AUTHORS file)
+
+The ESP Web Site is free software; you can redistribute it and/or
+modify it under the terms of the GNU Affero General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public
+License along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Contact information:
+MIT Educational Studies Program
+  84 Massachusetts Ave W20-467, Cambridge, MA 02139
+  Phone: 617-253-4882
+  Email: esp-webmasters@mit.edu
+Learning Unlimited, Inc.
+  527 Franklin St, Cambridge, MA 02139
+  Phone: 617-379-0178
+  Email: web-team@lists.learningu.org
+"""
+
+import numpy
+assert numpy.version.short_version >= "1.7.0"
+
+import numpy.random
+
+from datetime import date, datetime
+
+from esp.cal.models import Event
+from esp.users.models import ESPUser, StudentInfo
+from esp.program.models import StudentRegistration, RegistrationType, RegistrationProfile, ClassSection
+from esp.program.models.class_ import ClassCategories
+from esp.program import enrollment_counts
+from esp.mailman import add_list_member, remove_list_member, list_contents
+
+from django.conf import settings
+import multiprocessing
+import os
+
+#   The controller that compute_best_assignments() is running; the worker
+#   processes it forks inherit it from here.
+_worker_controller = None
+
+def _run_seeded_assignment(args):
+    """ Compute one seeded assignment in a worker process, and return its
+        score along with the seed. """
+    (seed, metric) = args
+    numpy.random.seed(seed)
+    _worker_controller.compute_assignments()
+    stats = _worker_controller.compute_stats(display=False)
+    return (stats[metric], seed)
+
+class SparseBoolMatrix(object):
+    """ A boolean matrix that only stores the (row, column) positions of its
+        true entries, for the lottery's sparse mode.  Provides the few
+        operations that the lottery needs from its students x sections
+        preference matrices.  The entries are kept sorted by column, then by
+        row, so that column() returns rows in the same order as
+        numpy.nonzero() does on the equivalent dense matrix.
+    """
+
+    def __init__(self, shape, rows, cols):
+        self.shape = shape
+        #   Drop any duplicate entries
+        positions = numpy.unique(numpy.asarray(cols, dtype=numpy.int64) * shape[0] + numpy.asarray(rows, dtype=numpy.int64))
+        self.cols = (positions // shape[0]).astype(numpy.int32)
+        self.rows = (positions % shape[0]).astype(numpy.int32)
+        self.col_starts = numpy.searchsorted(self.cols, numpy.arange(shape[1] + 1))
+
+    def column(self, j):
+        """ Indices of the true entries in column j, in increasing order. """
+        return self.rows[self.col_starts[j]:self.col_starts[j + 1]]
+
+    def row(self, i):
+        """ Indices of the true entries in row i, in increasing order. """
+        return self.cols[self.rows == i]
+
+    def sum(self, axis):
+        """ Number of true entries in each column (axis=0) or row (axis=1). """
+        if axis == 0:
+            return numpy.diff(self.col_starts)
+        else:
+            return numpy.bincount(self.rows, minlength=self.shape[0])
+
+    def count_matches(self, assignments):
+        """ Number of true entries in each row that are also true in the
+            SparseAssignmentMatrix of the same shape, i.e. numpy.sum(self * assignments, 1). """
+        return numpy.bincount(self.rows, weights=assignments.contains(self.rows, self.cols), minlength=self.shape[0]).astype(numpy.int64)
+
+    def to_dense(self):
+        result = numpy.zeros(self.shape, dtype=numpy.bool)
+        result[self.rows, self.cols] = True
+        return result
+
+class SparseAssignmentMatrix(object):
+    """ The students x sections matrix of lottery assignments in sparse mode,
+        stored as the sorted array of students assigned to each section.
+        Sections are filled one at a time, so entries are only ever added a
+        column at a time.
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.columns = [numpy.zeros((0,), dtype=numpy.int64) for j in range(shape[1])]
+
+    def column(self, j):
+        """ Indices of the true entries in column j, in increasing order. """
+        return self.columns[j]
+
+    def add_to_column(self, j, rows):
+        self.columns[j] = numpy.sort(numpy.concatenate((self.columns[j], rows)))
+
+    def any_in_columns(self, rows, cols):
+        """ For each of the given rows, whether it has a true entry in any of
+            the given columns. """
+        entries = [self.columns[j] for j in cols]
+        if not entries:
+            return numpy.zeros(rows.shape, dtype=numpy.bool)
+        return numpy.in1d(rows, numpy.concatenate(entries))
+
+    def nonzero(self):
+        """ Row and column indices of the true entries, in the same order as
+            numpy.nonzero() on the equivalent dense matrix. """
+        rows = numpy.concatenate(self.columns)
+        cols = numpy.repeat(numpy.arange(self.shape[1]), [column.shape[0] for column in self.columns])
+        order = numpy.lexsort((cols, rows))
+        return (rows[order], cols[order])
+
+    def row(self, i):
+        """ Indices of the true entries in row i, in increasing order. """
+        (rows, cols) = self.nonzero()
+        return cols[rows == i]
+
+    def sum(self, axis=None):
+        """ Number of true entries in each column (axis=0), in each row
+            (axis=1), or in total (axis=None). """
+        counts = numpy.array([column.shape[0] for column in self.columns], dtype=numpy.int64)
+        if axis is None:
+            return numpy.sum(counts)
+        elif axis == 0:
+            return counts
+        else:
+            return numpy.bincount(numpy.concatenate(self.columns), minlength=self.shape[0])
+
+    def contains(self, rows, cols):
+        """ Whether each of the given (row, column) positions is true. """
+        (assigned_rows, assigned_cols) = self.nonzero()
+        positions = assigned_cols * self.shape[0] + assigned_rows
+        return numpy.in1d(numpy.asarray(cols, dtype=numpy.int64) * self.shape[0] + rows, positions)
+
+    def to_dense(self):
+        result = numpy.zeros(self.shape, dtype=numpy.bool)
+        result[self.nonzero()] = True
+        return result
+
+class LotteryAssignmentController(object):
+
+    default_options = {
+        'Kp': 1.2,
+        'Ki': 1.1,
+        'check_grade': True,
+        'stats_display': False,
+        'directory': os.getenv("HOME"),
+        #   Store interest, priority, assignments and section overlaps as lists
+        #   of entries rather than dense matrices; uses memory in proportion to
+        #   the number of preferences instead of students x sections.
+        'sparse': False,
+    }
+    
+    def __init__(self, program, **kwargs):
+        """ Set constant parameters for a lottery assignment. """
+        
+        if 'lotteried_students' not in program.students():
+            raise Exception('Cannot retrive lottery preferences for program, please ensure that it has the lottery module.')
+
+        self.program = program
+        self.num_timeslots = len(self.program.getTimeSlots())
+        self.num_students = self.program.students()['lotteried_students'].count()
+        self.num_sections = len(self.program.sections().filter(status__gt=0, registration_status=0))
+        
+        self.options = LotteryAssignmentController.default_options.copy()
+        self.options.update(kwargs)
+        
+        numpy.random.seed(datetime.now().microsecond)
+        
+        self.initialize()
+        
+        if self.options['stats_display']: 
+            print 'Initialized lottery assignment for %d students, %d sections, %d timeslots' % (self.num_students, self.num_sections, self.num_timeslots)
+        
+    def get_index_array(self, arr):
+        """ Given an array of arbitrary integers, create a new array that maps 
+            the values back to their indices.  Invalid entries are stored as -1.
+            For example:            arr = [1, 6, 5, 3]
+                -> get_index_array(arr) = [-1, 0, -1, 3, -1, 2, 1]
+        """
+        
+        max_index = numpy.max(arr)
+        index_arr = -numpy.ones((max_index + 1,), dtype=numpy.int32)
+        for i in range(arr.shape[0]):
+            index_arr[arr[i]] = i
+        return index_arr
+        
+    def get_ids(self, qs):
+        """ Get an array of the IDs of the objects stored in the QuerySet qs. """
+        
+        return numpy.array(qs.order_by('id').values_list('id', flat=True))
+        
+    def get_ids_and_indices(self, qs):
+        """ Get a tuple of the IDs and lookup indices of the objects stored in the QuerySet qs. """
+        
+        a1 = numpy.array(qs.order_by('id').values_list('id', flat=True))
+        a2 = self.get_index_array(a1)
+        return (a1, a2)
+        
+    def clear_assignments(self):
+        """ Reset the state of the controller so that new assignments may be computed,
+            but without fetching any information from the database. """
+            
+        self.student_schedules = numpy.zeros((self.num_students, self.num_timeslots), dtype=numpy.bool)
+        if self.options['sparse']:
+            self.student_sections = SparseAssignmentMatrix((self.num_students, self.num_sections))
+        else:
+            self.student_sections = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
+        self.student_weights = numpy.ones((self.num_students,))
+        self.student_utilities = numpy.zeros((self.num_students, ), dtype=numpy.float)
+
+    def initialize(self):
+        """ Gather all of the information needed to run the lottery assignment.
+            This includes:
+            -   Students' interest (priority and interested bits)
+            -   Class schedules and capacities
+            -   Timeslots (incl. lunch periods for each day)
+        """
+        
+        self.section_schedules = numpy.zeros((self.num_sections, self.num_timeslots), dtype=numpy.bool)
+        self.section_capacities = numpy.zeros((self.num_sections,), dtype=numpy.uint32)
+        
+        # One array to keep track of student weigths (defined as # of classes signed up for);
+        # the utility of each student (defined as hours of interested class + 1.5*hours of
+        # priority classes) is kept in student_utilities, which clear_assignments() resets
+        self.student_utility_weights = numpy.zeros((self.num_students, ), dtype=numpy.float)
+
+        #   Get student, section, timeslot IDs and prepare lookup table
+        (self.student_ids, self.student_indices) = self.get_ids_and_indices(self.program.students()['lotteried_students'])
+        (self.section_ids, self.section_indices) = self.get_ids_and_indices(self.program.sections().filter(status__gt=0, registration_status=0))
+        (self.timeslot_ids, self.timeslot_indices) = self.get_ids_and_indices(self.program.getTimeSlots())
+        
+        #   Get IDs of timeslots allocated to lunch by day
+        #   (note: requires that this is constant across days)
+        self.lunch_schedule = numpy.zeros((self.num_timeslots,))
+        lunch_timeslots = Event.objects.filter(meeting_times__parent_class__parent_program=self.program, meeting_times__parent_class__category__category='Lunch').order_by('start').distinct()
+        #   Note: this code should not be necessary once lunch-constraints branch is merged (provides Program.dates())
+        dates = []
+        for ts in self.program.getTimeSlots():
+            ts_day = date(ts.start.year, ts.start.month, ts.start.day)
+            if ts_day not in dates:
+                dates.append(ts_day)
+        lunch_by_day = [[] for x in dates]
+        ts_count = 0
+        for ts in lunch_timeslots:
+            d = date(ts.start.year, ts.start.month, ts.start.day)
+            lunch_by_day[dates.index(d)].append(ts.id)
+            self.lunch_schedule[self.timeslot_indices[ts.id]] = True
+        for i in range(len(lunch_by_day)):
+            if len(lunch_by_day[i]) > ts_count:
+                ts_count = len(lunch_by_day[i])
+        self.lunch_timeslots = numpy.zeros((len(lunch_by_day), ts_count), dtype=numpy.int32)
+        for i in range(len(lunch_by_day)):
+            self.lunch_timeslots[i, :len(lunch_by_day[i])] = numpy.array(lunch_by_day[i])
+
+        #   Populate interest matrix
+        interest_regs = StudentRegistration.valid_objects().filter(section__parent_class__parent_program=self.program, relationship__name='Interested').values_list('user__id', 'section__id').distinct()
+        ira = numpy.array(interest_regs, dtype=numpy.uint32)
+        self.interest = self.make_signup_matrix(self.student_indices[ira[:, 0]], self.section_indices[ira[:, 1]])
+        
+        #   Populate priority matrix
+        priority_regs = StudentRegistration.valid_objects().filter(section__parent_class__parent_program=self.program, relationship__name='Priority/1').values_list('user__id', 'section__id').distinct()
+        pra = numpy.array(priority_regs, dtype=numpy.uint32)
+        self.priority = self.make_signup_matrix(self.student_indices[pra[:, 0]], self.section_indices[pra[:, 1]])
+        
+        #   Set student utility weights. Counts number of classes that students selected. Used only for computing the overall_utility stat
+        #   NOTE: Uses fixed (interest + priority) formula, needs attention when multiple priority levels are merged.
+        self.student_utility_weights = self.signup_counts(self.interest, 1).astype(float) + self.signup_counts(self.priority, 1).astype(float)
+
+        #   Populate section schedule
+        section_times = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).filter(meeting_times__id__isnull=False).distinct().values_list('id', 'meeting_times__id'))
+        self.section_schedules[self.section_indices[section_times[:, 0]], self.timeslot_indices[section_times[:, 1]]] = True
+        
+        #   Populate section overlap matrix (sections overlap if they are of the same class)
+        self.section_parent_classes = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).order_by('id').values_list('parent_class__id', flat=True))
+        if not self.options['sparse']:
+            self.section_overlap = (self.section_parent_classes[:, numpy.newaxis] == self.section_parent_classes[numpy.newaxis, :])
+
+        #   Populate section grade limits
+        self.section_grade_min = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).order_by('id').values_list('parent_class__grade_min', flat=True), dtype=numpy.uint32)
+        self.section_grade_max = numpy.array(self.program.sections().filter(status__gt=0, registration_status=0).order_by('id').values_list('parent_class__grade_max', flat=True), dtype=numpy.uint32)
+        
+        #   Populate student grades; grade will be assumed to be 0 if not entered on profile
+        self.student_grades = numpy.zeros((self.num_students,))
+        gradyear_pairs = numpy.array(RegistrationProfile.objects.filter(user__id__in=list(self.student_ids), most_recent_profile=True, student_info__graduation_year__isnull=False).values_list('user__id', 'student_info__graduation_year'), dtype=numpy.uint32)
+        self.student_grades[self.student_indices[gradyear_pairs[:, 0]]] = 12 + ESPUser.current_schoolyear() - gradyear_pairs[:, 1]
+        
+        #   Find section capacities, all at once
+        capacities = self.program.capacity_by_section_id()
+        self.section_capacities = numpy.array([capacities[sec_id] for sec_id in self.section_ids], dtype=numpy.uint32)
+
+        # Populate section lengths (hours)
+        self.section_lengths = numpy.array([x.nonzero()[0].size for x in self.section_schedules])
+
+        self.initialize_section_constraints()
+
+    def make_signup_matrix(self, student_indices, section_indices):
+        """ Build a students x sections matrix of sign-up preferences from the
+            positions of its true entries; a SparseBoolMatrix in sparse mode. """
+        
+        if self.options['sparse']:
+            return SparseBoolMatrix((self.num_students, self.num_sections), student_indices, section_indices)
+        signup = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
+        signup[student_indices, section_indices] = True
+        return signup
+
+    def signup_counts(self, signup, axis):
+        """ Number of students signed up for each section (axis=0), or of
+            sections each student signed up for (axis=1). """
+        
+        if self.options['sparse']:
+            return signup.sum(axis)
+        return numpy.sum(signup, axis)
+
+    def signup_students(self, signup, si):
+        """ Indices of the students signed up for the section with index si. """
+        
+        if self.options['sparse']:
+            return signup.column(si)
+        return numpy.nonzero(signup[:, si])[0]
+
+    def signup_sections(self, signup, student_index):
+        """ Indices of the sections a student signed up for. """
+        
+        if self.options['sparse']:
+            return signup.row(student_index)
+        return numpy.nonzero(signup[student_index, :])[0]
+
+    def assigned_signup_counts(self, signup):
+        """ Number of the sections each student signed up for that they were assigned to. """
+        
+        if self.options['sparse']:
+            return signup.count_matches(self.student_sections)
+        return numpy.sum(self.student_sections * signup, 1)
+
+    def assigned_students(self, si):
+        """ Indices of the students assigned to the section with index si. """
+        
+        if self.options['sparse']:
+            return self.student_sections.column(si)
+        return numpy.nonzero(self.student_sections[:, si])[0]
+
+    def assigned_sections(self, student_index):
+        """ Indices of the sections a student is assigned to. """
+        
+        if self.options['sparse']:
+            return self.student_sections.row(student_index)
+        return numpy.nonzero(self.student_sections[student_index, :])[0]
+
+    def assignment_counts(self, axis=None):
+        """ Number of students assigned to each section (axis=0), of sections
+            each student is assigned to (axis=1), or of assignments in total. """
+        
+        if self.options['sparse']:
+            return self.student_sections.sum(axis)
+        return numpy.sum(self.student_sections, axis)
+
+    def assign_students(self, student_indices, si):
+        """ Assign the given students to the section with index si; none of
+            them may be assigned to it already. """
+        
+        if self.options['sparse']:
+            assert(not numpy.any(numpy.in1d(student_indices, self.student_sections.column(si))))
+            self.student_sections.add_to_column(si, student_indices)
+        else:
+            assert(numpy.sum(self.student_sections[student_indices, si]) == 0)
+            self.student_sections[student_indices, si] = True
+
+    def overlapping_sections(self, si):
+        """ Boolean array of the sections that a student can't take along with
+            the section with index si (including that section itself). """
+        
+        if self.options['sparse']:
+            return (self.section_parent_classes == self.section_parent_classes[si])
+        return self.section_overlap[:, si]
+
+    def overlap_conflicts(self, student_indices, si):
+        """ For each of the given students, whether they are already assigned
+            to a section that overlaps with the section with index si. """
+        
+        if self.options['sparse']:
+            return self.student_sections.any_in_columns(student_indices, numpy.nonzero(self.overlapping_sections(si))[0])
+        #   (For boolean arrays, dot() is true wherever any of the products are.)
+        return self.student_sections[student_indices].dot(self.overlapping_sections(si))
+
+    def initialize_section_constraints(self):
+        """ Work out, for all sections at once, the scheduling constraints that
+            fill_section() checks students against:
+            -   Which days' lunch periods each section covers entirely
+            -   Which timeslots a student must have free to take each section:
+                its own, plus (if it overlaps with lunch on a day) the other
+                lunch periods on that day
+        """
+        
+        lunch_indices = self.timeslot_indices[self.lunch_timeslots]
+        num_days = self.lunch_timeslots.shape[0]
+        
+        self.section_lunch_days = numpy.zeros((self.num_sections, num_days), dtype=numpy.bool)
+        if self.lunch_timeslots.shape[1] != 0:
+            lunch_overlap = self.lunch_schedule * self.section_schedules
+            self.section_lunch_days = numpy.sum(lunch_overlap[:, lunch_indices], 2) >= self.lunch_timeslots.shape[1]
+        
+        self.section_required_timeslots = numpy.copy(self.section_schedules)
+        for i in range(num_days):
+            is_lunch = self.lunch_timeslots[i] != 0
+            overlaps_lunch = numpy.any(self.section_schedules[:, lunch_indices[i, is_lunch]], 1)
+            self.section_required_timeslots[numpy.ix_(overlaps_lunch, lunch_indices[i])] = True
+    
+    def fill_section(self, si, priority=False):
+        """ Assigns students to the section with index si.
+            Performs some checks along the way to make sure this didn't break anything. """
+        
+        timeslots = numpy.nonzero(self.section_schedules[si, :])[0]
+        
+        if self.options['stats_display']: print '-- Filling section %d (index %d, capacity %d, timeslots %s), priority=%s' % (self.section_ids[si], si, self.section_capacities[si], self.timeslot_ids[timeslots], priority)
+        
+        #   Compute number of spaces - exit if section or program is already full
+        num_spaces = self.section_capacities[si] - self.assigned_students(si).shape[0]
+        if self.program.program_size_max:
+            program_spaces_remaining = self.program.program_size_max - numpy.sum((numpy.sum(self.student_schedules, 1) > 0))
+            num_spaces = min(num_spaces, program_spaces_remaining)
+            if num_spaces == 0:
+                if self.options['stats_display']: print '   Program was already full with %d students' % numpy.sum((numpy.sum(self.student_schedules, 1) > 0))
+                return True
+        else:
+            if num_spaces == 0:
+                if self.options['stats_display']: print '   Section was already full with %d students' % self.section_capacities[si]
+                return True
+        assert(num_spaces > 0)
+        
+        #   Assign the matrix of sign-up preferences depending on whether we are considering priority bits or not
+        if priority:
+            signup = self.priority
+            weight_factor = self.options['Kp']
+        else:
+            signup = self.interest
+            weight_factor = self.options['Ki']
+            
+        #   Check that there is at least one timeslot associated with this section
+        if timeslots.shape[0] == 0:
+            if self.options['stats_display']: print '   Section was not assigned to any timeslots, aborting'
+            return False
+            
+        #   Check that this section does not cover all lunch timeslots on any given day
+        lunch_days = numpy.nonzero(self.section_lunch_days[si, :])[0]
+        if lunch_days.shape[0] > 0:
+            if self.options['stats_display']: print '   Section covered all lunch timeslots %s on day %d, aborting' % (self.lunch_timeslots[lunch_days[0], :], lunch_days[0])
+            return False
+        
+        #   Get students who have indicated interest in the section; the rest of
+        #   the checks only look at their rows of the student matrices
+        candidate_students = self.signup_students(signup, si)
+        
+        #   Filter students by the section's grade limits
+        if self.options['check_grade']:
+            grades = self.student_grades[candidate_students]
+            candidate_students = candidate_students[(grades >= self.section_grade_min[si]) & (grades <= self.section_grade_max[si])]
+            
+        #   Filter students by who has all of the section's timeslots available, and by lunch
+        #   constraint - if class overlaps with lunch period, student must have 1 additional free spot
+        #   NOTE: Currently only works with 2 lunch periods per day
+        #   (For boolean arrays, dot() is true wherever any of the products are.)
+        conflicts = self.student_schedules[candidate_students].dot(self.section_required_timeslots[si, :])
+            
+        #   Filter students by who is not already registered for a different section of the class
+        conflicts |= self.overlap_conflicts(candidate_students, si)
+        
+        candidate_students = candidate_students[~conflicts]
+        if candidate_students.shape[0] <= num_spaces:
+            #   If the section has enough space for all students that applied, let them all in.
+            selected_students = candidate_students
+            section_filled = False
+        else:
+            #   If the section does not have enough space, select the students up to the maximum
+            #   capacity of the section, with the students' weight values serving as the probability
+            #   distribution to draw from.
+            weights = self.student_weights[candidate_students]
+            weights /= numpy.sum(weights)
+            selected_students = numpy.random.choice(candidate_students, num_spaces, replace=False, p=weights)
+            section_filled = True
+
+        #   Update student section assignments
+        self.assign_students(selected_students, si)
+        
+        #   Update student schedules
+        #   Check that none of the students are already occupied in those timeblocks
+        selected_schedules = self.student_schedules[selected_students]
+        assert(not numpy.any(selected_schedules.dot(self.section_schedules[si, :])))
+        self.student_schedules[selected_students] = selected_schedules | self.section_schedules[si, :]
+
+        #   Update student utilies
+        if priority:
+            self.student_utilities[selected_students] += 1.5 * timeslots.shape[0]
+        else:
+            self.student_utilities[selected_students] += timeslots.shape[0]
+        
+        #   Update student weights
+        self.student_weights[selected_students] /= weight_factor
+        
+        if self.options['stats_display']: print '   Added %d/%d students (section filled: %s)' % (selected_students.shape[0], candidate_students.shape[0], section_filled)
+        
+        return section_filled
+
+    def compute_assignments(self, check_result=True):
+        """ Figure out what students should be assigned to what sections.
+            Doesn't actually store results in the database.
+            Can be run any number of times. """
+            
+        self.clear_assignments()
+        
+        #   Assign priority students to all sections in random order, grouped by duration
+        #   so that longer sections aren't disadvantaged by scheduling conflicts
+        random_section_indices = numpy.random.choice(self.num_sections, self.num_sections, replace=False)
+        random_section_indices = sorted(random_section_indices, key=lambda i : -self.section_lengths[i])
+        if self.options['stats_display']: print '\n== Assigning priority students'
+        for section_index in random_section_indices:
+            self.fill_section(section_index, priority=True)
+        
+        #   Sort sections in increasing order of number of interesting students
+        #   TODO: Check with Alex that this is the desired algorithm
+        interested_counts = self.signup_counts(self.interest, 0)
+        sorted_section_indices = numpy.argsort(interested_counts.astype(numpy.float) / self.section_capacities)
+        if self.options['stats_display']: print '\n== Assigning interested students'
+        for section_index in sorted_section_indices:
+            self.fill_section(section_index, priority=False)
+        
+        if check_result:
+            self.check_assignments()
+    
+    def compute_best_assignments(self, num_runs=4, processes=None, metric='overall_utility'):
+        """ Compute assignments num_runs times with different random seeds, and
+            keep the one that scores highest on the given statistic from
+            compute_stats().  The runs are spread over worker processes (by
+            default, one per CPU), so this takes about as long as a single run
+            on a machine with enough cores.
+            Like compute_assignments(), doesn't store results in the database;
+            call save_assignments() afterwards to store the winning run.
+            Returns the statistics of the winning run. """
+        
+        global _worker_controller
+        seeds = [int(seed) for seed in numpy.random.randint(0, 2**31 - 1, num_runs)]
+        
+        #   The workers only use the arrays that are already loaded, and never
+        #   touch the database connection they inherit from this process.
+        _worker_controller = self
+        pool = multiprocessing.Pool(processes)
+        try:
+            self.run_scores = pool.map(_run_seeded_assignment, [(seed, metric) for seed in seeds])
+        finally:
+            pool.close()
+            pool.join()
+            _worker_controller = None
+        
+        (best_score, best_seed) = max(self.run_scores)
+        if self.options['stats_display']:
+            print 'Scores (%s) of %d lottery runs: %s' % (metric, num_runs, ', '.join(['%.4f' % score for (score, seed) in self.run_scores]))
+        
+        #   Each run only depends on its seed, so the winner can be recomputed here
+        numpy.random.seed(best_seed)
+        self.compute_assignments()
+        return self.compute_stats(display=False)
+    
+    def check_assignments(self):
+        """ Check the result for desired properties, before it is saved. """
+        
+        #   Check that no sections are overfilled
+        assert(numpy.sum(self.assignment_counts(0) > self.section_capacities) == 0)
+        
+        #   Check that no student's schedule violates the lunch constraints: 1 or more open lunch periods per day
+        for i in range(self.lunch_timeslots.shape[0]):
+            timeslots = numpy.array([]) if (self.lunch_timeslots[i].shape[0] == 0) else self.timeslot_indices[self.lunch_timeslots[i, :]]
+            if (timeslots.shape[0] == 0): continue
+            assert(numpy.sum(numpy.sum(self.student_schedules[:, timeslots] > self.lunch_timeslots.shape[1] - 1)) == 0)
+        
+        #   Check that each student's schedule is consistent with their assigned sections
+        assigned_schedules = numpy.zeros((self.num_students, self.num_timeslots), dtype=numpy.int64)
+        for si in range(self.num_sections):
+            assigned_schedules[self.assigned_students(si)] += self.section_schedules[si, :]
+        assert(numpy.sum(self.student_schedules != assigned_schedules) == 0)
+    
+    def compute_stats(self, display=True):
+        """ Compute statistics to provide feedback to the user about how well the
+            lottery assignment worked.  """
+
+        stats = {}
+
+        priority_assigned = self.assigned_signup_counts(self.priority)
+        priority_requested = self.signup_counts(self.priority, 1)
+        priority_fractions = numpy.nan_to_num(priority_assigned.astype(numpy.float) / priority_requested)
+
+        interest_assigned = self.assigned_signup_counts(self.interest)
+        interest_requested = self.signup_counts(self.interest, 1)
+        interest_fractions = numpy.nan_to_num(interest_assigned.astype(numpy.float) / interest_requested)
+
+        stats['priority_requested'] = priority_requested
+        stats['priority_assigned'] = priority_assigned
+        stats['interest_requested'] = interest_requested
+        stats['interest_assigned'] = interest_assigned
+        stats['student_ids'] = self.student_ids
+        stats['student_grades'] = self.student_grades
+        stats['num_sections'] = self.num_sections
+        stats['num_enrolled_students'] = numpy.sum((numpy.sum(self.student_schedules, 1) > 0))
+        stats['num_lottery_students'] = self.num_students
+        stats['overall_priority_ratio'] = float(numpy.sum(priority_assigned)) / numpy.sum(priority_requested)
+        stats['overall_interest_ratio'] = float(numpy.sum(interest_assigned)) / numpy.sum(interest_requested)
+        stats['num_registrations'] = self.assignment_counts()
+        stats['num_full_classes'] = numpy.sum(self.section_capacities == self.assignment_counts(0))
+        stats['total_spaces'] = numpy.sum(self.section_capacities)
+
+        #   Compute histograms of assigned vs. requested classes
+        hist_priority = {}
+        for i in range(self.num_students):
+            key = (priority_assigned[i], priority_requested[i])
+            if key not in hist_priority:
+                hist_priority[key] = 0
+            hist_priority[key] += 1
+        stats['hist_priority'] = hist_priority
+
+        hist_interest = {}
+        for i in range(self.num_students):
+            key = (interest_assigned[i], interest_requested[i])
+            if key not in hist_interest:
+                hist_interest[key] = 0
+            hist_interest[key] += 1
+        stats['hist_interest'] = hist_interest
+
+        # Compute the overall utility of the current run.
+        # 1. Each student has a utility of sqrt(#hours of interested + 1.5 #hours of priority).
+        # This measures how happy the student will be with their classes
+        # 2. Each student gets a weight of sqrt(# classes regged for)
+        # This measures how much responsibility we take if the student gets a
+        # bad schedule (we care less if students regged for less classes).
+        # 3. We then sum weight*utility over all students and divide that
+        # by the sum of weights to get a weighted average utility.
+        #
+        # Also use the utility to get a list of screwed students,
+        # where the level of screwedness is defined by (1+utility)/(1+weight)
+        # So, people with low untilities and high weights (low screwedness scores)
+        # are considered screwed. This is pretty sketchy, so take it with a grain of salt.
+        weighted_overall_utility = 0.0
+        sum_of_weights=0.0
+        screwed_students=[]
+        for i in range(self.num_students):
+            utility = numpy.sqrt(self.student_utilities[i])
+            weight = numpy.sqrt((self.student_utility_weights[i]))
+            weighted_overall_utility += utility * weight
+            sum_of_weights += weight
+            screwed_students.append(((1+utility)/(1+weight), self.student_ids[i]))
+
+        overall_utility = weighted_overall_utility/sum_of_weights
+        screwed_students.sort()
+
+        stats['overall_utility'] = overall_utility
+        stats['students_by_screwedness'] = screwed_students
+
+        if self.options['stats_display'] or display:
+            self.display_stats(stats)
+
+        self.stats = stats
+        return stats
+
+    def display_stats(self, stats):
+        print 'Lottery results for %s' % self.program.niceName()
+        print '--------------------------------------'
+
+        print 'Counts:'
+        print '%6d students applied to the lottery' % stats['num_lottery_students']
+        print '%6d students were enrolled in at least 1 class' % stats['num_enrolled_students']
+        print '%6d total enrollments' % stats['num_registrations']
+        print '%6d available sections' % stats['num_sections']
+        print '%6d sections were filled to capacity' % stats['num_full_classes']
+
+        print 'Ratios:'
+        print '%2.2f%% of priority classes were enrolled' % (stats['overall_priority_ratio'] * 100.0)
+        print '%2.2f%% of interested classes were enrolled' % (stats['overall_interest_ratio'] * 100.0)
+        """
+        print 'Example results:'
+        no_pri_indices = numpy.nonzero(stats['priority_assigned'] == 0)[0]
+        print '1) First %d students who got none of their priority classes:' % min(5, no_pri_indices.shape[0])
+        for i in range(min(5, no_pri_indices.shape[0])):
+            sid = stats['student_ids'][no_pri_indices[i]]
+            student = ESPUser.objects.get(id=sid)
+            print '   Student: %s (grade %s)' % (student.name(), student.getGrade())
+            cs_ids = self.section_ids[numpy.nonzero(self.priority[no_pri_indices[i], :])[0]]
+            print '   - Priority classes: %s' % ClassSection.objects.filter(id__in=list(cs_ids))
+            cs_ids = self.section_ids[numpy.nonzero(self.interest[no_pri_indices[i], :])[0]]
+            print '   - Interested classes: %s' % ClassSection.objects.filter(id__in=list(cs_ids))
+            """
+
+    def get_computed_schedule(self, student_id, mode='assigned'):
+        #   mode can be 'assigned', 'interested', or 'priority'
+        if mode == 'assigned':
+            assignments = self.assigned_sections(self.student_indices[student_id])
+        elif mode == 'interested':
+            assignments = self.signup_sections(self.interest, self.student_indices[student_id])
+        elif mode == 'priority':
+            assignments = self.signup_sections(self.priority, self.student_indices[student_id])
+        result = []
+        for i in range(assignments.shape[0]):
+            result.append(ClassSection.objects.get(id=self.section_ids[assignments[i]]))
+        return result
+
+    def generate_screwed_csv(self, directory=None, n=None, stats=None):
+        """Generate a CSV file of the n most screwed students. Default: All of them.
+        Directory: string of what directory you like the information stored in.
+        This is also known as the script shulinye threw together while trying to run the Spark 2013 lottery.
+        You might want to crosscheck this file before accepting it."""
+        import csv
+
+        if directory == None:
+            directory = self.options['directory']
+
+        if stats == None:
+            stats = self.compute_stats(display=False) #Calculate stats if I didn't get any
+
+        studentlist = stats['students_by_screwedness']
+        if n != None: studentlist = studentlist[:n]
+        tday = datetime.today().strftime('%Y-%m-%d')
+        
+        fullfilename = directory + '/screwed_csv_' + tday + '.csv'
+        
+        csvfile = open(fullfilename, 'wb')
+        csvwriter = csv.writer(csvfile)
+        
+        csvwriter.writerow(["Student", "Student ID", "StudentScrewedScore", "#Classes"])
+
+        for s in studentlist:
+            csvwriter.writerow([ESPUser.objects.get(id=s[1]).name().encode('ascii', 'ignore'), s[1], s[0], len(self.get_computed_schedule(s[1]))])
+
+        csvfile.close()
+        print 'File can be found at: ' + fullfilename
+    
+    def save_assignments(self, debug_display=False, try_mailman=False):
+        """ Store lottery assignments in the database once they have been computed.
+            This is a fairly time consuming step compared to computing the assignments. """
+            
+        self.clear_saved_assignments()
+        
+        if self.options['sparse']:
+            assignments = self.student_sections.nonzero()
+        else:
+            assignments = numpy.nonzero(self.student_sections)
+        student_ids = self.student_ids[assignments[0]]
+        section_ids = self.section_ids[assignments[1]]
+        
+        assert(student_ids.shape == section_ids.shape)
+        
+        relationship, created = RegistrationType.objects.get_or_create(name='Enrolled')
+        self.now = datetime.now()   # The time that all the registrations start at, in case all lottery registrations need to be manually reverted later
+        StudentRegistration.objects.bulk_create([StudentRegistration(user_id=student_ids[i], section_id=section_ids[i], relationship=relationship, start_date=self.now) for i in range(student_ids.shape[0])])
+        #   bulk_create() doesn't send signals, so recount the enrollments
+        enrollment_counts.invalidate(self.section_ids)
+        print "StudentRegistration enrollments all created to start at %s" % self.now
+        if debug_display:
+            print 'Created %d registrations' % student_ids.shape[0]
+        
+        #As mailman doesn't work, disable for now.
+        if try_mailman:
+            self.update_mailman_lists()
+    
+    def clear_saved_assignments(self, delete=False):
+        """ Expire/delete all previous StudentRegistration enrollments associated with the program. """
+        
+        old_registrations = StudentRegistration.objects.filter(section__parent_class__parent_program=self.program, relationship__name='Enrolled')
+        if delete:
+            old_registrations.delete()
+        else:
+            old_registrations.filter(StudentRegistration.is_valid_qobject()).update(end_date=datetime.now())
+        enrollment_counts.invalidate(self.program.sections().values_list('id', flat=True))
+        
+    def clear_mailman_list(self, list_name):
+        contents = list_contents(list_name)
+        for address in contents:
+            remove_list_member(list_name, address)
+        
+    def update_mailman_lists(self, delete=True):
+        if hasattr(settings, 'USE_MAILMAN') and settings.USE_MAILMAN:
+            self.clear_mailman_list("%s_%s-students" % (self.program.program_type, self.program.program_instance))
+            for i in range(self.num_sections):
+                section = ClassSection.objects.get(id=self.section_ids[i])
+                list_names = ["%s-%s" % (section.emailcode(), "students"), "%s-%s" % (section.parent_class.emailcode(), "students")]
+                for list_name in list_names:
+                    self.clear_mailman_list(list_name)
+                for j in range(self.num_students):
+                    student = ESPUser.objects.get(id=self.student_ids[i])
+                    for list_name in list_names:
+                        add_list_member(list_name, student.email)
+                    add_list_member("%s_%s-students" % (self.program.program_type, self.program.program_instance), student.email)
+        
@@ -42,6 +42,7 @@ from esp.users.models import ESPUser, StudentInfo
 from esp.program.models import StudentRegistration, RegistrationType, RegistrationProfile, ClassSection
 from esp.program.models.class_ import ClassCategories
 from esp.mailman import add_list_member, remove_list_member, list_contents
+from esp.cache.batch import batched_invalidations
 
 from django.conf import settings
 import os
@@ -82,10 +83,11 @@ class StudentRegSanityController(object):
                 srs = sec.getRegistrations()
                 report.append((sec, srs.count()))
 
-        for sr in srs:		
-            if not fake:	
-                if csvlog: csvwriter.writerow([w.title().encode('ascii', 'ignore'), ', '.join(sec.friendly_times()), sr.user.name().encode('ascii', 'ignore'), sr.relationship.__unicode__().encode('ascii', 'ignore')])
-                sr.expire()
+        with batched_invalidations():
+            for sr in srs:
+                if not fake:
+                    if csvlog: csvwriter.writerow([w.title().encode('ascii', 'ignore'), ', '.join(sec.friendly_times()), sr.user.name().encode('ascii', 'ignore'), sr.relationship.__unicode__().encode('ascii', 'ignore')])
+                    sr.expire()
         if verbose > 0: print report
         if closeatend: csvfile.close()
         print "Walkins checked"
@@ -114,9 +116,10 @@ class StudentRegSanityController(object):
             srs = l.getRegistrations()
             report.append((l, srs.count()))
             if not fake:
-                for sr in srs:
-                    if csvlog: csvwriter.writerow([l.title().encode('ascii', 'ignore'), sr.user.name().encode('ascii', 'ignore'), sr.relationship.__unicode__().encode('ascii', 'ignore')])
-                    sr.expire()
+                with batched_invalidations():
+                    for sr in srs:
+                        if csvlog: csvwriter.writerow([l.title().encode('ascii', 'ignore'), sr.user.name().encode('ascii', 'ignore'), sr.relationship.__unicode__().encode('ascii', 'ignore')])
+                        sr.expire()
         if verbose > 0: print report
         if closeatend: csvfile.close()
         print "Lunch checked."
@@ -0,0 +1,251 @@
+""" Counts of the students enrolled in each class section. """
+__author__    = "Individual contributors (see AUTHORS file)"
+__date__      = "$DATE$"
+__rev__       = "$REV$"
+__license__   = "AGPL v.3"
+__copyright__ = """
+This file is part of the ESP Web Site
+Copyright (c) 2013 by the individual contributors
+  (see AUTHORS file)
+
+The ESP Web Site is free software; you can redistribute it and/or
+modify it under the terms of the GNU Affero General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public
+License along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Contact information:
+MIT Educational Studies Program
+  84 Massachusetts Ave W20-467, Cambridge, MA 02139
+  Phone: 617-253-4882
+  Email: esp-webmasters@mit.edu
+Learning Unlimited, Inc.
+  527 Franklin St, Cambridge, MA 02139
+  Phone: 617-379-0178
+  Email: web-team@lists.learningu.org
+"""
+
+from django.core.cache import cache
+from django.db.models import Count, signals
+
+import random
+import time
+
+from esp.cache.batch import queue_delete_many, drop_pending
+from esp.program.models import StudentRegistration, RegistrationType
+from esp.utils.transaction_hooks import on_commit
+
+__all__ = ['get_count', 'get_counts', 'get_program_counts', 'get_program_counts_since', 'invalidate', 'reconcile', 'reconcile_program']
+
+#   The counts live in the cache, one per section, and are dropped whenever a
+#   registration that may affect them is saved or deleted.  Each one also
+#   expires this many seconds after it was counted from the database, so even
+#   if it drifts (say, because some code updated StudentRegistrations in bulk
+#   without calling invalidate()) it won't be wrong for long.
+RECONCILE_INTERVAL = 600
+
+#   Alongside each count is a token that changes whenever the count is
+#   dropped.  A count read from the database is only kept if the token is the
+#   same afterwards as it was before, i.e. if no registration for that
+#   section was saved in the meantime; otherwise it might be missing a write
+#   that hadn't been committed yet when we counted.
+#
+#   Invalidations happen twice: right away, so that this thread doesn't use
+#   the old counts (while handling a request, they go through
+#   esp.cache.batch, and until the end of the request this thread doesn't
+#   cache any counts for the affected sections); and once the change has
+#   been committed (see esp.utils.transaction_hooks), in case some other
+#   process counted the sections again in between.
+TOKEN_TIMEOUT = 86400
+
+#   How long a numbered snapshot of a program's counts is kept around for
+#   get_program_counts_since() to compare against.  Clients that have been
+#   away longer than this just get all of the counts again.
+SNAPSHOT_TIMEOUT = 3600
+
+def _key(section_id):
+    return 'enrollment_count|%d' % section_id
+
+def _token_key(section_id):
+    return 'enrollment_count_token|%d' % section_id
+
+def _section_id(section):
+    if hasattr(section, 'id'):
+        return int(section.id)
+    return int(section)
+
+def count_from_db(section_ids):
+    """ Count the students enrolled in each of the given sections, with one
+    query.  Returns a dictionary of counts keyed by section id. """
+    enrolled_type = RegistrationType.get_map(include=['Enrolled'], category='student')['Enrolled']
+    counts = dict([(section_id, 0) for section_id in section_ids])
+    rows = StudentRegistration.valid_objects().filter(section__in=section_ids, relationship=enrolled_type).values('section').annotate(num_students=Count('user', distinct=True))
+    for row in rows:
+        counts[row['section']] = row['num_students']
+    return counts
+
+def _get_tokens(section_ids):
+    """ Returns the current token of each section, keyed by token key,
+    creating any that are missing.  A token that is about to be deleted, or
+    that someone else created at the same time, comes back as None. """
+    keys = [_token_key(section_id) for section_id in section_ids]
+    tokens = drop_pending(cache, cache.get_many(keys))
+    for key in keys:
+        if key not in tokens:
+            token = random.randint(0, 1048575)
+            if cache.add(key, token, TOKEN_TIMEOUT):
+                tokens[key] = token
+            else:
+                tokens[key] = None
+    return tokens
+
+def _store_counts(counts, tokens, overwrite=False):
+    """ Cache counts (keyed by section id) that were counted from the
+    database after reading tokens with _get_tokens(), and drop them again if
+    any of the sections were invalidated in the meantime. """
+    counts = dict([(section_id, count) for section_id, count in counts.items()
+                   if tokens[_token_key(section_id)] is not None])
+    if not counts:
+        return
+    if overwrite:
+        cache.set_many(dict([(_key(section_id), count) for section_id, count in counts.items()]), RECONCILE_INTERVAL)
+    else:
+        for section_id, count in counts.items():
+            #   Don't clobber a count that someone else just stored
+            cache.add(_key(section_id), count, RECONCILE_INTERVAL)
+    current = drop_pending(cache, cache.get_many([_token_key(section_id) for section_id in counts]))
+    stale_keys = [_key(section_id) for section_id in counts
+                  if current.get(_token_key(section_id)) != tokens[_token_key(section_id)]]
+    if stale_keys:
+        cache.delete_many(stale_keys)
+
+def get_counts(sections):
+    """ Returns a dictionary of the number of students enrolled in each of
+    the given sections (or section ids), keyed by section id.  Only the
+    sections whose counts are missing are counted in the database. """
+    section_ids = [_section_id(section) for section in sections]
+    cached = drop_pending(cache, cache.get_many([_key(section_id) for section_id in section_ids]))
+    counts = {}
+    missing_ids = []
+    for section_id in section_ids:
+        count = cached.get(_key(section_id))
+        if count is None:
+            missing_ids.append(section_id)
+        else:
+            counts[section_id] = count
+    if missing_ids:
+        tokens = _get_tokens(missing_ids)
+        db_counts = count_from_db(missing_ids)
+        _store_counts(db_counts, tokens)
+        counts.update(db_counts)
+    return counts
+
+def get_count(section):
+    """ The number of students enrolled in section. """
+    section_id = _section_id(section)
+    return get_counts([section_id])[section_id]
+
+def get_program_counts(program):
+    """ The number of students enrolled in each section of program, keyed by
+    section id. """
+    from esp.program.models.class_ import sections_in_program_by_id
+    return get_counts(sections_in_program_by_id(program))
+
+def _version_key(program_id):
+    return 'enrollment_count_version|%d' % program_id
+
+def _snapshot_key(program_id, version):
+    return 'enrollment_count_snapshot|%d|%d' % (program_id, version)
+
+def _next_version(program_id):
+    try:
+        return cache.incr(_version_key(program_id))
+    except ValueError:
+        #   The version counter was never set up, or has been evicted.  Start
+        #   it from the current time in milliseconds, so that it is still
+        #   greater than any version a client may have been given before.
+        cache.add(_version_key(program_id), int(time.time() * 1000), SNAPSHOT_TIMEOUT)
+        return cache.incr(_version_key(program_id))
+
+def get_program_counts_since(program, since=None):
+    """ Like get_program_counts(), but only returns the counts that have
+    changed since the given version.
+
+    Returns a tuple (version, counts, full).  version identifies the current
+    counts, and should be passed back in as since the next time.  If the
+    counts as of since are no longer known (or since is None), all of the
+    counts are returned and full is True; otherwise counts only holds the
+    sections whose counts changed and full is False. """
+    program_id = program.id
+    counts = program.student_counts_by_section_id()
+
+    #   Number a new snapshot whenever the counts differ from the last one
+    version = cache.get(_version_key(program_id))
+    if version is None or cache.get(_snapshot_key(program_id, version)) != counts:
+        version = _next_version(program_id)
+        cache.set(_snapshot_key(program_id, version), counts, SNAPSHOT_TIMEOUT)
+
+    if since is not None and since <= version:
+        old_counts = cache.get(_snapshot_key(program_id, since))
+        #   A section that has gone away can't be expressed as a change
+        if old_counts is not None and not (set(old_counts) - set(counts)):
+            changed = dict([(section_id, count) for section_id, count in counts.items()
+                            if old_counts.get(section_id) != count])
+            return (version, changed, False)
+    return (version, counts, True)
+
+def invalidate(sections):
+    """ Forget the counts for the given sections (or section ids), so that
+    they are counted again when they are next read.  Use this after changing
+    StudentRegistrations in bulk. """
+    keys = []
+    for section in sections:
+        section_id = _section_id(section)
+        keys += [_key(section_id), _token_key(section_id)]
+    queue_delete_many(cache, keys)
+    on_commit(lambda: queue_delete_many(cache, keys))
+
+def reconcile(sections):
+    """ Recount the given sections in the database and reset their counters.
+    Returns a list of (section id, old count, new count) for the counters
+    that were wrong. """
+    section_ids = [_section_id(section) for section in sections]
+    cached = cache.get_many([_key(section_id) for section_id in section_ids])
+    tokens = _get_tokens(section_ids)
+    db_counts = count_from_db(section_ids)
+    _store_counts(db_counts, tokens, overwrite=True)
+    return [(section_id, cached[_key(section_id)], count) for section_id, count in db_counts.items()
+            if _key(section_id) in cached and cached[_key(section_id)] != count]
+
+def reconcile_program(program):
+    """ reconcile() every section of program. """
+    from esp.program.models.class_ import sections_in_program_by_id
+    return reconcile(sections_in_program_by_id(program))
+
+#   Drop the counts when registrations are saved one at a time.  Creating a
+#   registration other than an enrollment can't change a count, so we don't
+#   bother then.
+def _enrolled_type_id():
+    enrolled_type = RegistrationType.get_map().get('Enrolled')
+    if enrolled_type is None:
+        return None
+    return enrolled_type.id
+
+def _registration_saved(sender, instance, created=False, **kwargs):
+    if created and instance.relationship_id != _enrolled_type_id():
+        return
+    invalidate([instance.section_id])
+
+def _registration_deleted(sender, instance, **kwargs):
+    invalidate([instance.section_id])
+
+signals.post_save.connect(_registration_saved, sender=StudentRegistration, weak=False)
+signals.pre_delete.connect(_registration_deleted, sender=StudentRegistration, weak=False)
@@ -403,13 +403,20 @@ class Program(models.Model, CustomFormsLinkModel):
 
     @cache_function
     def capacity_by_section_id(self):
-        capacities = {}
-        for sec in self.sections():
-            capacities[sec.id] = sec.capacity
+        from esp.program.models.class_ import compute_capacities
+        section_ids = list(self.sections().values_list('id', flat=True))
+        #   Fetch all of the cached capacities at once, rather than one at a
+        #   time, and work out the missing ones together
+        capacities = dict(zip(section_ids, ClassSection._get_capacity.get_many([(sec_id, False) for sec_id in section_ids])))
+        missing_ids = [sec_id for sec_id in section_ids if capacities[sec_id] is None]
+        if missing_ids:
+            capacities.update(compute_capacities(self, missing_ids))
+            ClassSection._get_capacity.set_many([((sec_id, False), capacities[sec_id]) for sec_id in missing_ids])
         return capacities
     #   Clear this cache on any ClassSection capacity update... kind of brute force, but oh well.
     #   WARNING: Not sure if this usage is correct, can someone check?
     capacity_by_section_id.depend_on_cache(lambda: ClassSection._get_capacity, lambda **kwargs: {})
+    capacity_by_section_id.set_warmer(lambda program: program.capacity_by_section_id())
 
     def checked_in_by_section_id(self):
         from esp.program.models.class_ import sections_in_program_by_id
@@ -429,30 +436,8 @@ class Program(models.Model, CustomFormsLinkModel):
         return counts
         
     def student_counts_by_section_id(self):
-        from esp.program.models.class_ import sections_in_program_by_id
-        section_ids = sections_in_program_by_id(self)
-        
-        class_cachekey = "class_size_counter_%d"
-        counts = cache.get_many([class_cachekey % x for x in section_ids])
-
-        clean_counts = {}
-        missing_secs = set()
-
-        for section_id in section_ids:
-            clean_count = counts.get(class_cachekey % section_id, None)
-            if not clean_count:
-                missing_secs.add(section_id)
-            clean_counts[section_id] = clean_count
-
-        if len(missing_secs) != 0:
-            initial_catalog_queryset = ClassSubject.objects.filter(sections__in=missing_secs)
-            catalog = ClassSubject.objects.catalog(self, initial_queryset = initial_catalog_queryset)
-            for subject in catalog:
-                for section in subject.get_sections():
-                    if int(section.id) in missing_secs:
-                        clean_counts[section.id] = section.num_students()  ## Also repopulates the cache.  Magic!
-
-        return clean_counts
+        from esp.program import enrollment_counts
+        return enrollment_counts.get_program_counts(self)
 
     @cache_function
     def getListDescriptions(self):
@@ -725,6 +710,7 @@ class Program(models.Model, CustomFormsLinkModel):
         else:
             return list(self.getTimeSlots())
     getTimeSlotList.depend_on_model(lambda: Event)
+    getTimeSlotList.set_warmer(lambda program: (program.getTimeSlotList(), program.getTimeSlotList(include_all=True)))
 
     def total_duration(self):
         """ Returns the total length of the events in this program, as a timedelta object. """
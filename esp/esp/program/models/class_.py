@@ -38,7 +38,7 @@ from collections import defaultdict
 
 # django Util
 from django.db import models
-from django.db.models import get_model
+from django.db.models import get_model, Max
 from django.db.models.query import Q
 from django.db.models import signals
 from django.core.cache import cache
@@ -69,6 +69,7 @@ from esp.qsdmedia.models import Media
 from esp.users.models import ESPUser, Permission, UserAvailability
 from esp.middleware              import ESPError
 from esp.program.models          import Program, StudentRegistration, RegistrationType
+from esp.program                 import enrollment_counts
 from esp.program.models import BooleanExpression, ScheduleMap, ScheduleConstraint, ScheduleTestOccupied, ScheduleTestCategory, ScheduleTestSectionList
 from esp.resources.models        import ResourceType, Resource, ResourceRequest, ResourceAssignment
 from esp.cache                   import cache_function
@@ -83,6 +84,17 @@ from esp.customforms.linkfields import CustomFormsLinkModel
 
 __all__ = ['ClassSection', 'ClassSubject', 'ProgramCheckItem', 'ClassManager', 'ClassCategories', 'ClassImplication', 'ClassSizeRange']
 
+#   Number of students enrolled in a class, for use in .extra(); the parameters
+#   are the id of the Enrolled RegistrationType and the current time (twice).
+CATALOG_NUM_STUDENTS_SQL = 'SELECT COUNT(DISTINCT "program_studentregistration"."user_id") FROM "program_studentregistration", "program_classsection" WHERE ("program_studentregistration"."relationship_id" = %s AND "program_studentregistration"."section_id" = "program_classsection"."id" AND "program_classsection"."parent_class_id" = "program_class"."id" AND ("program_studentregistration"."start_date" IS NULL OR "program_studentregistration"."start_date" <= %s) AND ("program_studentregistration"."end_date" IS NULL OR "program_studentregistration"."end_date" >= %s))'
+
+#   Format of the times in the JSON catalog
+CATALOG_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+#   Number of classes whose catalog entries are fetched at a time when the
+#   JSON catalog is put together
+CATALOG_CHUNK_SIZE = 100
+
 class ClassSizeRange(models.Model):
     from esp.program.models import Program
 
@@ -152,18 +164,12 @@ class ClassManager(ProcedureManager):
         # Try getting the catalog straight from cache
         catalog = self.catalog_cached(program, ts, force_all, initial_queryset, cache_only=True, order_args_override=order_args_override)
         if catalog is None:
-            # Get it from the DB, then try prefetching class sizes
+            # Get it from the DB
             catalog = self.catalog_cached(program, ts, force_all, initial_queryset, use_cache=use_cache, cache_only=cache_only, order_args_override=order_args_override)
-        else:
-            for cls in catalog:
-                for sec in cls.get_sections():
-                    if hasattr(sec, '_count_students'):
-                        del sec._count_students
 
         return catalog
 
     
-    @cache_function
     def catalog_cached(self, program, ts=None, force_all=False, initial_queryset=None, order_args_override=None):
         """ Return a queryset of classes for view in the catalog.
 
@@ -194,7 +200,7 @@ class ClassManager(ProcedureManager):
         #   Retrieve the content type for finding class documents (generic relation)
         content_type_id = ContentType.objects.get_for_model(ClassSubject).id
         
-        select = SortedDict([( '_num_students', 'SELECT COUNT(DISTINCT "program_studentregistration"."user_id") FROM "program_studentregistration", "program_classsection" WHERE ("program_studentregistration"."relationship_id" = %s AND "program_studentregistration"."section_id" = "program_classsection"."id" AND "program_classsection"."parent_class_id" = "program_class"."id" AND ("program_studentregistration"."start_date" IS NULL OR "program_studentregistration"."start_date" <= %s) AND ("program_studentregistration"."end_date" IS NULL OR "program_studentregistration"."end_date" >= %s))'),
+        select = SortedDict([( '_num_students', CATALOG_NUM_STUDENTS_SQL),
                              ('teacher_ids', 'SELECT list(DISTINCT espuser_id) FROM program_class_teachers Where program_class_teachers.classsubject_id=program_class.id'),
                              ('media_count', 'SELECT COUNT(*) FROM "qsdmedia_media" WHERE ("qsdmedia_media"."owner_id" = "program_class"."id") AND ("qsdmedia_media"."owner_type_id" = %s)'),
                              ('_index_qsd', 'SELECT list("qsd_quasistaticdata"."id") FROM "qsd_quasistaticdata" WHERE ("qsd_quasistaticdata"."name" = \'learn:index\' AND "qsd_quasistaticdata"."url" LIKE %s AND "qsd_quasistaticdata"."url" SIMILAR TO %s || "program_class"."id" || %s)'),
@@ -210,41 +216,23 @@ class ClassManager(ProcedureManager):
                          ]
         classes = classes.extra(select=select, select_params=select_params)
 
-        #   Allow customized orderings for the catalog.
-        #   These are the default ordering fields in descending order of priority.
-        if order_args_override:
-            order_args = order_args_override
-        else:
-            order_args = ['category__symbol', 'sections__meeting_times__start', '_num_students', 'id']
-            #   First check if there is an ordering specified for the program.
-            program_sort_fields = Tag.getProgramTag('catalog_sort_fields', program)
-            if program_sort_fields:
-                #   If you found one, use it.
-                order_args = program_sort_fields.split(',')
-        
         #   Order the QuerySet using the specified list.
-        classes = classes.order_by(*order_args)
+        classes = classes.order_by(*ClassManager.catalog_order_args(program, order_args_override))
         
         classes = classes.distinct()
-        classes = list(classes)
         
         #   Filter out duplicates by ID.  This is necessary because Django's ORM
         #   adds the related fields (e.g. sections__meeting_times) to the SQL
         #   SELECT statement and doesn't include them in the result.
         #   See http://docs.djangoproject.com/en/dev/ref/models/querysets/#s-distinct
-        counter = 0
-        index = 0
-        max_count = len(classes)
-        id_list = []
-        while counter < max_count:
-            cls = classes[index]
+        id_set = set()
+        unique_classes = []
+        for counter, cls in enumerate(classes):
             cls._temp_index = counter
-            if cls.id not in id_list:
-                id_list.append(cls.id)
-                index += 1
-            else:
-                classes.remove(cls)
-            counter += 1
+            if cls.id not in id_set:
+                id_set.add(cls.id)
+                unique_classes.append(cls)
+        classes = unique_classes
 
         # All class ID's; used by later query ugliness:
         class_ids = map(lambda x: x.id, classes)
@@ -271,7 +259,9 @@ class ClassManager(ProcedureManager):
 
         # Now, to combine all of the above
 
-        if len(classes) >= 1:
+        if isinstance(program, Program):
+            p = program
+        elif len(classes) >= 1:
             p = Program.objects.get(id=classes[0].parent_program_id)
             
         for c in classes:
@@ -285,13 +275,135 @@ class ClassManager(ProcedureManager):
                                  # they show up for all instances.
             
         return classes
-    catalog_cached.depend_on_model(lambda: ClassSubject)
-    catalog_cached.depend_on_model(lambda: ClassSection)
-    catalog_cached.depend_on_model(lambda: Media)
-    catalog_cached.depend_on_model(lambda: Tag)
+    #   Everyone looks at the catalog as soon as registration opens, and it
+    #   takes a while to build, so only let one process at a time build it.
+    catalog_cached = cache_function(catalog_cached, use_leases=True)
+    #   The catalog is invalidated per program, so that editing one program's
+    #   classes doesn't flush the catalog of every other program.
+    catalog_cached.get_or_create_token(('program',))
+    catalog_cached.depend_on_row(lambda: ClassSubject, lambda cls: ClassManager.catalog_key_sets(cls.parent_program_id))
+    catalog_cached.depend_on_row(lambda: ClassSection, lambda sec: ClassManager.catalog_key_sets(ClassManager.class_program_id(sec.parent_class_id)))
+    #   A Tag that isn't attached to anything (a global Tag) still flushes
+    #   every program's catalog; see catalog_key_sets_for_owner().
+    catalog_cached.depend_on_row(lambda: Media, lambda media: ClassManager.catalog_key_sets_for_owner(media.owner_type_id, media.owner_id))
+    catalog_cached.depend_on_row(lambda: Tag, lambda tag: ClassManager.catalog_key_sets_for_owner(tag.content_type_id, tag.object_id))
+    catalog_cached.set_warmer(lambda program: ClassSubject.objects.catalog(program))
     #catalog_cached.depend_on_row(lambda: UserBit, lambda bit: {},
     #                             lambda bit: bit.applies_to_verb('V/Flags/Registration/Enrolled')) # This will expire a *lot*, and the value that it saves can be gotten from cache (with effort) instead of from SQL.  Should go do that.
 
+    @staticmethod
+    def catalog_order_args(program, order_args_override=None):
+        """ The fields to order the catalog by. """
+        #   Allow customized orderings for the catalog.
+        if order_args_override:
+            return order_args_override
+        #   First check if there is an ordering specified for the program.
+        program_sort_fields = Tag.getProgramTag('catalog_sort_fields', program)
+        if program_sort_fields:
+            #   If you found one, use it.
+            return program_sort_fields.split(',')
+        #   These are the default ordering fields in descending order of priority.
+        return ['category__symbol', 'sections__meeting_times__start', '_num_students', 'id']
+
+    @cache_function
+    def catalog_ids(self, program):
+        """ The ids of the classes in the program's catalog, in catalog order.
+        Much cheaper than catalog(), since it doesn't fetch the classes. """
+        now = datetime.datetime.now()
+        enrolled_type = RegistrationType.get_map(include=['Enrolled'], category='student')['Enrolled']
+
+        classes = self.filter(self.approved(return_q_obj=True)).filter(parent_program=program)
+        classes = classes.extra(select={'_num_students': CATALOG_NUM_STUDENTS_SQL}, select_params=[enrolled_type.id, now, now])
+        classes = classes.order_by(*ClassManager.catalog_order_args(program))
+
+        #   As in catalog_cached(), ordering by related fields gives duplicates
+        id_set = set()
+        class_ids = []
+        for class_id, num_students in classes.values_list('id', '_num_students'):
+            if class_id not in id_set:
+                id_set.add(class_id)
+                class_ids.append(class_id)
+        return class_ids
+    catalog_ids.get_or_create_token(('program',))
+    catalog_ids.depend_on_cache(catalog_cached, lambda program=wildcard, **kwargs: {'program': program})
+
+    def catalog_snapshot(self, program):
+        """ The program's catalog as JSON-ready data, for catalog_json.
+
+        This is put together from one precomputed entry per class (see
+        ClassSubject.catalog_entry), so that editing a class, or adding a
+        student to it, only means rebuilding that class's entry rather than
+        rerunning the whole catalog query. Enrollments and capacities change
+        too often to be kept in the entries; they are filled in here. """
+        return list(self.iter_catalog_snapshot(program))
+
+    def iter_catalog_snapshot(self, program, chunk_size=CATALOG_CHUNK_SIZE):
+        """ Generate the entries of catalog_snapshot() one at a time.
+
+        Entries are fetched and completed chunk_size classes at a time, so
+        that no single query has to cover the whole catalog. """
+        class_ids = self.catalog_ids(program)
+        capacities = program.capacity_by_section_id()
+        for start in xrange(0, len(class_ids), chunk_size):
+            chunk_ids = class_ids[start:start + chunk_size]
+            entries = ClassSubject.catalog_entry.get_many([[class_id] for class_id in chunk_ids])
+
+            #   Build the missing entries all at once, the same way
+            #   catalog_entry() would; catalog_ids() has already picked out
+            #   the approved classes.
+            missing_ids = [class_id for class_id, entry in zip(chunk_ids, entries) if entry is None]
+            if missing_ids:
+                classes = self.catalog_cached(program, force_all=True, initial_queryset=self.filter(id__in=missing_ids), use_cache=False)
+                new_entries = dict([(cls.id, cls.catalog_data()) for cls in classes])
+                ClassSubject.catalog_entry.set_many([([class_id], entry) for class_id, entry in new_entries.items()])
+                entries = [entry if entry is not None else new_entries.get(class_id) for class_id, entry in zip(chunk_ids, entries)]
+                entries = [entry for entry in entries if entry is not None]
+
+            section_ids = [sec['id'] for entry in entries for sec in entry['get_sections']]
+            counts = enrollment_counts.get_counts(section_ids)
+            for entry in entries:
+                for sec in entry['get_sections']:
+                    sec['num_students'] = counts[sec['id']]
+                    sec['capacity'] = capacities.get(sec['id'])
+                entry['num_students'] = sum([sec['num_students'] for sec in entry['get_sections']])
+                yield entry
+
+    @staticmethod
+    def catalog_key_sets(program):
+        """ Key sets of catalog_cached to flush when a program's classes change.
+        Catalogs built with program=None span every program, so they go too. """
+        return [{'program': program}, {'program': None}]
+
+    @staticmethod
+    def class_program_id(class_id):
+        """ The id of the program that the class with this id belongs to, or
+        None if there is no such class; one query, for just the id. """
+        program_ids = ClassSubject.objects.filter(id=class_id).values_list('parent_program', flat=True)
+        if program_ids:
+            return program_ids[0]
+        return None
+
+    @staticmethod
+    def catalog_key_sets_for_owner(content_type_id, object_id):
+        """ Key sets of catalog_cached to flush when an object attached to
+        the given generic foreign key target (e.g. a Media or Tag) changes.
+
+        Global objects, such as program-independent Tags, can affect every
+        program's catalog, so they flush all of them.  The content types are
+        looked up through ContentType's own cache, so only objects attached
+        to a class cost a query (for the class's program). """
+        if content_type_id is None:
+            return {}
+        if content_type_id == ContentType.objects.get_for_model(Program).id:
+            return ClassManager.catalog_key_sets(object_id)
+        if content_type_id == ContentType.objects.get_for_model(ClassSubject).id:
+            program_id = ClassManager.class_program_id(object_id)
+            if program_id is not None:
+                return ClassManager.catalog_key_sets(program_id)
+            return None
+        #   Attached to something that isn't part of the catalog
+        return None
+
     #perhaps make it program-specific?
     @staticmethod
     def is_class_index_qsd(qsd):
@@ -351,25 +463,16 @@ class ClassSection(models.Model):
     
     @classmethod
     def prefetch_catalog_data(cls, queryset):
-        """ Take a queryset of a set of ClassSubject's, and annotate each class in it with the '_count_students' and 'event_ids' fields (used internally when available by many functions to save on queries later) """
-        now = datetime.datetime.now()
-        enrolled_type = RegistrationType.get_map()['Enrolled']
-
-        select = SortedDict([( '_count_students', 'SELECT COUNT(DISTINCT "program_studentregistration"."user_id") FROM "program_studentregistration" WHERE ("program_studentregistration"."relationship_id" = %s AND "program_studentregistration"."section_id" = "program_classsection"."id" AND ("program_studentregistration"."start_date" IS NULL OR "program_studentregistration"."start_date" <= %s) AND ("program_studentregistration"."end_date" IS NULL OR "program_studentregistration"."end_date" >= %s))'),
-                             ('event_ids', 'SELECT list("cal_event"."id") FROM "cal_event", "program_classsection_meeting_times" WHERE ("program_classsection_meeting_times"."event_id" = "cal_event"."id" AND "program_classsection_meeting_times"."classsection_id" = "program_classsection"."id")')])
-        
-        select_params = [ enrolled_type.id,
-                          now,
-                          now,
-                         ]
+        """ Take a queryset of a set of ClassSubject's, and annotate each class in it with the 'event_ids' field (used internally when available by many functions to save on queries later) """
+        select = SortedDict([('event_ids', 'SELECT list("cal_event"."id") FROM "cal_event", "program_classsection_meeting_times" WHERE ("program_classsection_meeting_times"."event_id" = "cal_event"."id" AND "program_classsection_meeting_times"."classsection_id" = "program_classsection"."id")')])
 
-        sections = queryset.extra(select=select, select_params=select_params)
+        sections = queryset.extra(select=select)
         sections = list(sections)
         section_ids = map(lambda x: x.id, sections)
 
         # Now, go get some events...
 
-        events = Event.objects.filter(meeting_times__in=section_ids).distinct()
+        events = Event.objects.filter(meeting_times__in=section_ids).distinct().select_related('event_type')
 
         events_by_id = {}
         for e in events:
@@ -382,6 +485,24 @@ class ClassSection(models.Model):
             s._events.sort(cmp=lambda e1, e2: cmp(e1.start, e2.start))
 
         return sections
+
+    def catalog_data(self):
+        """ This section as JSON-ready data for the catalog, leaving out the
+        enrollment and capacity; see ClassSubject.catalog_data(). """
+        return { 'id': self.id,
+                 'status': self.status,
+                 'duration': str(self.duration) if self.duration is not None else None,
+                 'get_meeting_times': [{ 'id': event.id,
+                                         'program': event.program_id,
+                                         'start': event.start.strftime(CATALOG_TIME_FORMAT),
+                                         'end': event.end.strftime(CATALOG_TIME_FORMAT),
+                                         'short_description': event.description,
+                                         'event_type': { 'id': event.event_type.id,
+                                                         'description': event.event_type.description
+                                                         },
+                                         'priority': event.priority,
+                                         } for event in self._events],
+                 }
     
     @cache_function
     def get_meeting_times(self):
@@ -987,15 +1108,21 @@ class ClassSection(models.Model):
     @cache_function
     def num_students(self, verbs=['Enrolled']):
         if verbs == ['Enrolled']:
-            if not hasattr(self, '_count_students'):
-                self._count_students = self.students(verbs).count()
-            return self._count_students
+            return enrollment_counts.get_count(self)
         return self.students(verbs).count()
     num_students.depend_on_row(lambda: StudentRegistration, lambda reg: {'self': reg.section})
 
+    def _warm_num_students(program):
+        #   Count the whole program's enrollments at once, so that filling
+        #   in each section's num_students only takes cache lookups
+        enrollment_counts.get_program_counts(program)
+        ClassSection.num_students.call_many([(sec,) for sec in program.sections()])
+    num_students.set_warmer(_warm_num_students)
+    _warm_num_students = staticmethod(_warm_num_students)
+
     @cache_function
     def count_enrolled_students(self):
-        return self.num_students(use_cache=False)
+        return enrollment_counts.get_count(self)
     count_enrolled_students.depend_on_row(lambda: StudentRegistration, lambda reg: {'self': reg.section})
 
     enrolled_students = DerivedField(models.IntegerField, count_enrolled_students)(null=False, default=0)
@@ -1172,17 +1299,18 @@ class ClassSection(models.Model):
         #   Stop all active or pending registrations
         if prereg_verb:
             qs = StudentRegistration.valid_objects(now).filter(relationship__name=prereg_verb, section=self, user=user)
-            qs.update(end_date=now)
-            #   print 'Expired %s' % qs
         else:
             qs = StudentRegistration.valid_objects(now).filter(section=self, user=user)
-            qs.update(end_date=now)
-            #   print 'Expired %s' % qs
+        qs.update(end_date=now)
+        #   print 'Expired %s' % qs
+        #   The signal below may not be sent, since qs has just been emptied
+        enrollment_counts.invalidate([self])
             
         #   Explicitly fire the signals for saving a StudentRegistration in order to update caches
         #   since it doesn't get sent by update() above
         if qs.exists():
-            signals.post_save.send(sender=StudentRegistration, instance=qs[0])
+            reg = qs[0]
+            signals.post_save.send(sender=StudentRegistration, instance=reg)
             
         #   If the student had blank application question responses for this class, remove them.
         app = ESPUser(user).getApplication(self.parent_program, create=False)
@@ -1493,6 +1621,8 @@ class ClassSubject(models.Model, CustomFormsLinkModel):
         return result
         
     def num_students(self, verbs=['Enrolled']):
+        if verbs == ['Enrolled']:
+            return sum(enrollment_counts.get_counts(self.get_sections()).values())
         result = 0
         for sec in self.get_sections():
             result += sec.num_students(verbs)
@@ -1553,6 +1683,44 @@ class ClassSubject(models.Model, CustomFormsLinkModel):
         
         super(ClassSubject, self).delete()
 
+    def catalog_data(self):
+        """ This class as JSON-ready data for the catalog, leaving out the
+        enrollment numbers. Only works on classes that came out of
+        ClassSubject.objects.catalog(). """
+        return { 'id': self.id,
+                 'title': self.title,
+                 'parent_program': self.parent_program_id,
+                 'category': self.category.catalog_data(),
+                 'class_info': self.class_info,
+                 'grade_min': self.grade_min,
+                 'grade_max': self.grade_max,
+                 'class_size_min': self.class_size_min,
+                 'class_size_max': self.class_size_max,
+                 'schedule': self.schedule,
+                 'prereqs': self.prereqs,
+                 'session_count': self.session_count,
+                 'teachers': [{ 'id': t.id,
+                                'first_name': t.first_name,
+                                'last_name': t.last_name,
+                                'username': t.username,
+                              } for t in self._teachers],
+                 'get_sections': [sec.catalog_data() for sec in self._sections],
+                 'num_questions': self.numStudentAppQuestions()
+                 }
+
+    @cache_function
+    def catalog_entry(self):
+        """ catalog_data(), cached; see ClassManager.catalog_snapshot(). """
+        classes = ClassSubject.objects.catalog_cached(self.parent_program, force_all=True, initial_queryset=ClassSubject.objects.filter(id=self.id), use_cache=False)
+        return classes[0].catalog_data()
+    catalog_entry.depend_on_row(lambda: ClassSubject, 'self')
+    catalog_entry.depend_on_row(lambda: ClassSection, lambda sec: {'self': sec.parent_class})
+    catalog_entry.depend_on_m2m(lambda: ClassSubject, 'teachers', lambda cls, teacher: {'self': cls})
+    catalog_entry.depend_on_m2m(lambda: ClassSection, 'meeting_times', lambda sec, event: {'self': sec.parent_class})
+    catalog_entry.depend_on_row(lambda: ClassCategories, lambda category: {})
+    catalog_entry.depend_on_row(lambda: get_model('program', 'StudentAppQuestion'), lambda question: {'self': question.subject} if question.subject_id else None)
+    catalog_entry.set_warmer(lambda program: ClassSubject.objects.catalog_snapshot(program))
+
     def numStudentAppQuestions(self):
         # This field may be prepopulated by .objects.catalog()
         if not hasattr(self, "_studentapps_count"):
@@ -2058,6 +2226,12 @@ class ClassCategories(models.Model):
 
     def __unicode__(self):
         return u'%s (%s)' % (self.category, self.symbol)
+
+    def catalog_data(self):
+        return { 'id': self.id,
+                 'category': self.category,
+                 'symbol': self.symbol
+                 }
         
         
     @staticmethod
@@ -2080,6 +2254,66 @@ def sections_in_program_by_id(prog):
 sections_in_program_by_id.depend_on_model(ClassSection)
 sections_in_program_by_id.depend_on_model(ClassSubject)
 
+def compute_capacities(prog, section_ids):
+    """ Works out ClassSection.capacity for each of the given sections of prog,
+    the same way as ClassSection._get_capacity(), but with a fixed number of
+    queries rather than several per section.  Returns a dictionary keyed by
+    section id. """
+    options = prog.getModuleExtension('StudentClassRegModuleInfo')
+    section_ids = list(section_ids)
+    sections = list(ClassSection.objects.filter(id__in=section_ids).values('id', 'max_class_capacity', 'parent_class', 'parent_class__class_size_max', 'parent_class__class_size_optimal'))
+
+    #   The rooms each section is in at its first meeting time
+    first_times = {}
+    for (section_id, event_id) in ClassSection.meeting_times.through.objects.filter(classsection__in=section_ids).order_by('event__start').values_list('classsection', 'event'):
+        first_times.setdefault(section_id, event_id)
+    rooms = defaultdict(dict)
+    assignments = ResourceAssignment.objects.filter(target__in=section_ids, resource__res_type=ResourceType.get_or_create('Classroom')).values_list('target', 'resource', 'resource__event', 'resource__num_students')
+    for (section_id, resource_id, event_id, num_students) in assignments:
+        if section_id in first_times and event_id == first_times[section_id]:
+            rooms[section_id][resource_id] = num_students
+
+    #   The largest allowable class size of each class
+    class_ids = set([sec['parent_class'] for sec in sections])
+    max_sizes = dict(ClassSubject.objects.filter(id__in=class_ids).annotate(max_size=Max('allowable_class_size_ranges__range_max')).values_list('id', 'max_size'))
+
+    def room_capacity(section_id):
+        rc = sum(rooms[section_id].values())
+        if options.apply_multiplier_to_room_cap:
+            rc = int(rc * options.class_cap_multiplier + options.class_cap_offset)
+        return rc
+
+    capacities = {}
+    for sec in sections:
+        has_rooms = len(rooms[sec['id']]) > 0
+        class_size_max = sec['parent_class__class_size_max']
+        class_size_optimal = sec['parent_class__class_size_optimal']
+        if sec['max_class_capacity'] is not None:
+            ans = sec['max_class_capacity']
+        elif not has_rooms:
+            ans = class_size_max
+        else:
+            ans = min(class_size_max, room_capacity(sec['id']))
+
+        if ans == None or ans == 0:
+            max_size = max_sizes.get(sec['parent_class'])
+            if max_size is not None and has_rooms:
+                ans = min(max(max_size, class_size_optimal), room_capacity(sec['id']))
+            elif class_size_optimal and has_rooms:
+                ans = min(class_size_optimal, room_capacity(sec['id']))
+            elif class_size_optimal:
+                ans = class_size_optimal
+            elif has_rooms:
+                ans = room_capacity(sec['id'])
+            else:
+                ans = 0
+
+        if not options.apply_multiplier_to_room_cap:
+            capacities[sec['id']] = int(ans * options.class_cap_multiplier + options.class_cap_offset)
+        else:
+            capacities[sec['id']] = int(ans)
+    return capacities
+
 def install():
     """ Initialize the default class categories. """
     category_dict = {
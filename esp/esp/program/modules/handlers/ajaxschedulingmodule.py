@@ -51,7 +51,23 @@ from collections                 import defaultdict
 from esp.cache                   import cache_function
 from uuid                        import uuid4 as get_uuid
 from esp.utils.decorators         import json_response
-import calendar, time, datetime
+import calendar, math, time, datetime
+
+#   Key sets for ajax_schedule_get_uuid, for the program that a changed row belongs to
+def _program_of_event(event):
+    if event is None or event.program_id is None:
+        return None
+    return {'prog': event.program_id}
+
+def _program_of_class(cls):
+    if cls is None:
+        return None
+    return {'prog': cls.parent_program_id}
+
+def _program_of_section(sec):
+    if sec is None:
+        return None
+    return _program_of_class(sec.parent_class)
 
 class AJAXSchedulingModule(ProgramModuleObj):
     """ This program module allows teachers to indicate their availability for the program. """
@@ -362,18 +378,47 @@ class AJAXSchedulingModule(ProgramModuleObj):
     def ajax_change_log(self, request, tl, one, two, module, extra, prog):
         cl = self.get_change_log(prog)
         last_fetched_index = int(request.GET['last_fetched_index'])
-        
-        #print "schedule_time", cl[0]['schedule_time']
-        #print "last fetched time", last_fetched_time
-        #print "len(cl)", len(cl)
+        return self.change_log_response(cl, cl.get_log(last_fetched_index, self.get_recent_indices(request)))
 
-        #check whether we have a log entry at least as old as the last fetched time
-        #if not, we return a command to reload instead of the log
-        #note: negative number implies we want to debug dump changelog
-        if cl.get_earliest_index() is not None and cl.get_earliest_index() > last_fetched_index:
-            return { "other" : [ { 'command' : "reload", 'earliest_index' : cl.get_earliest_index(), 'latest_index' : cl.get_latest_index(), 'time' : time.time() } ] }
+    #longest time that ajax_change_log_wait will hold on to a request
+    max_change_log_wait = 25
 
-        return { "changelog" : cl.get_log(last_fetched_index), 'other' : [ { 'time': time.time() } ] }
+    @aux_call
+    @needs_admin
+    @json_response()
+    def ajax_change_log_wait(self, request, tl, one, two, module, extra, prog):
+        """ Long-polling version of ajax_change_log: if nothing has changed since
+        last_fetched_index, waits for a change (or for the timeout, in seconds,
+        to pass) before responding.  Each waiting scheduler ties up a server
+        thread, but not the database. """
+
+        cl = self.get_change_log(prog)
+        last_fetched_index = int(request.GET['last_fetched_index'])
+        try:
+            timeout = float(request.GET.get('timeout', self.max_change_log_wait))
+        except ValueError:
+            timeout = None
+        if timeout is None or math.isnan(timeout) or math.isinf(timeout) or timeout < 0:
+            raise ESPError(False), "The timeout must be a non-negative number of seconds."
+        timeout = max(0, min(timeout, self.max_change_log_wait))
+        return self.change_log_response(cl, cl.wait_for_log(last_fetched_index, timeout, self.get_recent_indices(request)))
+
+    def get_recent_indices(self, request):
+        #the indices of the entries the client has gotten lately, other than
+        #the last fetched one, as a comma-separated list (see AJAXChangeLog.get_log)
+        try:
+            return [int(x) for x in request.GET.get('recent_indices', '').split(',') if x.strip()]
+        except ValueError:
+            raise ESPError(False), "The recent indices must be a comma-separated list of integers."
+
+    def change_log_response(self, cl, changelog):
+        #if the log no longer has everything since the last fetched index,
+        #we return a command to reload instead of the log
+        if changelog is None:
+            latest_index = cl.get_latest_index()
+            return { "other" : [ { 'command' : "reload", 'earliest_index' : cl.get_earliest_index(), 'latest_index' : latest_index, 'recent_indices' : cl.get_recent_indices(latest_index), 'time' : time.time() } ] }
+
+        return { "changelog" : changelog, 'other' : [ { 'time': time.time() } ] }
 
     @aux_call
     @needs_admin
@@ -382,20 +427,11 @@ class AJAXSchedulingModule(ProgramModuleObj):
         called in production, but it is annoying.  
         Clears the change log for this program. """
 
-        self.get_change_log(prog).entries.all().delete()
+        self.get_change_log(prog).clear()
         return HttpResponse('')
 
     def get_change_log(self, prog):
-        change_log = module_ext.AJAXChangeLog.objects.filter(program=prog)
-
-        if change_log.count() == 0:
-            change_log = module_ext.AJAXChangeLog()
-            change_log.update(prog)
-            change_log.save()
-        else:
-            change_log = change_log[0]
-
-        return change_log
+        return module_ext.AJAXChangeLog(prog)
 
     @aux_call
     @needs_admin
@@ -434,10 +470,13 @@ class AJAXSchedulingModule(ProgramModuleObj):
         return self.ajax_schedule_last_changed_helper(prog)
 
     def ajax_schedule_last_changed_helper(self, prog):
+        change_log = self.get_change_log(prog)
+        latest_index = change_log.get_latest_index()
         ret = { 'val': str(self.ajax_schedule_get_uuid(prog)),
                 'msg': 'UUID that changes every time the schedule is updated',
                 'time' : time.time(),
-                'latest_index' : self.get_change_log(prog).get_latest_index() }
+                'latest_index' : latest_index,
+                'recent_indices' : change_log.get_recent_indices(latest_index) }
 
         response = HttpResponse(content_type="application/json")
         simplejson.dump(ret, response)
@@ -449,16 +488,18 @@ class AJAXSchedulingModule(ProgramModuleObj):
         return get_uuid()
 
     # This function should be called iff the data returned by any of the other ajax_ JSON functions changes.
-    # So, cache it; and have the cache expire whenever any of the relevant models changes.
-    # Yeah, the cache will get expired quite often...; but, eh, it's a cheap function.
+    # So, cache it; and have the cache expire whenever any of the relevant rows of that program changes.
+    # (The program is passed around by id, so that working it out doesn't take more queries than it must.)
     ajax_schedule_get_uuid.get_or_create_token(('prog',))
-    ajax_schedule_get_uuid.depend_on_model(lambda: ResourceAssignment)
-    ajax_schedule_get_uuid.depend_on_model(lambda: Resource)
-    ajax_schedule_get_uuid.depend_on_model(lambda: ResourceRequest)
-    ajax_schedule_get_uuid.depend_on_model(lambda: Event)
-    ajax_schedule_get_uuid.depend_on_model(lambda: ClassSection)
-    ajax_schedule_get_uuid.depend_on_model(lambda: ClassSubject)
-    ajax_schedule_get_uuid.depend_on_model(lambda: UserAvailability)
+    ajax_schedule_get_uuid.depend_on_row(lambda: ResourceAssignment, lambda ra: _program_of_event(ra.resource.event))
+    ajax_schedule_get_uuid.depend_on_row(lambda: Resource, lambda res: _program_of_event(res.event))
+    ajax_schedule_get_uuid.depend_on_row(lambda: ResourceRequest, lambda rr: _program_of_section(rr.target) if rr.target_id else _program_of_class(rr.target_subj))
+    ajax_schedule_get_uuid.depend_on_row(lambda: Event, _program_of_event)
+    ajax_schedule_get_uuid.depend_on_row(lambda: ClassSection, _program_of_section)
+    ajax_schedule_get_uuid.depend_on_row(lambda: ClassSubject, _program_of_class)
+    ajax_schedule_get_uuid.depend_on_row(lambda: UserAvailability, lambda ua: _program_of_event(ua.event))
+    ajax_schedule_get_uuid.depend_on_m2m(lambda: ClassSection, 'meeting_times', lambda sec, event: _program_of_section(sec))
+    ajax_schedule_get_uuid.depend_on_m2m(lambda: ClassSubject, 'teachers', lambda cls, teacher: _program_of_class(cls))
 
     @cache_function
     def ajax_lunch_timeslots_cached(self, prog):
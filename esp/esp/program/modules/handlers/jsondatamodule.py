@@ -59,6 +59,46 @@ from datetime import datetime
 import operator
 import simplejson as json
 
+def _program_teachers(prog, class_ids, sections):
+    """ Returns the teachers of a program's classes, as needed by the
+        scheduling views below, in two queries.
+
+        sections is a list of the program's sections in order of ID, as
+        dictionaries with at least 'id', 'status', 'parent_class__id' and
+        'parent_class__status'.  The result is a dictionary mapping class IDs
+        to the IDs of their teachers, and a list of teachers (with their
+        availability and the non-rejected sections they teach) in the order
+        they first show up in the classes of class_ids. """
+    class_teachers = defaultdict(list)
+    teacher_names = {}
+    for row in ClassSubject.teachers.through.objects.filter(classsubject__parent_program=prog).order_by('id').values('classsubject', 'espuser', 'espuser__first_name', 'espuser__last_name'):
+        class_teachers[row['classsubject']].append(row['espuser'])
+        teacher_names[row['espuser']] = (row['espuser__first_name'], row['espuser__last_name'])
+
+    avail_for_user = defaultdict(list)
+    for avail in UserAvailability.objects.filter(event__program=prog).values('user_id', 'event_id'):
+        if avail['user_id'] in teacher_names:
+            avail_for_user[avail['user_id']].append(avail['event_id'])
+
+    teachers = []
+    teacher_dicts = {}
+    for class_id in class_ids:
+        for teacher_id in class_teachers[class_id]:
+            if teacher_id not in teacher_dicts:
+                first_name, last_name = teacher_names[teacher_id]
+                teacher_dicts[teacher_id] = {'id': teacher_id, 'first_name': first_name, 'last_name': last_name, 'availability': avail_for_user[teacher_id], 'sections': []}
+                teachers.append(teacher_dicts[teacher_id])
+
+    #   Same as ESPUser.getTaughtSectionsFromProgram()
+    for section in sections:
+        if section['status'] == -10 or section['parent_class__status'] == -10:
+            continue
+        for teacher_id in class_teachers[section['parent_class__id']]:
+            if teacher_id in teacher_dicts:
+                teacher_dicts[teacher_id]['sections'].append(section['id'])
+
+    return class_teachers, teachers
+
 class JSONDataModule(ProgramModuleObj, CoreModule):
     """ A program module dedicated to returning program-specific data in JSON form. """
 
@@ -186,12 +226,15 @@ class JSONDataModule(ProgramModuleObj, CoreModule):
             'enrolled_students': 'num_students'})
     @cached_module_view
     def sections(prog):
-        teacher_dict = {}
-        teachers = []
+        #   A fixed number of queries for the whole program, however many
+        #   sections it has: one for the sections, then the teachers and
+        #   their availability (see _program_teachers()).
         sections = list(prog.sections().values(
                 'id',
                 'status',
+                'duration',
                 'parent_class__id',
+                'parent_class__status',
                 'parent_class__category__symbol',
                 'parent_class__category__id',
                 'parent_class__grade_max',
@@ -199,28 +242,23 @@ class JSONDataModule(ProgramModuleObj, CoreModule):
                 'parent_class__title',
                 'parent_class__class_size_max',
                 'enrolled_students'))
+        class_teachers, teachers = _program_teachers(prog, [sec['parent_class__id'] for sec in sections], sections)
+        #   Sections are in order of ID, so this numbers them within their
+        #   classes the same way ClassSection.index() does.
+        class_counts = defaultdict(int)
         for section in sections:
-            s = ClassSection.objects.get(id=section['id'])
-            section['index'] = s.index()
-            section['emailcode'] = s.emailcode()
-            section['length'] = float(s.duration)
-            section['teachers'] = [t.id for t in s.parent_class.get_teachers()]
-            for t in s.parent_class.get_teachers():
-                if teacher_dict.has_key(t.id):
-                    continue
-                teacher_dict[t.id] = True
-                # Build up teacher availability
-                availabilities = UserAvailability.objects.filter(user__in=s.parent_class.get_teachers()).filter(event__program = prog).values('user_id', 'event_id')
-                avail_for_user = defaultdict(list)
-                for avail in availabilities:
-                    avail_for_user[avail['user_id']].append(avail['event_id'])
-                teachers.append({'id': t.id, 'first_name': t.first_name, 'last\
-_name': t.last_name, 'availability': avail_for_user[t.id], 'sections': [x.id for x in t.getTaughtSectionsFromProgram(prog)]})
-    
+            class_id = section['parent_class__id']
+            class_counts[class_id] += 1
+            section['index'] = class_counts[class_id]
+            section['emailcode'] = '%s%ds%d' % (section['parent_class__category__symbol'], class_id, section['index'])
+            section['length'] = float(section.pop('duration'))
+            section['teachers'] = class_teachers[class_id]
+            del section['parent_class__status']
+
         return {'sections': sections, 'teachers': teachers}
     sections.cached_function.depend_on_row(ClassSection, lambda sec: {'prog': sec.parent_class.parent_program})
     sections.cached_function.depend_on_row(ClassSubject, lambda subj: {'prog': subj.parent_program})
-    sections.cached_function.depend_on_model(UserAvailability)
+    sections.cached_function.depend_on_row(UserAvailability, lambda ua: {'prog': ua.event.program})
     # Put this import here rather than at the toplevel, because wildcard messes things up
     from esp.cache.key_set import wildcard
     sections.cached_function.depend_on_cache(ClassSubject.get_teachers, lambda self=wildcard, **kwargs: {'prog': self.parent_program})
@@ -237,37 +275,33 @@ _name': t.last_name, 'availability': avail_for_user[t.id], 'sections': [x.id for
             })
     @cached_module_view
     def class_subjects(prog):
-        teacher_dict = {}
-        teachers = []
+        #   As with sections(), a fixed number of queries for the whole program
         classes = list(prog.classes().values(
                 'id',
                 'status',
                 'title',
+                'duration',
                 'category__symbol',
                 'grade_max',
                 'grade_min'))
+        sections = list(prog.sections().values('id', 'status', 'parent_class__id', 'parent_class__status'))
+        class_teachers, teachers = _program_teachers(prog, [cls['id'] for cls in classes], sections)
 
+        class_sections = defaultdict(list)
+        for section in sections:
+            class_sections[section['parent_class__id']].append(section['id'])
         for cls in classes:
-            c = ClassSubject.objects.get(id=cls['id'])
-            class_teachers = c.get_teachers()
-            cls['emailcode'] = c.emailcode()
-            cls['length'] = float(c.duration)
-            cls['sections'] = [s.id for s in c.sections.all()]
-            cls['teachers'] = [t.id for t in class_teachers]
-            for t in class_teachers:
-                if teacher_dict.has_key(t.id):
-                    continue
-                teacher_dict[t.id] = True
-                # Build up teacher availability
-                availabilities = UserAvailability.objects.filter(user__in=class_teachers).filter(event__program=prog).values('user_id', 'event_id')
-                avail_for_user = defaultdict(list)
-                for avail in availabilities:
-                    avail_for_user[avail['user_id']].append(avail['event_id'])
-                teachers.append({'id': t.id, 'first_name': t.first_name, 'last\
-_name': t.last_name, 'availability': avail_for_user[t.id], 'sections': [x.id for x in t.getTaughtSectionsFromProgram(prog)]})
-    
+            cls['emailcode'] = '%s%d' % (cls['category__symbol'], cls['id'])
+            #   Classes don't always have a duration of their own
+            duration = cls.pop('duration')
+            cls['length'] = float(duration) if duration is not None else None
+            cls['sections'] = class_sections[cls['id']]
+            cls['teachers'] = class_teachers[cls['id']]
+
         return {'classes': classes, 'teachers': teachers}
     class_subjects.cached_function.depend_on_row(ClassSubject, lambda cls: {'prog': cls.parent_program})
+    class_subjects.cached_function.depend_on_row(ClassSection, lambda sec: {'prog': sec.parent_class.parent_program})
+    class_subjects.cached_function.depend_on_row(UserAvailability, lambda ua: {'prog': ua.event.program})
     class_subjects.cached_function.depend_on_cache(ClassSubject.get_teachers, lambda cls=wildcard, **kwargs: {'prog': cls.parent_program})
 
     @aux_call
@@ -34,8 +34,6 @@ Learning Unlimited, Inc.
 """
 
 import simplejson
-from datetime import datetime
-from decimal import Decimal
 from collections import defaultdict
 
 from django.db.models.query import Q
@@ -49,6 +47,7 @@ from django.core.cache import cache
 from esp.program.modules.base import ProgramModuleObj, needs_teacher, needs_student, needs_admin, usercheck_usetl, meets_deadline, meets_any_deadline, main_call, aux_call
 from esp.datatree.models import *
 from esp.program.models  import ClassSubject, ClassSection, ClassCategories, RegistrationProfile, ClassImplication, StudentRegistration
+from esp.program import enrollment_counts
 from esp.program.modules import module_ext
 from esp.web.util        import render_to_response
 from esp.middleware      import ESPError, AjaxError, ESPError_Log, ESPError_NoLog
@@ -62,69 +61,6 @@ from esp.middleware.threadlocalrequest import get_current_request
 from esp.utils.query_utils import nest_Q
 
 
-def json_encode(obj):
-    if isinstance(obj, ClassSubject):
-        return { 'id': obj.id,
-                 'title': obj.title,
-                 'parent_program': obj.parent_program_id,
-                 'category': obj.category,
-                 'class_info': obj.class_info,
-#                 'allow_lateness': obj.allow_lateness,
-                 'grade_min': obj.grade_min,
-                 'grade_max': obj.grade_max,
-                 'class_size_min': obj.class_size_min,
-                 'class_size_max': obj.class_size_max,
-                 'schedule': obj.schedule,
-                 'prereqs': obj.prereqs,
-#                 'requested_special_resources': obj.requested_special_resources,
-#                 'directors_notes': obj.directors_notes,
-#                 'requested_room': obj.requested_room,
-                 'session_count': obj.session_count,
-                 'num_students': obj.num_students(),
-                 'teachers': obj._teachers,
-                 'get_sections': obj._sections,                         
-                 'num_questions': obj.numStudentAppQuestions()
-                 }
-    elif isinstance(obj, ClassSection):
-        return { 'id': obj.id,
-                 'status': obj.status,
-                 'duration': obj.duration,
-                 'get_meeting_times': obj._events,
-                 'num_students': obj.num_students(),
-                 'capacity': obj.capacity
-                 }
-    elif isinstance(obj, ClassCategories):
-        return { 'id': obj.id,
-                 'category': obj.category,
-                 'symbol': obj.symbol
-                 }
-    elif isinstance(obj, Event):
-        return { 'id': obj.id,
-                 'program': obj.program_id,
-                 'start': obj.start,
-                 'end': obj.end,
-                 'short_description': obj.description,
-                 'event_type': obj.event_type,
-                 'priority': obj.priority,
-                 }
-    elif isinstance(obj, EventType):
-        return { 'id': obj.id,
-                 'description': obj.description
-                 }
-    elif isinstance(obj, User):
-        return { 'id': obj.id,
-                 'first_name': obj.first_name,
-                 'last_name': obj.last_name,
-                 'username': obj.username,
-                 }
-    elif isinstance(obj, Decimal):
-        return str(obj)
-    elif isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%dT%H:%M:%S')
-    else:
-        raise TypeError(repr(obj) + " is not JSON serializable")
-
-
 # student class picker module
 class StudentClassRegModule(ProgramModuleObj, module_ext.StudentClassRegModuleInfo):
     @classmethod
@@ -605,13 +541,19 @@ class StudentClassRegModule(ProgramModuleObj, module_ext.StudentClassRegModuleIn
     @aux_call
     def catalog_json(self, request, tl, one, two, module, extra, prog, timeslot=None):
         """ Return the program class catalog """
-        # using .extra() to select all the category text simultaneously
-        classes = ClassSubject.objects.catalog(self.program)        
-        
-        resp = HttpResponse(mimetype='application/json')
-        
-        simplejson.dump(list(classes), resp, default=json_encode)
-        
+        #   Sent a class at a time as the snapshot is put together, rather
+        #   than all at once at the end; this gives the same JSON as dumping
+        #   catalog_snapshot() in one go.
+        def catalog_chunks():
+            yield '['
+            for i, entry in enumerate(ClassSubject.objects.iter_catalog_snapshot(self.program)):
+                if i > 0:
+                    yield ', '
+                yield simplejson.dumps(entry)
+            yield ']'
+
+        resp = HttpResponse(catalog_chunks(), mimetype='application/json')
+        resp.streaming = True
         return resp
 
 
@@ -629,8 +571,23 @@ class StudentClassRegModule(ProgramModuleObj, module_ext.StudentClassRegModuleIn
         simplejson.dump(verb_list, resp)
         return resp
 
+    @aux_call
     def catalog_student_count_json(self, request, tl, one, two, module, extra, prog, timeslot=None):
-        clean_counts = prog.student_counts_by_section_id()
+        """ Return the number of students enrolled in each section.
+
+        If a 'since' version is given, return {'version': ..., 'counts': ...,
+        'full': ...} where counts only holds the sections whose enrollment
+        changed since that version (unless full is true), and version is to
+        be passed as 'since' next time.  Use since=0 to start. """
+        if 'since' not in request.GET:
+            clean_counts = prog.student_counts_by_section_id()
+        else:
+            try:
+                since = int(request.GET['since'])
+            except ValueError:
+                since = None
+            version, counts, full = enrollment_counts.get_program_counts_since(prog, since)
+            clean_counts = {'version': version, 'counts': counts, 'full': full}
         resp = HttpResponse(mimetype='application/json')
         simplejson.dump(clean_counts, resp)
         return resp
@@ -33,9 +33,13 @@ Learning Unlimited, Inc.
   Email: web-team@lists.learningu.org
 """
 
+import threading
 import time
 from datetime import timedelta
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Q
+from esp.cache.batch import queue_callback
 from esp.datatree.models import *
 from esp.program.modules.base import ProgramModuleObj
 from esp.db.fields import AjaxForeignKey
@@ -391,9 +395,17 @@ class CreditCardSettings(models.Model):
     invoice_prefix = models.CharField(max_length=80, default=settings.INSTITUTION_NAME.lower())
 
 class AJAXChangeLogEntry(models.Model):
+    """ One change to a program's schedule, made through the AJAX scheduler.
 
-    # unique index in change_log of this entry
-    index = models.IntegerField()
+    Entries are only ever inserted, and deleted once they are old; nothing
+    updates them.  The auto-incrementing id serves as the entry's index in the
+    program's change log: indices increase with every change, though they
+    aren't consecutive within a program, and an entry may be committed after
+    ones with higher indices.  (The migration adds an index on (program, id),
+    so that reading a program's recent changes is one range scan.) """
+
+    # program whose schedule was changed
+    program = AjaxForeignKey(Program)
 
     # comma-separated list of integer timeslots
     timeslots = models.CharField(max_length=256)
@@ -410,11 +422,9 @@ class AJAXChangeLogEntry(models.Model):
     # time we entered this
     time = models.FloatField()
 
-    def update(self, index, timeslots, room_name, cls_id):
-        self.index = index
-        self.timeslots = ','.join([str(x) for x in timeslots])
-        self.room_name = room_name
-        self.cls_id = cls_id
+    @property
+    def index(self):
+        return self.id
 
     def save(self, *args, **kwargs):
         self.time = time.time()
@@ -429,64 +439,168 @@ class AJAXChangeLogEntry(models.Model):
         else:
             return "unknown"
 
-class AJAXChangeLog(models.Model):
-    # program this change log stores changes for
-    program = AjaxForeignKey(Program)
+    def to_dict(self):
+        return {    'index'     : self.index,
+                    'room_name' : self.room_name,
+                    'id'        : self.cls_id,
+                    'timeslots' : self.getTimeslots(),
+                    'user'      : self.getUserName() }
 
-    # many to many for entries in this change log
-    entries = models.ManyToManyField(AJAXChangeLogEntry)
+#   Notified whenever this process publishes a change to a change log, so that
+#   requests waiting in AJAXChangeLog.wait_for_log() can check it right away.
+#   Changes made by other processes are picked up through the cache instead.
+_change_log_changed = threading.Condition()
+
+class AJAXChangeLog(object):
+    """ The log of changes to a program's schedule, which the AJAX scheduler
+    polls to pick up other admins' changes.  Not stored itself; it just
+    reads and writes the program's AJAXChangeLogEntry rows. """
 
     # log entries older than this are deleted
     max_log_age = timedelta(hours=12).total_seconds()
 
-    def update(self, program):
-        self.program = program
-        self.age = time.time()
+    # how often wait_for_log() looks at the cache for changes made elsewhere
+    poll_interval = 0.5
 
-    def prune(self):
-        max_time = time.time() - self.max_log_age
-        self.entries.filter(time__lte=max_time).delete()
-        self.save()
-
-    def append(self, timeslots, room_name, cls_id, user=None):
-        next_index = self.get_latest_index() + 1
+    # longest that an entry can go uncommitted after it's saved (i.e. the
+    # longest a scheduling request takes); get_log() looks this far back for
+    # entries that were committed after ones with higher indices
+    commit_window = 60
 
-        entry = AJAXChangeLogEntry()
-        entry.update(next_index, timeslots, room_name, cls_id)
+    # how long wait_for_log() trusts a cached index that had nothing new
+    # behind it, before looking at the database again
+    recheck_interval = 5
 
-        if user:
-        	entry.user = user
-
-        entry.save()
-        self.save()
-        self.entries.add(entry)
-        self.save()
+    def __init__(self, program):
+        self.program = program
 
-    def get_latest_index(self):
-        index = self.entries.all().aggregate(models.Max('index'))['index__max']
+    def entries(self):
+        return AJAXChangeLogEntry.objects.filter(program=self.program)
 
-        if index is None:
-            index = 0
+    def latest_index_key(self):
+        # the latest index, if known; kept in the cache so waiting requests
+        # can watch for new entries without querying the database
+        return 'ajax_change_log_latest|%d' % self.program.id
 
-        return index
+    def changed(self, latest_index=None):
+        """ Tell waiting requests about a change to the log.  During a
+        request, this waits for the end of its invalidation batch (see
+        esp.cache.batch), which comes after the transaction is committed: a
+        waiting request that looked any earlier wouldn't see the change. """
+        queue_callback(lambda: self.publish(latest_index))
 
-    def get_earliest_index(self):
-        return self.entries.all().aggregate(models.Min('index'))['index__min']
+    def publish(self, latest_index):
+        if latest_index is None:
+            cache.delete(self.latest_index_key())
+        else:
+            cache.set(self.latest_index_key(), latest_index, int(self.max_log_age))
+        with _change_log_changed:
+            _change_log_changed.notify_all()
 
-        if index is None:
-            index = 0
+    def prune(self):
+        max_time = time.time() - self.max_log_age
+        self.entries().filter(time__lte=max_time).delete()
+        self.changed()
 
-        return index
+    def clear(self):
+        self.entries().delete()
+        self.changed()
 
-    def get_log(self, last_index):
-        new_entries = self.entries.filter(index__gt=last_index).order_by('index')
-        entry_list = list()
+    def append(self, timeslots, room_name, cls_id, user=None):
+        entry = AJAXChangeLogEntry(program=self.program, room_name=room_name, cls_id=cls_id, user=user)
+        entry.timeslots = ','.join([str(x) for x in timeslots])
+        entry.save()
+        self.changed(entry.id)
+        return entry
 
-        for entry in new_entries:
-            entry_list.append( {	'index'     : entry.index,
-                                    'room_name' : entry.room_name,
-                                    'id'    : entry.cls_id,
-                                    'timeslots' : entry.getTimeslots(),
-                                    'user'      : entry.getUserName() })
+    def get_latest_index(self):
+        indices = self.entries().order_by('-id').values_list('id', flat=True)[:1]
+        if len(indices) == 0:
+            return 0
+        return indices[0]
 
-        return entry_list
+    def get_earliest_index(self):
+        indices = self.entries().order_by('id').values_list('id', flat=True)[:1]
+        if len(indices) == 0:
+            return None
+        return indices[0]
+
+    def get_log(self, last_index, recent_indices=()):
+        """ Returns the entries the client hasn't seen, given the latest index
+        it has (last_index) and the indices of the other entries it got lately
+        (recent_indices), or None if some of them may have been pruned (or the
+        log cleared) since, in which case the client has to reload the whole
+        schedule.
+
+        Since entries can be committed out of order, an entry the client
+        doesn't have may have a lower index than last_index; so besides the
+        entries after last_index, this returns any from the commit_window
+        seconds before it that aren't in recent_indices.  The client should
+        apply entries in the order it gets them, which for late ones is the
+        order they were committed in, and may get one it already has if it
+        leaves it out of recent_indices.
+
+        The entry at last_index itself serves as a marker: if it's gone, so
+        may be others that came after it. """
+
+        new_entries = self.entries()
+        if last_index > 0:
+            late_entries = self.late_entries(last_index)
+            if late_entries is None:
+                return None
+            new_entries = new_entries.filter(Q(id__gt=last_index) | Q(id__in=late_entries.values('id'))).exclude(id__in=list(recent_indices))
+
+        return [entry.to_dict() for entry in new_entries.select_related('user').order_by('id')]
+
+    def late_entries(self, last_index):
+        """ The entries from the commit_window seconds before the one at
+        last_index, which may have been committed after it; or None if the
+        entry at last_index is gone. """
+
+        marker_times = list(self.entries().filter(id=last_index).values_list('time', flat=True))
+        if len(marker_times) == 0:
+            return None
+        return self.entries().filter(time__gte=marker_times[0] - self.commit_window, id__lt=last_index)
+
+    def get_recent_indices(self, last_index):
+        """ The indices that a client which has everything up to last_index
+        should pass to get_log() as recent_indices, to start with. """
+
+        late_entries = self.late_entries(last_index)
+        if late_entries is None:
+            return []
+        return list(late_entries.values_list('id', flat=True))
+
+    def wait_for_log(self, last_index, timeout, recent_indices=()):
+        """ Like get_log(), but if nothing has changed since last_index, waits
+        up to timeout seconds for something to, and then returns it.
+
+        While waiting, this only looks at the cache.  The database is read when
+        the cached latest index differs from last_index (or is missing), and
+        once more at the end, in case two processes appending at once left
+        the cache behind.  A cached index that turns out not to have any new
+        entries behind it (say, because another process's older append was
+        published last) isn't looked up again for recheck_interval seconds, so
+        that it doesn't send us back to the database on every poll. """
+
+        if not timeout > 0:
+            timeout = 0
+        deadline = time.time() + timeout
+        # when to look at the database again for each cached index that had
+        # nothing new behind it
+        recheck_times = {}
+        while True:
+            cached_index = cache.get(self.latest_index_key())
+            if cached_index != last_index and time.time() >= recheck_times.get(cached_index, 0):
+                log = self.get_log(last_index, recent_indices)
+                if log != []:
+                    return log
+                # nothing new, so last_index is the latest one for now
+                recheck_times[cached_index] = time.time() + self.recheck_interval
+                cache.add(self.latest_index_key(), last_index, int(self.max_log_age))
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return self.get_log(last_index, recent_indices)
+            with _change_log_changed:
+                _change_log_changed.wait(min(self.poll_interval, remaining))
@@ -34,6 +34,7 @@ Learning Unlimited, Inc.
 
 from esp.program.tests import ProgramFrameworkTest
 from django.utils import simplejson as json
+import threading
 import time
 
 class AJAXSchedulingModuleTestBase(ProgramFrameworkTest):
@@ -118,6 +119,17 @@ class AJAXSchedulingModuleTestBase(ProgramFrameworkTest):
     def unschedule_class(self, section_id):
         resp = self.client.post(self.schedule_class_url, {'action': 'deletereg', 'cls': section_id})
         assert resp.status_code == 200 #successful deleting of class
+
+    def getLatestIndex(self):
+        #index of the latest change log entry, as the scheduler page first sees it
+        response = self.client.get(self.ajax_url_base + 'ajax_schedule_last_changed')
+        return json.loads(response.content)['latest_index']
+
+    def getChangeLogCursor(self):
+        #the change log parameters that the scheduler page starts out with:
+        #the latest index, and the entries it already has from just before it
+        response = json.loads(self.client.get(self.ajax_url_base + 'ajax_schedule_last_changed').content)
+        return {'last_fetched_index': response['latest_index'], 'recent_indices': ','.join([str(i) for i in response['recent_indices']])}
         
 class AJAXSchedulingModuleTest(AJAXSchedulingModuleTestBase):        
 
@@ -231,12 +243,12 @@ class AJAXSchedulingModuleTest(AJAXSchedulingModuleTestBase):
         (section, rooms, times) = self.scheduleClass()
         self.unschedule_class(section.id)
 
-        beforeSchedule = time.time()
+        beforeSchedule = self.getChangeLogCursor()
         # Schedule one class.
         self.scheduleClass()
 
         #fetch the changelog
-        changelog_response = self.client.get(self.changelog_url, {'last_fetched_time': beforeSchedule })
+        changelog_response = self.client.get(self.changelog_url, beforeSchedule)
         self.failUnless(changelog_response.status_code == 200, "Changelog not successfully retreieved")
         changelog = json.loads(changelog_response.content)["changelog"]
         self.failUnless(len(changelog) == 1, "Change log does not contain exactly one class: " + str(changelog) )
@@ -246,12 +258,12 @@ class AJAXSchedulingModuleTest(AJAXSchedulingModuleTestBase):
         
         # Schedule one class.
         self.scheduleClass()
-        afterSchedule = time.time()
+        afterSchedule = self.getChangeLogCursor()
 
-        #change log should truncate at last requested time
-        changelog_response = self.client.get(self.changelog_url, {'last_fetched_time': afterSchedule })
+        #change log should truncate at last requested index
+        changelog_response = self.client.get(self.changelog_url, afterSchedule)
         changelog = json.loads(changelog_response.content)["changelog"]
-        self.failUnless(len(changelog) == 0, "Change log contained content from before last_fetched_time: " + str(changelog) )
+        self.failUnless(len(changelog) == 0, "Change log contained content from before last_fetched_index: " + str(changelog) )
     
     def testChangeLogDeletedClasses(self):
         self.clearScheduleAvailability()
@@ -259,13 +271,13 @@ class AJAXSchedulingModuleTest(AJAXSchedulingModuleTestBase):
         # Schedule one class.
         (section, times, rooms) = self.scheduleClass()
 
-        beforeUnschedule = time.time()
+        beforeUnschedule = self.getChangeLogCursor()
 
         #unschedule a class
         self.unschedule_class(section.id)
 
         #change log should include unscheduled classes 
-        changelog_response = self.client.get(self.changelog_url, {'last_fetched_time': beforeUnschedule })
+        changelog_response = self.client.get(self.changelog_url, beforeUnschedule)
         changelog = json.loads(changelog_response.content)["changelog"]
 
         self.failUnless(len(changelog) == 1, "Change log did not contain the unscheduled class: " + str(changelog))
@@ -285,11 +297,11 @@ class AJAXSchedulingModuleTest(AJAXSchedulingModuleTestBase):
         s2 = sections[0]
         
         #schedule it
-        beforeSchedule = time.time()
+        beforeSchedule = self.getChangeLogCursor()
         self.scheduleClass(section=s2, timeslots=times, rooms=rooms, shouldFail=True)
 
         #change log should not include it
-        changelog_response = self.client.get(self.changelog_url, {'last_fetched_time': beforeSchedule })
+        changelog_response = self.client.get(self.changelog_url, beforeSchedule)
         changelog = json.loads(changelog_response.content)["changelog"]
         self.failUnless(len(changelog) == 0, "Change log shows unsuccessfully scheduled class: " + str(changelog))
  
@@ -297,12 +309,202 @@ class AJAXSchedulingModuleTest(AJAXSchedulingModuleTestBase):
         self.clearScheduleAvailability()
         # Schedule class
         (s1, times, rooms) = self.scheduleClass()
-        #time before the changelog was deleted
-        beforeDelete = time.time()
+        #index before the changelog was deleted
+        beforeDelete = self.getLatestIndex()
         # delete change log
         self.client.post('/manage/%s/ajax_clear_change_log' % self.program.getUrlBase(), {})
         #request change log
-        response = self.client.get(self.changelog_url, {'last_fetched_time': beforeDelete })
+        response = self.client.get(self.changelog_url, {'last_fetched_index': beforeDelete })
         response = json.loads(response.content)
-        self.failUnless(response["other"] == [{"command" : "reload"}], "Was not asked to reload after the change log was destroyed: " +
+        self.failUnless(response["other"][0]["command"] == "reload", "Was not asked to reload after the change log was destroyed: " +
                         str(response["other"]))
+
+    def testChangeLogIndices(self):
+        from esp.program.modules.module_ext import AJAXChangeLog, AJAXChangeLogEntry
+
+        change_log = AJAXChangeLog(self.program)
+        change_log.clear()
+        self.failUnless(change_log.get_latest_index() == 0 and change_log.get_earliest_index() is None, "Cleared change log is not empty")
+        self.failUnless(change_log.get_log(0) == [], "Cleared change log is not empty")
+
+        #indices increase with each entry
+        first = change_log.append([1, 2], "Room 1", 10)
+        second = change_log.append([], "", 10, self.admins[0])
+        self.failUnless(first.index < second.index, "Change log indices don't increase")
+        self.failUnless(change_log.get_latest_index() == second.index and change_log.get_earliest_index() == first.index)
+        self.failUnless([e['index'] for e in change_log.get_log(0)] == [first.index, second.index])
+        log = change_log.get_log(first.index)
+        self.failUnless(log == [{'index': second.index, 'room_name': "", 'id': 10, 'timeslots': [''], 'user': self.admins[0].username}], str(log))
+        self.failUnless(change_log.get_recent_indices(second.index) == [first.index])
+        self.failUnless(change_log.get_log(second.index, [first.index]) == [])
+
+        #an entry committed after one with a higher index is still returned,
+        #unless the client says it already has it
+        third = change_log.append([3], "Room 3", 11)
+        fourth = change_log.append([4], "Room 4", 12)
+        self.failUnless([e['index'] for e in change_log.get_log(second.index, [first.index])] == [third.index, fourth.index])
+        self.failUnless([e['index'] for e in change_log.get_log(fourth.index, [first.index])] == [second.index, third.index])
+        self.failUnless(change_log.get_log(fourth.index, [first.index, second.index, third.index]) == [])
+        third.time -= change_log.commit_window + 1
+        AJAXChangeLogEntry.objects.filter(id=third.id).update(time=third.time)
+        self.failUnless([e['index'] for e in change_log.get_log(fourth.index, [first.index])] == [second.index], "Entries from before the commit window were returned")
+        third.delete()
+        fourth.delete()
+
+        #once the last fetched entry is gone, the client has to reload
+        first.delete()
+        self.failUnless(change_log.get_log(first.index) is None, "Pruned entries went unnoticed")
+        self.failUnless(change_log.get_log(second.index) == [])
+
+    def longPollInThread(self, cursor, timeout):
+        """ Start a request to ajax_change_log_wait in another thread, as
+        another admin's scheduler would.  Returns the thread and a dict that
+        gets the response and how long it took. """
+        from django.db import connections
+        from django.test.client import Client
+
+        #share this thread's database connection, so that the request sees
+        #the test's (uncommitted) data
+        connection = connections['default']
+        connection.allow_thread_sharing = True
+        client = Client()
+        client.cookies = self.client.cookies
+        result = {}
+        def poll():
+            connections['default'] = connection
+            start = time.time()
+            response = client.get(self.ajax_url_base + 'ajax_change_log_wait', dict(cursor, timeout=timeout))
+            result['time'] = time.time() - start
+            result['response'] = json.loads(response.content)
+        thread = threading.Thread(target=poll)
+        thread.start()
+        return (thread, result)
+
+    def testLongPoll(self):
+        from esp.program.modules.module_ext import AJAXChangeLog
+
+        self.loginAdmin()
+        change_log = AJAXChangeLog(self.program)
+        cursor = self.getChangeLogCursor()
+
+        #the request waits until there's a change, then returns it
+        (thread, result) = self.longPollInThread(cursor, 10)
+        time.sleep(0.5)
+        self.failUnless(thread.is_alive(), "Long poll returned before anything changed: " + str(result))
+        entry = change_log.append([1], "Room 1", 10)
+        thread.join(5)
+        self.failIf(thread.is_alive(), "Long poll didn't notice the change")
+        self.failUnless([e['index'] for e in result['response']['changelog']] == [entry.index], str(result['response']))
+        self.failUnless(result['time'] < 5)
+
+        #changes that were already there are returned right away
+        (thread, result) = self.longPollInThread(cursor, 10)
+        thread.join(5)
+        self.failIf(thread.is_alive(), "Long poll waited despite a change")
+        self.failUnless([e['index'] for e in result['response']['changelog']] == [entry.index], str(result['response']))
+
+    def testLongPollTimeout(self):
+        from esp.program.modules.module_ext import AJAXChangeLog
+
+        self.loginAdmin()
+        last_index = AJAXChangeLog(self.program).append([1], "Room 1", 10).index
+
+        #with no changes, the request gives up after the timeout
+        (thread, result) = self.longPollInThread({'last_fetched_index': last_index}, 1)
+        thread.join(10)
+        self.failIf(thread.is_alive(), "Long poll didn't time out")
+        self.failUnless(result['response']['changelog'] == [], str(result['response']))
+        self.failUnless(result['time'] >= 1)
+
+        #and a cleared log makes the client reload
+        self.client.post('/manage/%s/ajax_clear_change_log' % self.program.getUrlBase(), {})
+        (thread, result) = self.longPollInThread({'last_fetched_index': last_index}, 1)
+        thread.join(10)
+        self.failUnless(result['response']['other'][0]['command'] == "reload", str(result['response']))
+        self.failUnless(result['time'] < 1)
+
+    def testLongPollBadTimeout(self):
+        self.loginAdmin()
+        last_index = self.getLatestIndex()
+        for timeout in ['nan', 'inf', '-1', 'soon']:
+            response = self.client.get(self.ajax_url_base + 'ajax_change_log_wait', {'last_fetched_index': last_index, 'timeout': timeout})
+            self.failIf('changelog' in response.content, "Accepted a timeout of %s" % timeout)
+
+    def testLongPollMissingEntry(self):
+        from django.core.cache import cache
+        from esp.program.modules.module_ext import AJAXChangeLog
+
+        change_log = AJAXChangeLog(self.program)
+        last_index = change_log.append([1], "Room 1", 10).index
+
+        #a cached index with nothing behind it only costs one look at the
+        #database (two queries) per recheck_interval, not one per poll
+        cache.set(change_log.latest_index_key(), last_index + 1000)
+        with self.assertNumQueries(4):
+            self.failUnless(change_log.wait_for_log(last_index, 1.5) == [])
+
+    def testLongPollRecheck(self):
+        from django.core.cache import cache
+        from esp.program.modules.module_ext import AJAXChangeLog, AJAXChangeLogEntry
+
+        self.loginAdmin()
+        change_log = AJAXChangeLog(self.program)
+        last_index = change_log.append([1], "Room 1", 10).index
+
+        #an entry that shows up behind a cached index that already turned out
+        #to be empty is still found, once that index is rechecked
+        cache.set(change_log.latest_index_key(), last_index + 1000)
+        old_recheck_interval = AJAXChangeLog.recheck_interval
+        AJAXChangeLog.recheck_interval = 1
+        try:
+            (thread, result) = self.longPollInThread({'last_fetched_index': last_index}, 10)
+            time.sleep(0.5)
+            entry = AJAXChangeLogEntry(program=self.program, timeslots='1', room_name="Room 1", cls_id=10)
+            entry.save()
+            thread.join(10)
+        finally:
+            AJAXChangeLog.recheck_interval = old_recheck_interval
+        self.failIf(thread.is_alive(), "Long poll never rechecked the database")
+        self.failUnless([e['index'] for e in result['response']['changelog']] == [entry.index], str(result['response']))
+        self.failUnless(result['time'] < 5)
+
+    def testChangeLogPublishedAfterBatch(self):
+        from django.core.cache import cache
+        from esp.cache.batch import batched_invalidations
+        from esp.program.modules.module_ext import AJAXChangeLog
+
+        #within a request, new entries are only announced once its batch
+        #ends, after the transaction has been committed
+        change_log = AJAXChangeLog(self.program)
+        with batched_invalidations():
+            entry = change_log.append([1], "Room 1", 10)
+            self.failIf(cache.get(change_log.latest_index_key()) == entry.index, "Change log entry was announced before the end of the batch")
+        self.failUnless(cache.get(change_log.latest_index_key()) == entry.index)
+
+    def getScheduleUUID(self):
+        response = self.client.get(self.ajax_url_base + 'ajax_schedule_last_changed')
+        return json.loads(response.content)['val']
+
+    def testScheduleUUIDScope(self):
+        from esp.cal.models import Event
+        from esp.program.models import ClassSubject
+
+        self.loginAdmin()
+        self.create_past_program()
+        uuid = self.getScheduleUUID()
+        self.failUnless(self.getScheduleUUID() == uuid, "Schedule UUID changed with nothing changing")
+
+        #changes to another program leave this program's scheduler alone
+        other_timeslot = Event.objects.create(program=self.new_prog, event_type=self.event_type, start=self.timeslots[0].start, end=self.timeslots[0].end, short_description='Other slot', description='Other slot')
+        other_class = ClassSubject.objects.create(title='Other class', category=self.categories[0], grade_min=7, grade_max=12, parent_program=self.new_prog, class_size_max=10, class_info='Other class')
+        other_section = other_class.add_section(duration=50/60.0)
+        other_section.assign_meeting_times([other_timeslot])
+        self.failUnless(self.getScheduleUUID() == uuid, "Schedule UUID changed after a change to another program")
+
+        #but changes to this one don't
+        section = self.program.sections()[0]
+        section.assign_meeting_times([self.timeslots[0]])
+        new_uuid = self.getScheduleUUID()
+        self.failUnless(new_uuid != uuid, "Schedule UUID didn't change when a section was scheduled")
+        self.timeslots[0].save()
+        self.failUnless(self.getScheduleUUID() != new_uuid, "Schedule UUID didn't change when a timeslot was changed")
@@ -0,0 +1,150 @@
+__author__    = "Individual contributors (see AUTHORS file)"
+__date__      = "$DATE$"
+__rev__       = "$REV$"
+__license__   = "AGPL v.3"
+__copyright__ = """
+This file is part of the ESP Web Site
+Copyright (c) 2012 by the individual contributors
+  (see AUTHORS file)
+
+The ESP Web Site is free software; you can redistribute it and/or
+modify it under the terms of the GNU Affero General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public
+License along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Contact information:
+MIT Educational Studies Program
+  84 Massachusetts Ave W20-467, Cambridge, MA 02139
+  Phone: 617-253-4882
+  Email: esp-webmasters@mit.edu
+Learning Unlimited, Inc.
+  527 Franklin St, Cambridge, MA 02139
+  Phone: 617-379-0178
+  Email: web-team@lists.learningu.org
+"""
+
+from esp.program.models import ClassSection, ClassSubject
+from esp.program.modules.handlers.jsondatamodule import JSONDataModule
+from esp.program.tests import ProgramFrameworkTest
+from esp.users.models import ESPUser, UserAvailability
+
+class JSONDataModuleTest(ProgramFrameworkTest):
+    def setUp(self, *args, **kwargs):
+        super(JSONDataModuleTest, self).setUp(*args, **kwargs)
+        self.schedule_randomly()
+        self.failUnless(self.client.login(username=self.admins[0].username, password='password'), "Failed to log in admin user.")
+
+    def get_json(self, view, etag=None):
+        url = '/json/%s/%s' % (self.program.getUrlBase(), view)
+        if etag is None:
+            return self.client.get(url)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def check_etag(self, view, change):
+        """ Check that view answers a matching If-None-Match with a 304,
+            until change() changes its result. """
+        response = self.get_json(view)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        content = response.content
+
+        #   The ETag stays the same while the result does
+        response = self.get_json(view)
+        self.assertEqual(response['ETag'], etag)
+        response = self.get_json(view, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        self.assertEqual(response['ETag'], etag)
+
+        #   A stale ETag gets the new result
+        change()
+        response = self.get_json(view, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotEqual(response.content, content)
+        self.assertEqual(self.get_json(view, response['ETag']).status_code, 304)
+
+    def test_etags(self):
+        #   Invalidated by a token
+        def change_timeslot():
+            timeslot = self.timeslots[0]
+            timeslot.short_description = 'New %s' % timeslot.short_description
+            timeslot.save()
+        self.check_etag('timeslots', change_timeslot)
+
+        #   Invalidated by deleting the program's entry
+        def change_class():
+            cls = self.program.classes()[0]
+            cls.title = 'New %s' % cls.title
+            cls.save()
+        self.check_etag('sections', change_class)
+
+    def test_availability_scope(self):
+        """ A teacher's availability for another program leaves this
+            program's class_subjects view alone. """
+        from esp.cal.models import Event
+
+        cached_classes = JSONDataModule.class_subjects.cached_function
+        self.get_json('class_subjects')
+        self.assertNotEqual(cached_classes.get([self.program]), None)
+
+        self.create_past_program()
+        other_timeslot = Event.objects.create(program=self.new_prog, event_type=self.event_type, start=self.timeslots[0].start, end=self.timeslots[0].end, short_description='Other slot', description='Other slot')
+        ESPUser(self.teachers[0]).addAvailableTime(self.new_prog, other_timeslot)
+        self.assertNotEqual(cached_classes.get([self.program]), None)
+
+        ESPUser(self.teachers[0]).addAvailableTime(self.program, self.timeslots[0])
+        self.assertEqual(cached_classes.get([self.program]), None)
+
+    def test_sections_queries(self):
+        """ The sections view takes the same number of queries however many
+            sections the program has, and numbers them as the models do. """
+        compute_sections = JSONDataModule.sections.cached_function.func
+        self.assertNumQueries(3, compute_sections, self.program)
+        for cls in self.program.classes():
+            cls.add_section()
+            cls.add_section()
+        self.assertNumQueries(3, compute_sections, self.program)
+
+        result = compute_sections(self.program)
+
+        self.assertEqual([sec['id'] for sec in result['sections']], [sec.id for sec in self.program.sections()])
+        for sec in result['sections']:
+            section = ClassSection.objects.get(id=sec['id'])
+            self.assertEqual(sec['index'], section.index())
+            self.assertEqual(sec['emailcode'], section.emailcode())
+            self.assertEqual(sorted(sec['teachers']), sorted(t.id for t in section.parent_class.get_teachers()))
+        for teacher in result['teachers']:
+            user = ESPUser.objects.get(id=teacher['id'])
+            self.assertEqual(teacher['sections'], [sec.id for sec in user.getTaughtSectionsFromProgram(self.program)])
+            self.assertEqual(sorted(teacher['availability']), sorted(UserAvailability.objects.filter(user=user, event__program=self.program).values_list('event', flat=True)))
+
+    def test_class_subjects_queries(self):
+        """ Likewise for the class_subjects view, as classes are added. """
+        compute_classes = JSONDataModule.class_subjects.cached_function.func
+        self.assertNumQueries(4, compute_classes, self.program)
+        for cls in list(self.program.classes()):
+            new_class = ClassSubject.objects.create(title='Copy of %s' % cls.title, parent_program=self.program, category=cls.category, grade_min=cls.grade_min, grade_max=cls.grade_max, duration=1.0, status=cls.status)
+            new_class.teachers.add(*cls.get_teachers())
+            new_class.add_section()
+        self.assertNumQueries(4, compute_classes, self.program)
+
+        result = compute_classes(self.program)
+        self.assertEqual([c['id'] for c in result['classes']], [cls.id for cls in self.program.classes()])
+        for c in result['classes']:
+            cls = ClassSubject.objects.get(id=c['id'])
+            self.assertEqual(c['emailcode'], cls.emailcode())
+            self.assertEqual(c['sections'], [sec.id for sec in cls.sections.all()])
+            self.assertEqual(sorted(c['teachers']), sorted(t.id for t in cls.get_teachers()))
+        for teacher in result['teachers']:
+            user = ESPUser.objects.get(id=teacher['id'])
+            self.assertEqual(teacher['sections'], [sec.id for sec in user.getTaughtSectionsFromProgram(self.program)])
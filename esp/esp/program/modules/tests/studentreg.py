@@ -40,6 +40,7 @@ from esp.program.tests import ProgramFrameworkTest
 from esp.accounting.controllers import ProgramAccountingController, IndividualAccountingController
 
 from decimal import Decimal
+import simplejson
 import random
 import re
 
@@ -143,6 +144,72 @@ class StudentRegTest(ProgramFrameworkTest):
         sec.preregister_student(student)
         verify_catalog_correctness()
 
+    def test_catalog_json(self):
+        from esp.program.models import ClassSubject
+
+        #   The view serves the catalog snapshot
+        sec = random.choice(self.program.sections())
+        sec.preregister_student(self.students[0])
+        expected = simplejson.dumps(ClassSubject.objects.catalog_snapshot(self.program))
+        response = self.client.get('/learn/%s/catalog_json' % self.program.getUrlBase())
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, expected)
+
+        #   Streamed, even to clients that accept gzip
+        response = self.client.get('/learn/%s/catalog_json' % self.program.getUrlBase(), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, expected)
+
+        #   Regardless of how the classes are split into chunks
+        for chunk_size in [1, 2, 1000]:
+            chunked = simplejson.dumps(list(ClassSubject.objects.iter_catalog_snapshot(self.program, chunk_size=chunk_size)))
+            self.assertEqual(chunked, expected)
+
+    def test_catalog_student_count_json(self):
+        url = '/learn/%s/catalog_student_count_json' % self.program.getUrlBase()
+        def get_counts(since=None):
+            if since is None:
+                response = self.client.get(url)
+            else:
+                response = self.client.get(url, {'since': since})
+            return simplejson.loads(response.content)
+
+        sections = list(self.program.sections())
+        all_counts = dict([(str(sec.id), sec.num_students()) for sec in sections])
+
+        #   Without a version, we get all the counts as before
+        self.assertEqual(get_counts(), all_counts)
+
+        #   Starting from scratch, we get all the counts and a version
+        data = get_counts(0)
+        self.assertTrue(data['full'])
+        self.assertEqual(data['counts'], all_counts)
+        version = data['version']
+
+        #   Nothing has changed since then
+        data = get_counts(version)
+        self.assertEqual(data, {'version': version, 'counts': {}, 'full': False})
+
+        #   Only the section a student enrolled in is sent
+        sec = sections[0]
+        sec.preregister_student(self.students[0], prereg_verb='Enrolled')
+        data = get_counts(version)
+        self.assertFalse(data['full'])
+        self.assertTrue(data['version'] > version)
+        self.assertEqual(data['counts'], {str(sec.id): sec.num_students()})
+        self.assertEqual(get_counts(data['version'])['counts'], {})
+
+        #   Older versions still give the changes since then
+        self.assertEqual(get_counts(version)['counts'], {str(sec.id): sec.num_students()})
+
+        #   Unknown versions give everything
+        all_counts[str(sec.id)] = sec.num_students()
+        for since in [data['version'] + 1, 'junk']:
+            new_data = get_counts(since)
+            self.assertTrue(new_data['full'])
+            self.assertEqual(new_data['counts'], all_counts)
+
     def test_profile(self):
 
         #   Login as a student and ensure we can submit the profile
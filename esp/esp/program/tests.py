@@ -978,6 +978,41 @@ class DynamicCapacityTest(ProgramFrameworkTest):
         sec.parent_program._moduleExtension = {}
         self.assertEqual(sec.capacity, initial_capacity)
 
+class BulkCapacityTest(ProgramFrameworkTest):
+    """ Check that compute_capacities() agrees with ClassSection.capacity. """
+    def runTest(self):
+        from esp.program.models.class_ import compute_capacities
+        from esp.program.models import ClassSizeRange
+
+        self.schedule_randomly()
+        sections = list(self.program.sections())
+        #   Cover each way of working out the capacity
+        sections[0].max_class_capacity = 5
+        sections[0].save()
+        cls = sections[1].parent_class
+        cls.class_size_max = None
+        cls.class_size_optimal = 12
+        cls.save()
+        cls = sections[2].parent_class
+        cls.class_size_max = 0
+        cls.save()
+        cls.allowable_class_size_ranges.add(ClassSizeRange.objects.create(range_min=5, range_max=20, program=self.program))
+        sections[3].clearRooms()
+
+        def check_capacities():
+            expected = dict([(sec.id, sec._get_capacity(use_cache=False)) for sec in self.program.sections()])
+            self.assertEqual(compute_capacities(self.program, expected.keys()), expected)
+            self.assertEqual(self.program.capacity_by_section_id(), expected)
+
+        check_capacities()
+        options = self.program.getModuleExtension('StudentClassRegModuleInfo')
+        options.class_cap_multiplier = '0.5'
+        options.class_cap_offset = 3
+        options.apply_multiplier_to_room_cap = True
+        options.save()
+        self.program._moduleExtension = {}
+        check_capacities()
+
 
 class ModuleControlTest(ProgramFrameworkTest):
     def runTest(self):
@@ -1044,6 +1079,128 @@ class MeetingTimesTest(ProgramFrameworkTest):
         section.meeting_times.remove(ts2)
         self.assertSetEquals(section.get_meeting_times(), [])
 
+class CatalogCacheTest(ProgramFrameworkTest):
+    """ Check that the catalog cache is invalidated only for the program whose
+        classes changed.  """
+    def runTest(self):
+        self.create_past_program()
+        other_class, created = ClassSubject.objects.get_or_create(title='Past class', category=self.categories[0], grade_min=7, grade_max=12, parent_program=self.new_prog, class_size_max=10, class_info='Description!')
+        other_class.add_section(duration=1.0)
+        other_class.accept()
+
+        #   Populate both catalogs
+        ClassSubject.objects.catalog(self.program)
+        ClassSubject.objects.catalog(self.new_prog)
+        self.assertTrue(ClassSubject.objects.catalog_cached(self.program, cache_only=True) is not None)
+        self.assertTrue(ClassSubject.objects.catalog_cached(self.new_prog, cache_only=True) is not None)
+
+        #   Editing a section of the other program leaves this program's catalog alone
+        other_section = other_class.get_sections()[0]
+        other_section.max_class_capacity = 5
+        other_section.save()
+        self.assertTrue(ClassSubject.objects.catalog_cached(self.program, cache_only=True) is not None)
+        self.assertTrue(ClassSubject.objects.catalog_cached(self.new_prog, cache_only=True) is None)
+
+        #   Editing a class of this program flushes this program's catalog
+        ClassSubject.objects.catalog(self.new_prog)
+        cls = self.program.classes()[0]
+        cls.class_info = 'New description'
+        cls.save()
+        self.assertTrue(ClassSubject.objects.catalog_cached(self.program, cache_only=True) is None)
+        self.assertTrue(ClassSubject.objects.catalog_cached(self.new_prog, cache_only=True) is not None)
+
+class CatalogSnapshotTest(ProgramFrameworkTest):
+    """ Check the catalog snapshot against the catalog, and that editing a
+        class only rebuilds that class's entry.  """
+    def runTest(self):
+        self.schedule_randomly()
+        catalog = ClassSubject.objects.catalog(self.program)
+        snapshot = ClassSubject.objects.catalog_snapshot(self.program)
+        self.assertEqual([entry['id'] for entry in snapshot], [cls.id for cls in catalog])
+        for cls, entry in zip(catalog, snapshot):
+            self.assertEqual(entry['title'], cls.title)
+            self.assertEqual(entry['num_students'], cls.num_students())
+            self.assertEqual([sec['id'] for sec in entry['get_sections']], [sec.id for sec in cls.get_sections()])
+            for sec, sec_entry in zip(cls.get_sections(), entry['get_sections']):
+                self.assertEqual(sec_entry['capacity'], sec.capacity)
+                self.assertEqual([ev['id'] for ev in sec_entry['get_meeting_times']], [ev.id for ev in sec.get_meeting_times()])
+
+        #   Every class has an entry now
+        classes = list(self.program.classes())
+        for cls in classes:
+            self.assertTrue(cls.catalog_entry(cache_only=True) is not None)
+
+        #   The entries the snapshot built are the ones catalog_entry() builds
+        for cls in classes:
+            self.assertEqual(cls.catalog_entry(cache_only=True), cls.catalog_entry(use_cache=False))
+
+        #   Editing one class only drops its own entry
+        cls = classes[0]
+        cls.class_info = 'New description'
+        cls.save()
+        self.assertTrue(cls.catalog_entry(cache_only=True) is None)
+        for other_cls in classes[1:]:
+            self.assertTrue(other_cls.catalog_entry(cache_only=True) is not None)
+        snapshot = ClassSubject.objects.catalog_snapshot(self.program)
+        self.assertEqual([entry['class_info'] for entry in snapshot if entry['id'] == cls.id], ['New description'])
+
+        #   Enrollments are always current
+        sec = cls.get_sections()[0]
+        sec.preregister_student(self.students[0], fast_force_create=True)
+        snapshot = ClassSubject.objects.catalog_snapshot(self.program)
+        entry = [entry for entry in snapshot if entry['id'] == cls.id][0]
+        self.assertEqual(entry['num_students'], cls.num_students())
+        self.assertEqual(entry['get_sections'][0]['num_students'], sec.num_students())
+
+class EnrollmentCountsTest(ProgramFrameworkTest):
+    """ Check that the enrollment counters follow registrations, and can be
+        reconciled with the database.  """
+    def runTest(self):
+        from esp.program import enrollment_counts
+
+        section = self.program.sections()[0]
+        other_section = self.program.sections()[1]
+        section_ids = [section.id, other_section.id]
+        self.assertEqual(enrollment_counts.get_counts(section_ids), {section.id: 0, other_section.id: 0})
+
+        #   Enrolling and dropping are reflected in the counts
+        section.preregister_student(self.students[0], prereg_verb='Enrolled')
+        section.preregister_student(self.students[1], prereg_verb='Enrolled')
+        self.assertEqual(enrollment_counts.get_count(section), 2)
+        section.unpreregister_student(self.students[0])
+        self.assertEqual(enrollment_counts.get_count(section), 1)
+        self.assertEqual(section.num_students(), 1)
+        self.assertEqual(section.parent_class.num_students(), 1)
+
+        #   Other kinds of registrations don't count
+        other_section.preregister_student(self.students[2], prereg_verb='Interested')
+        self.assertEqual(enrollment_counts.get_count(other_section), 0)
+
+        #   Bulk reads cover the whole program
+        counts = self.program.student_counts_by_section_id()
+        self.assertEqual(sorted(counts.keys()), sorted([sec.id for sec in self.program.sections()]))
+        self.assertEqual(counts[section.id], 1)
+
+        #   Changes that bypass the counters are caught by reconciling
+        StudentRegistration.valid_objects().filter(section=section).update(end_date=datetime.datetime.now() - datetime.timedelta(days=1))
+        self.assertEqual(enrollment_counts.get_count(section), 1)
+        self.assertEqual(enrollment_counts.reconcile(section_ids), [(section.id, 1, 0)])
+        self.assertEqual(enrollment_counts.get_count(section), 0)
+        self.assertEqual(enrollment_counts.reconcile(section_ids), [])
+
+        #   A count taken while a registration was being saved isn't kept
+        enrollment_counts.invalidate(section_ids)
+        tokens = enrollment_counts._get_tokens([section.id])
+        section.preregister_student(self.students[3], overridefull=True, prereg_verb='Enrolled')
+        enrollment_counts._store_counts({section.id: 0}, tokens)
+        self.assertEqual(enrollment_counts.get_count(section), 1)
+
+        #   The warmer fills in num_students for every section
+        ClassSection.num_students.delete_all()
+        ClassSection.num_students.warmer(self.program)
+        for sec in self.program.sections():
+            self.assertEqual(ClassSection.num_students.get([sec, ['Enrolled']]), enrollment_counts.get_count(sec))
+
 class LSRAssignmentTest(ProgramFrameworkTest):
     def setUp(self):
         random.seed()
@@ -1149,6 +1306,66 @@ class LSRAssignmentTest(ProgramFrameworkTest):
             #   Compare against the value in the stats dict (allow for floating-point error)
             self.assertAlmostEqual(student_screwed_val, stats_entry[0])
 
+    def testBestAssignments(self):
+        """ Verify that compute_best_assignments() keeps the best of its runs,
+            and that the winner can be saved.  """
+
+        lotteryController = LotteryAssignmentController(self.program)
+        stats = lotteryController.compute_best_assignments(num_runs=3, processes=2)
+        self.assertEqual(len(lotteryController.run_scores), 3)
+        self.assertEqual(stats['overall_utility'], max(lotteryController.run_scores)[0])
+
+        #   The winning run is the one that gets saved
+        lotteryController.save_assignments()
+        self.assertEqual(stats['num_registrations'], len(StudentRegistration.valid_objects().filter(user__in=self.students, relationship__name='Enrolled')))
+
+    def testRepeatable(self):
+        """ Verify that running the lottery twice on the same controller with
+            the same random seed gives the same results.  """
+
+        lotteryController = LotteryAssignmentController(self.program)
+        numpy.random.seed(1)
+        lotteryController.compute_assignments()
+        first_stats = lotteryController.compute_stats(display=False)
+        numpy.random.seed(1)
+        lotteryController.compute_assignments()
+        second_stats = lotteryController.compute_stats(display=False)
+
+        for key in ['priority_assigned', 'interest_assigned']:
+            self.assertTrue((first_stats[key] == second_stats[key]).all())
+        for key in ['num_registrations', 'num_enrolled_students', 'overall_utility', 'students_by_screwedness']:
+            self.assertEqual(first_stats[key], second_stats[key])
+
+    def testSparse(self):
+        """ Verify that the sparse mode makes the same assignments as the
+            dense one, given the same random seed.  """
+
+        dense_controller = LotteryAssignmentController(self.program)
+        sparse_controller = LotteryAssignmentController(self.program, sparse=True)
+        self.assertFalse(hasattr(sparse_controller, 'section_overlap'))
+        self.assertTrue((sparse_controller.interest.to_dense() == dense_controller.interest).all())
+        self.assertTrue((sparse_controller.priority.to_dense() == dense_controller.priority).all())
+
+        numpy.random.seed(1)
+        dense_controller.compute_assignments()
+        dense_stats = dense_controller.compute_stats(display=False)
+        numpy.random.seed(1)
+        sparse_controller.compute_assignments()
+        sparse_stats = sparse_controller.compute_stats(display=False)
+
+        #   No students x sections array was created along the way
+        dense_shape = (sparse_controller.num_students, sparse_controller.num_sections)
+        for (name, value) in vars(sparse_controller).items():
+            self.assertFalse(isinstance(value, numpy.ndarray) and value.shape == dense_shape, '%s is a dense students x sections array' % name)
+        self.assertTrue((sparse_controller.student_sections.to_dense() == dense_controller.student_sections).all())
+        for key in ['priority_assigned', 'priority_requested', 'interest_assigned', 'interest_requested']:
+            self.assertTrue((sparse_stats[key] == dense_stats[key]).all())
+        self.assertEqual(sparse_stats['overall_utility'], dense_stats['overall_utility'])
+
+        student = self.students[0]
+        for mode in ['assigned', 'interested', 'priority']:
+            self.assertEqual(sparse_controller.get_computed_schedule(student.id, mode), dense_controller.get_computed_schedule(student.id, mode))
+
     def testSingleLunchConstraint(self):
         # First generate 1 lunch timeslot
         lunch_timeslot = random.choice(self.timeslots)
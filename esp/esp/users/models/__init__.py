@@ -53,7 +53,7 @@ from django.template import loader, Context as DjangoContext
 from django.template.defaultfilters import urlencode
 
 from esp.cal.models import Event
-from esp.cache import cache_function, wildcard
+from esp.cache import cache_function, wildcard, one_of
 from esp.customforms.linkfields import CustomFormsLinkModel
 from esp.customforms.forms import AddressWidget, NameWidget
 from esp.datatree.models import *
@@ -472,12 +472,12 @@ class ESPUser(User, AnonymousUser):
 
         return list(valid_events)
     getAvailableTimes.get_or_create_token(('self', 'program',))
+    getAvailableTimes.get_or_create_token(('program',))
     getAvailableTimes.depend_on_cache(getTaughtSectionsFromProgram,
             lambda self=wildcard, program=wildcard, **kwargs:
                  {'self':self, 'program':program, 'ignore_classes':True})
-    # FIXME: Really should take into account section's teachers...
-    # even though that shouldn't change often
-    getAvailableTimes.depend_on_m2m(lambda:ClassSection, 'meeting_times', lambda sec, event: {'program': sec.parent_program})
+    #   Only the section's own teachers lose (or regain) those times
+    getAvailableTimes.depend_on_m2m(lambda:ClassSection, 'meeting_times', lambda sec, event: {'self': one_of(sec.parent_class.get_teachers()), 'program': sec.parent_program})
     getAvailableTimes.depend_on_m2m(lambda:Program, 'program_modules', lambda prog, pm: {'program': prog})
     getAvailableTimes.depend_on_row(lambda:UserAvailability, lambda ua:
                                         {'program': ua.event.program,
@@ -36,11 +36,14 @@ Learning Unlimited, Inc.
 from esp.cache import cache_function
 from esp.cache.function import describe_func
 
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.db.models import Model
+from django.utils.http import parse_etags, quote_etag
 
 from inspect import getargspec
 from functools import wraps
+import cPickle as pickle
+import hashlib
 import simplejson
 
 class OptionalDecorator(object):
@@ -101,6 +104,8 @@ def json_response(field_map={}):
                     new_result[key] = new_list
                 resp = HttpResponse(mimetype='application/json')
                 simplejson.dump(new_result, resp)
+                if getattr(result, 'etag', None):
+                    resp['ETag'] = result.etag
                 return resp
                 
         return _evaluate
@@ -108,16 +113,49 @@ def json_response(field_map={}):
     return dec
 
 
+class ETaggedDict(dict):
+    """ A view's result, along with the ETag that json_response should send
+        with it. """
+    def __init__(self, data, etag):
+        super(ETaggedDict, self).__init__(data)
+        self.etag = etag
+
+class ETaggedCacheFunction(cache_function):
+    """ A cache_function for views that stores each result as an ETaggedDict,
+        whose ETag is a digest of the result.  The ETag is cached along with
+        the result it describes, so the two can't get out of step. """
+
+    def __init__(self, func, *args, **kwargs):
+        super(ETaggedCacheFunction, self).__init__(func, *args, **kwargs)
+        def tagged_func(*args, **kwargs):
+            result = func(*args, **kwargs)
+            etag = hashlib.md5(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)).hexdigest()
+            return ETaggedDict(result, quote_etag(etag))
+        self.func = tagged_func
+
 class CachedModuleViewDecorator(object):
     """ Employs some of the techniques used by the cached inclusion tag to 
-        make caching a simple program module view easier. """
+        make caching a simple program module view easier.
+
+        Unless the view depends on the request, its responses also carry an
+        ETag, which only changes when the cached result is invalidated, so
+        that clients that send it back in If-None-Match get a 304 instead of
+        the same data all over again. """
     
     def __init__(self, func):
         parent_obj = self
 
         def prepare_dec(func):
             self.params, xx, xxx, defaults = getargspec(func)
-            self.cached_function = cache_function(func, uid_extra='*'+describe_func(func))
+            #   These views are expensive, and tend to be requested by many
+            #   clients at once, so only let one process at a time compute each
+            if 'request' in self.params:
+                self.cached_function = cache_function(func, uid_extra='*'+describe_func(func))
+            else:
+                self.cached_function = ETaggedCacheFunction(func, uid_extra='*'+describe_func(func), use_leases=True)
+            if self.params == ['prog']:
+                #   Views that only depend on the program can be computed ahead of time
+                self.cached_function.set_warmer(self.cached_function)
 
             def actual_func(self, request, tl, one, two, module, extra, prog):
                 #   Construct argument list
@@ -127,7 +165,14 @@ class CachedModuleViewDecorator(object):
                 for i in range(len(param_list)):
                     if param_name_list[i] in parent_obj.params:
                         args_for_func.append(param_list[i])
-                return parent_obj.cached_function(*args_for_func)
+                result = parent_obj.cached_function(*args_for_func)
+
+                etag = getattr(result, 'etag', None)
+                if etag and etag in [quote_etag(x) for x in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]:
+                    response = HttpResponseNotModified()
+                    response['ETag'] = etag
+                    return response
+                return result
             
             return actual_func
             
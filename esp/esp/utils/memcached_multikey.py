@@ -75,6 +75,13 @@ class CacheClass(BaseCache):
         if self.idebug: self._idebuglog("delete", key, None)
         return self._wrapped_cache.delete(self.make_key(key, version), version=version)
 
+    @try_multi(8)
+    def delete_many(self, keys, version=None):
+        if self.idebug:
+            for key in keys:
+                self._idebuglog("delete", key, None)
+        return self._wrapped_cache.delete_many([self.make_key(key, version) for key in keys], version=version)
+
     @try_multi(8)
     def get_many(self, keys, version=None):
         keys_dict = dict((self.make_key(key, version), key) for key in keys)
@@ -84,6 +91,13 @@ class CacheClass(BaseCache):
             ans[keys_dict[k]] = v
         return ans
 
+    @try_multi(8)
+    def set_many(self, data, timeout=0, version=None):
+        for key, value in data.items():
+            self._failfast_test(key, value)
+        wrapped_data = dict((self.make_key(key, version), value) for key, value in data.items())
+        return self._wrapped_cache.set_many(wrapped_data, timeout=timeout, version=version)
+
     # Django 1.1 feature
     # Don't try_multi, that could be all kinds of bad...
     def incr(self, key, delta=1, version=None):
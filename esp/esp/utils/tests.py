@@ -341,6 +341,72 @@ if MultihostCacheClass:
             self.assertEqual(3, self.cacheclass.get('test_math'))
         
 
+class TransactionHooksTest(unittest.TestCase):
+    """ Tests for esp.utils.transaction_hooks.  These use the connection
+    directly, since django.test.TestCase never really commits. """
+
+    def setUp(self):
+        from django.db import connection
+        self.connection = connection
+        self.calls = []
+
+    def call(self, x):
+        return lambda: self.calls.append(x)
+
+    def test_outside_transaction(self):
+        from esp.utils.transaction_hooks import on_commit
+        on_commit(self.call(1))
+        self.assertEqual(self.calls, [1])
+
+    def test_commit(self):
+        from esp.utils.transaction_hooks import on_commit
+        self.connection.enter_transaction_management()
+        self.connection.managed(True)
+        try:
+            on_commit(self.call(1))
+            on_commit(self.call(2))
+            self.assertEqual(self.calls, [])
+            self.connection.commit()
+            self.assertEqual(self.calls, [1, 2])
+        finally:
+            self.connection.leave_transaction_management()
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_rollback(self):
+        from esp.utils.transaction_hooks import on_commit
+        self.connection.enter_transaction_management()
+        self.connection.managed(True)
+        try:
+            on_commit(self.call(1))
+            self.connection.rollback()
+        finally:
+            self.connection.leave_transaction_management()
+        self.assertEqual(self.calls, [])
+
+    def test_forced_management(self):
+        """ Like QuerySet.delete(): transaction management without managed(),
+        committed by hand before leaving. """
+        from esp.utils.transaction_hooks import on_commit
+        self.connection.enter_transaction_management()
+        try:
+            on_commit(self.call(1))
+            self.assertEqual(self.calls, [])
+            self.connection.commit()
+            self.assertEqual(self.calls, [1])
+        finally:
+            self.connection.leave_transaction_management()
+
+    def test_nothing_to_commit(self):
+        from esp.utils.transaction_hooks import on_commit
+        self.connection.enter_transaction_management()
+        self.connection.managed(True)
+        try:
+            on_commit(self.call(1))
+            self.assertEqual(self.calls, [])
+        finally:
+            self.connection.leave_transaction_management()
+        self.assertEqual(self.calls, [1])
+
 class DefaultclassTestCase(unittest.TestCase):
     def testDefaultclass(self):
         """ Verify that defaultclass correctly lets you select out a custom instance of a class """
@@ -0,0 +1,96 @@
+""" Running code once the current transaction has been committed. """
+__author__    = "Individual contributors (see AUTHORS file)"
+__date__      = "$DATE$"
+__rev__       = "$REV$"
+__license__   = "AGPL v.3"
+__copyright__ = """
+This file is part of the ESP Web Site
+Copyright (c) 2013 by the individual contributors
+  (see AUTHORS file)
+
+The ESP Web Site is free software; you can redistribute it and/or
+modify it under the terms of the GNU Affero General Public License
+as published by the Free Software Foundation; either version 3
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public
+License along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+Contact information:
+MIT Educational Studies Program
+  84 Massachusetts Ave W20-467, Cambridge, MA 02139
+  Phone: 617-253-4882
+  Email: esp-webmasters@mit.edu
+Learning Unlimited, Inc.
+  527 Franklin St, Cambridge, MA 02139
+  Phone: 617-379-0178
+  Email: web-team@lists.learningu.org
+"""
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends import BaseDatabaseWrapper
+
+__all__ = ['on_commit']
+
+# Django 1.4 has no way to run code after a commit, which is what cache
+# invalidations want: one made any earlier leaves a window in which another
+# process can read the old rows and cache them again.
+#
+# Outside of any transaction management, Django commits each change as it's
+# made (save() commits before sending post_save), so on_commit() just calls
+# the function.  Otherwise (TransactionMiddleware, commit_on_success, or the
+# transaction that QuerySet.delete() forces) the function waits on the
+# connection until it is committed, or until the last transaction management
+# block is left without anything to commit; if the transaction is rolled back
+# instead, the function is dropped.
+#
+# Note that TestCase never really commits, so in tests the functions are only
+# ever dropped.
+
+def on_commit(func, using=None):
+    """ Call func once the changes made so far on the connection have been
+    committed. """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if not connection.transaction_state:
+        func()
+    else:
+        connection.commit_callbacks = getattr(connection, 'commit_callbacks', []) + [func]
+
+def _run_callbacks(connection):
+    callbacks = getattr(connection, 'commit_callbacks', [])
+    connection.commit_callbacks = []
+    for func in callbacks:
+        func()
+
+def _drop_callbacks(connection):
+    connection.commit_callbacks = []
+
+def _patch(name, before=None, after=None):
+    original = getattr(BaseDatabaseWrapper, name)
+    def patched(self, *args, **kwargs):
+        if before:
+            before(self)
+        result = original(self, *args, **kwargs)
+        if after:
+            after(self)
+        return result
+    patched.__name__ = name
+    patched.__doc__ = original.__doc__
+    setattr(BaseDatabaseWrapper, name, patched)
+
+if not getattr(BaseDatabaseWrapper, 'has_commit_hooks', False):
+    BaseDatabaseWrapper.has_commit_hooks = True
+    _patch('commit', after=_run_callbacks)
+    _patch('commit_unless_managed', after=lambda connection: connection.is_managed() or _run_callbacks(connection))
+    _patch('rollback', after=_drop_callbacks)
+    _patch('rollback_unless_managed', after=lambda connection: connection.is_managed() or _drop_callbacks(connection))
+    #   abort() rolls back behind rollback()'s back, and then leaves every block
+    _patch('abort', before=_drop_callbacks)
+    #   (if there's something left to commit, this rolls it back and raises)
+    _patch('leave_transaction_management', after=lambda connection: connection.transaction_state or _run_callbacks(connection))
@@ -126,6 +126,7 @@ ESP.Scheduling = function(){
 	//set last_fetched_index to the initial age
 	if(!ESP.Scheduling.hasOwnProperty('last_fetched_index')) {
 	ESP.Scheduling.last_fetched_index = 0
+	ESP.Scheduling.recent_indices = {}
 	}
 
 	//TODO:  add verbose mode here
@@ -402,23 +403,76 @@ ESP.Scheduling = function(){
         return processed_data;
     };
    
-    var fetch_updates = function()  {
-	$j.getJSON('ajax_change_log', {'last_fetched_index': ESP.Scheduling.last_fetched_index}, function(d, status) {
+    //how long to keep telling the server about an entry we've gotten; it
+    //only looks for late entries in the minute before last_fetched_index
+    var recent_index_lifetime = 600000;
+
+    //the change log entries we have from just before last_fetched_index, by
+    //index, with when we got them.  Entries can be committed out of order, so
+    //the server also sends the ones before last_fetched_index that it isn't
+    //told we have (see AJAXChangeLog.get_log).
+    var set_change_log_position = function(latest_index, recent_indices) {
+	ESP.Scheduling.last_fetched_index = latest_index;
+	ESP.Scheduling.recent_indices = {};
+	var now = new Date().getTime();
+	for (var i = 0; i < recent_indices.length; i++) {
+	    ESP.Scheduling.recent_indices[recent_indices[i]] = now;
+	}
+    };
+
+    var change_log_params = function(params) {
+	var now = new Date().getTime();
+	var recent = [];
+	for (var index in ESP.Scheduling.recent_indices) {
+	    if (!ESP.Scheduling.recent_indices.hasOwnProperty(index)) continue;
+	    if (now - ESP.Scheduling.recent_indices[index] > recent_index_lifetime) {
+		delete ESP.Scheduling.recent_indices[index];
+	    } else {
+		recent.push(index);
+	    }
+	}
+	params['last_fetched_index'] = ESP.Scheduling.last_fetched_index;
+	params['recent_indices'] = recent.join(',');
+	return params;
+    };
+
+    var apply_change_log = function(d) {
 	    //if we need to reload
 	    if (d['other'] && d['other'][0]['command'] == "reload"){
 		    console.log("reloading")
+		    set_change_log_position(d['other'][0]['latest_index'], d['other'][0]['recent_indices'])
 		    load()
 		}
 	    else{
 		apply_existing_classes(d.changelog, this.data)
 		//update last change time with received indices
+		var now = new Date().getTime();
 		for(var i = 0; i < d.changelog.length; i++){
+			ESP.Scheduling.recent_indices[d.changelog[i].index] = now;
 			if(d.changelog[i].index > ESP.Scheduling.last_fetched_index) {
 		    	ESP.Scheduling.last_fetched_index = d.changelog[i].index
 		    }
 		}
 	    }
-	});
+    };
+
+    //get whatever has changed since we last looked, without waiting
+    var fetch_updates = function()  {
+	$j.getJSON('ajax_change_log_wait', change_log_params({'timeout': 0}), apply_change_log);
+    };
+
+    //keep a request open for the server to answer as soon as something
+    //changes, and open the next one once it does (or times out)
+    var wait_for_updates = function() {
+	$j.getJSON('ajax_change_log_wait', change_log_params({}))
+	    .done(apply_change_log)
+	    .done(function() {
+		wait_for_updates();
+	    })
+	    .fail(function() {
+		ESP.Scheduling.status('error','Unable to refresh data from server.');
+		setTimeout(wait_for_updates, 10000);
+	    });
     };
 
     var apply_existing_classes = function(assignments, data) {
@@ -641,6 +695,8 @@ ESP.Scheduling = function(){
         validate_block_assignment: validate_block_assignment,
         validate_start_time: validate_start_time,
 	fetch_updates: fetch_updates,
+	wait_for_updates: wait_for_updates,
+	set_change_log_position: set_change_log_position,
 	//data: data
     };
 
@@ -657,31 +713,18 @@ $j(function(){
     $j.getJSON('ajax_schedule_last_changed', function(d, status) {
         if (status == "success") {
             ESP.version_uuid = d['val'];
-            ESP.Scheduling.last_fetched_index = d['latest_index'];
+            ESP.Scheduling.set_change_log_position(d['latest_index'], d['recent_indices']);
+            //if we're in debug mode, we can use the button at the top to get updates
+            if (!debug_on){
+                ESP.Scheduling.wait_for_updates();
+            }
         }
     });
 
     //json_fetch_data(json_components, json_data);
     load()
 
-    //if we're in debug mode, we can use the button at the top to get updates
     if (!debug_on){
-	setInterval(function() {
-            $j.getJSON('ajax_schedule_last_changed', function(d, status) {
-		if (status == "success") {
-                    if (d['val'] != ESP.version_uuid) {
-			ESP.version_uuid = d['val'];
-			//location.reload(true);
-			ESP.Scheduling.fetch_updates();
-                    } else {
-			ESP.Scheduling.last_fetched_index = d['latest_index'];
-                    }
-		} else {
-                    ESP.Scheduling.status('error','Unable to refresh data from server.');
-		}
-            });
-	}, 10000);
-
 	setInterval(function() {
 	    load()
 	}, 600000);
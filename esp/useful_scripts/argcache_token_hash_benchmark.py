@@ -0,0 +1,87 @@
+# Microbenchmark for ArgCache's hash_tokens option.
+# Usage: ./manage.py shell_plus < ../useful_scripts/argcache_token_hash_benchmark.py
+#
+# Compares storing all token values with each cached value (the default)
+# against storing a single digest of them (hash_tokens=True / the
+# CACHE_HASH_TOKENS setting).  For each number of tokens, reports the bytes
+# written per set(), the bytes read per get() and the average latency of get().
+#
+# By default this runs against the locmem backend, which measures pickling
+# overhead only.  Set BACKEND to the memcached backend (and LOCATION to your
+# memcached server) to include network transfer.
+
+import random
+import string
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.core.cache import get_cache
+
+from esp.cache import registry
+from esp.cache.argcache import ArgCache
+
+BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+LOCATION = 'argcache_token_hash_benchmark'
+TOKEN_COUNTS = [1, 3, 6, 10]
+NUM_KEYS = 200
+NUM_GETS = 5000
+VALUE = dict((i, 'value %d' % i) for i in range(10))
+
+class ByteCountingCache(object):
+    """ Wraps a cache backend and counts the pickled size of what goes through it. """
+    def __init__(self, backend):
+        self.backend = backend
+        self.bytes_read = 0
+        self.bytes_written = 0
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+    def get_many(self, keys, *args, **kwargs):
+        ans = self.backend.get_many(keys, *args, **kwargs)
+        for key, value in ans.items():
+            self.bytes_read += len(key) + len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        return ans
+    def set(self, key, value, *args, **kwargs):
+        self.bytes_written += len(key) + len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        return self.backend.set(key, value, *args, **kwargs)
+
+def make_cache(num_tokens, hash_tokens):
+    backend = ByteCountingCache(get_cache(BACKEND, LOCATION=LOCATION))
+    params = tuple('arg%d' % i for i in range(num_tokens))
+    name = 'benchmark_%s_' % ''.join(random.sample(string.letters, 8))
+    #   Caches are supposed to be created at startup; don't complain about this one.
+    old_locked = registry._caches_locked
+    registry._caches_locked = False
+    try:
+        cache_obj = ArgCache(name, params, cache=backend, hash_tokens=hash_tokens)
+    finally:
+        registry._caches_locked = old_locked
+    #   The global token plus one per parameter (the last one would be the
+    #   whole key, which is not a real token)
+    for param in params[:-1]:
+        cache_obj.get_or_create_token((param,))
+    return cache_obj, backend
+
+def run(num_tokens, hash_tokens):
+    cache_obj, backend = make_cache(num_tokens, hash_tokens)
+    arg_lists = [tuple(random.randint(0, 1000) for i in range(num_tokens)) for j in range(NUM_KEYS)]
+    for arg_list in arg_lists:
+        cache_obj.set(arg_list, VALUE)
+    bytes_per_set = float(backend.bytes_written) / NUM_KEYS
+
+    start = time.time()
+    for i in range(NUM_GETS):
+        assert cache_obj.get(arg_lists[i % NUM_KEYS]) is not None
+    elapsed = time.time() - start
+    bytes_per_get = float(backend.bytes_read) / NUM_GETS
+    cache_obj.delete_all()
+    return len(cache_obj.tokens), bytes_per_set, bytes_per_get, elapsed / NUM_GETS * 1e6
+
+print '%8s %12s %14s %14s %12s' % ('tokens', 'mode', 'bytes/set', 'bytes/get', 'usec/get')
+for num_tokens in TOKEN_COUNTS:
+    for hash_tokens in (False, True):
+        tokens, bytes_per_set, bytes_per_get, usec_per_get = run(num_tokens, hash_tokens)
+        print '%8d %12s %14.1f %14.1f %12.1f' % (tokens, 'hashed' if hash_tokens else 'list', bytes_per_set, bytes_per_get, usec_per_get)
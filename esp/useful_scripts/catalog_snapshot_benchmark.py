@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# Benchmark for the JSON catalog: the old path (ClassSubject.objects.catalog()
+# plus serializing model instances) against ClassSubject.objects.catalog_snapshot().
+# Usage: python useful_scripts/catalog_snapshot_benchmark.py
+#
+# Builds a synthetic program with NUM_TEACHERS * CLASSES_PER_TEACHER classes
+# in a fresh test database (so the database user needs permission to create
+# one), and times both paths cold (empty cache), warm, and after editing one
+# class.  The cache is a private locmem cache, so emptying it doesn't touch
+# the site's memcached.
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp.settings')
+
+import esp.manage
+
+#   This has to happen before anything imports django.core.cache
+from django.conf import settings
+settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'catalog_snapshot_benchmark'}}
+
+import time
+
+import simplejson
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+#   Import every app and set up the caches, as shell_plus would
+import esp.cache_loader
+from esp.program.models import ClassSubject
+from esp.program.tests import ProgramFrameworkTest
+
+if not isinstance(cache, LocMemCache):
+    raise Exception('The cache was set up before catalog_snapshot_benchmark could replace it; refusing to run against %r' % cache)
+
+NUM_TEACHERS = 100
+CLASSES_PER_TEACHER = 10
+NUM_REPEATS = 5
+
+def old_catalog_json(program):
+    classes = ClassSubject.objects.catalog(program)
+    data = []
+    for cls in classes:
+        entry = cls.catalog_data()
+        for sec, sec_entry in zip(cls.get_sections(), entry['get_sections']):
+            sec_entry['num_students'] = sec.num_students()
+            sec_entry['capacity'] = sec.capacity
+        entry['num_students'] = cls.num_students()
+        data.append(entry)
+    return simplejson.dumps(data)
+
+def new_catalog_json(program):
+    return simplejson.dumps(ClassSubject.objects.catalog_snapshot(program))
+
+def timed(func, program, prepare=None):
+    times = []
+    for i in range(NUM_REPEATS):
+        if prepare:
+            prepare()
+        start = time.time()
+        func(program)
+        times.append(time.time() - start)
+    return sum(times) / len(times)
+
+def edit_one_class(program):
+    cls = program.classes()[0]
+    cls.class_info += '.'
+    cls.save()
+
+setup_test_environment()
+old_database_name = connection.settings_dict['NAME']
+connection.creation.create_test_db(verbosity=1)
+try:
+    print 'Creating a program with %d classes...' % (NUM_TEACHERS * CLASSES_PER_TEACHER)
+    framework = ProgramFrameworkTest('runTest')
+    framework.setUp(num_teachers=NUM_TEACHERS, classes_per_teacher=CLASSES_PER_TEACHER, num_rooms=NUM_TEACHERS, num_timeslots=CLASSES_PER_TEACHER, program_instance_name='1111_Benchmark', program_instance_label='Benchmark 1111')
+    program = framework.program
+
+    assert simplejson.loads(old_catalog_json(program)) == simplejson.loads(new_catalog_json(program))
+
+    print '%-30s %12s %12s' % ('', 'catalog()', 'snapshot')
+    for label, prepare in [('cold', cache.clear), ('warm', None), ('after editing one class', lambda: edit_one_class(program))]:
+        old_time = timed(old_catalog_json, program, prepare)
+        new_time = timed(new_catalog_json, program, prepare)
+        print '%-30s %11.3fs %11.3fs' % (label, old_time, new_time)
+finally:
+    connection.creation.destroy_test_db(old_database_name, verbosity=1)
+    teardown_test_environment()
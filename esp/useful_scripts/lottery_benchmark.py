@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# Benchmark for the lottery: runs LotteryAssignmentController on a made-up
+# program, and reports how long each phase took along with the statistics
+# from compute_stats().  This gives a baseline for catching regressions in the
+# lottery's speed or the quality of its assignments, without needing a copy
+# of a real program's data.
+# Usage: python useful_scripts/lottery_benchmark.py
+#
+# Builds the program in a fresh test database (so the database user needs
+# permission to create one), with a private locmem cache; the site's own
+# database and memcached are never touched.  The program has NUM_STUDENTS
+# students, each with a grade, some priority picks (one per timeslot) and some
+# interested picks, and NUM_CLASSES classes scheduled at random.  Section
+# popularity follows a Pareto distribution.
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp.settings')
+
+import esp.manage
+
+#   This has to happen before anything imports django.core.cache
+from django.conf import settings
+settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lottery_benchmark'}}
+
+import random
+import time
+
+import numpy
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+#   Import every app and set up the caches, as shell_plus would
+import esp.cache_loader
+from esp.program.controllers.lottery import LotteryAssignmentController
+from esp.program.models import RegistrationProfile, RegistrationType, StudentRegistration
+from esp.program.tests import ProgramFrameworkTest
+from esp.users.models import ESPUser, StudentInfo
+
+if not isinstance(cache, LocMemCache):
+    raise Exception('The cache was set up before lottery_benchmark could replace it; refusing to run against %r' % cache)
+
+NUM_STUDENTS = 2000
+NUM_CLASSES = 300
+SECTIONS_PER_CLASS = 2
+NUM_TIMESLOTS = 8
+ROOM_CAPACITY = 30
+INTEREST_PER_STUDENT = 6
+PRIORITY_PER_STUDENT = 2        # each in a different timeslot
+POPULARITY = 1.5                # shape of the Pareto distribution of section popularity; 0 for uniform
+SEED = 0
+SPARSE = True
+
+def add_preferences(framework):
+    """ Give each student a grade, and sign them up for sections at random;
+        some sections are a lot more popular than others. """
+
+    rng = numpy.random.RandomState(SEED)
+    section_times = numpy.array(framework.program.sections().filter(meeting_times__isnull=False).order_by('id').values_list('id', 'meeting_times__id'))
+    (section_ids, first_rows) = numpy.unique(section_times[:, 0], return_index=True)
+    section_timeslots = section_times[first_rows, 1]
+    timeslot_ids = numpy.unique(section_timeslots)
+    if POPULARITY > 0:
+        popularity = rng.pareto(POPULARITY, section_ids.shape[0]) + 0.1
+    else:
+        popularity = numpy.ones(section_ids.shape)
+
+    priority_rt, created = RegistrationType.objects.get_or_create(name='Priority/1')
+    interested_rt, created = RegistrationType.objects.get_or_create(name='Interested')
+    registrations = []
+    for student in framework.students:
+        student_info = StudentInfo.objects.create(user=student, graduation_year=ESPUser.YOGFromGrade(int(rng.randint(7, 13))))
+        RegistrationProfile.objects.create(user=student, student_info=student_info, most_recent_profile=True)
+
+        chosen = numpy.zeros(section_ids.shape, dtype=numpy.bool)
+        for timeslot_id in rng.permutation(timeslot_ids)[:PRIORITY_PER_STUDENT]:
+            options = numpy.nonzero(section_timeslots == timeslot_id)[0]
+            choice = rng.choice(options, p=popularity[options] / numpy.sum(popularity[options]))
+            chosen[choice] = True
+            registrations.append(StudentRegistration(user=student, section_id=int(section_ids[choice]), relationship=priority_rt))
+
+        options = numpy.nonzero(~chosen)[0]
+        num_interested = min(INTEREST_PER_STUDENT, options.shape[0])
+        for choice in rng.choice(options, num_interested, replace=False, p=popularity[options] / numpy.sum(popularity[options])):
+            registrations.append(StudentRegistration(user=student, section_id=int(section_ids[choice]), relationship=interested_rt))
+    StudentRegistration.objects.bulk_create(registrations)
+
+setup_test_environment()
+old_database_name = connection.settings_dict['NAME']
+connection.creation.create_test_db(verbosity=1)
+try:
+    #   One teacher per class, and enough rooms for every section to fit
+    num_sections = NUM_CLASSES * SECTIONS_PER_CLASS
+    start_time = time.time()
+    random.seed(SEED)
+    framework = ProgramFrameworkTest('runTest')
+    framework.setUp(num_students=NUM_STUDENTS, num_teachers=NUM_CLASSES, classes_per_teacher=1, sections_per_class=SECTIONS_PER_CLASS, num_timeslots=NUM_TIMESLOTS, num_rooms=num_sections / NUM_TIMESLOTS + 1, room_capacity=ROOM_CAPACITY, program_instance_name='1111_Benchmark', program_instance_label='Benchmark 1111')
+    framework.schedule_randomly()
+    add_preferences(framework)
+    setup_time = time.time() - start_time
+
+    timings = []
+
+    start_time = time.time()
+    controller = LotteryAssignmentController(framework.program, sparse=SPARSE)
+    timings.append(('load', time.time() - start_time))
+
+    numpy.random.seed(SEED)
+    start_time = time.time()
+    controller.compute_assignments()
+    timings.append(('fill', time.time() - start_time))
+
+    start_time = time.time()
+    stats = controller.compute_stats(display=False)
+    timings.append(('stats', time.time() - start_time))
+
+    start_time = time.time()
+    controller.save_assignments()
+    timings.append(('save', time.time() - start_time))
+
+    print 'Lottery benchmark: %d students, %d sections, %d timeslots (set up in %.1fs)' % (controller.num_students, controller.num_sections, controller.num_timeslots, setup_time)
+    for (phase, elapsed) in timings:
+        print '%8s: %8.3fs' % (phase, elapsed)
+    for key in ['num_enrolled_students', 'num_registrations', 'num_full_classes', 'total_spaces', 'overall_priority_ratio', 'overall_interest_ratio', 'overall_utility']:
+        print '%24s: %s' % (key, stats[key])
+finally:
+    connection.creation.destroy_test_db(old_database_name, verbosity=1)
+    teardown_test_environment()
@@ -0,0 +1,164 @@
+# Benchmark for LotteryAssignmentController.fill_section: the old version,
+# which filtered every student one timeslot/section/lunch period at a time,
+# against the current one, which only looks at the section's applicants and
+# checks them against all of its constraints at once.
+# Usage: ./manage.py shell_plus < ../useful_scripts/lottery_fill_benchmark.py
+#
+# Doesn't touch the database: the controller's matrices are filled in with a
+# synthetic program of NUM_STUDENTS students and NUM_SECTIONS sections.  Both
+# versions are run with the same seeds, and must give the same assignments.
+
+import time
+
+import numpy
+import numpy.random
+
+from esp.program.controllers.lottery import LotteryAssignmentController
+
+NUM_STUDENTS = 3000
+NUM_SECTIONS = 800
+NUM_DAYS = 2
+TIMESLOTS_PER_DAY = 8
+LUNCH_TIMESLOTS = [3, 4]        # of each day
+INTEREST_PER_STUDENT = 12
+PRIORITY_PER_STUDENT = 3
+SEEDS = [1, 2, 3]
+NUM_REPEATS = 3
+
+class SyntheticProgram(object):
+    program_size_max = None
+
+    def niceName(self):
+        return 'Synthetic program'
+
+class SyntheticLotteryAssignmentController(LotteryAssignmentController):
+    """ A lottery controller for a made-up program. """
+
+    def __init__(self, seed=0):
+        self.program = SyntheticProgram()
+        self.options = LotteryAssignmentController.default_options.copy()
+        self.num_students = NUM_STUDENTS
+        self.num_sections = NUM_SECTIONS
+        self.num_timeslots = NUM_DAYS * TIMESLOTS_PER_DAY
+        numpy.random.seed(seed)
+        self.initialize()
+
+    def initialize(self):
+        self.student_ids = numpy.arange(1, self.num_students + 1)
+        self.section_ids = numpy.arange(1, self.num_sections + 1)
+        self.timeslot_ids = numpy.arange(1, self.num_timeslots + 1)
+        self.student_indices = self.get_index_array(self.student_ids)
+        self.section_indices = self.get_index_array(self.section_ids)
+        self.timeslot_indices = self.get_index_array(self.timeslot_ids)
+
+        self.lunch_timeslots = numpy.array([[self.timeslot_ids[day * TIMESLOTS_PER_DAY + i] for i in LUNCH_TIMESLOTS] for day in range(NUM_DAYS)], dtype=numpy.int32)
+        self.lunch_schedule = numpy.zeros((self.num_timeslots,))
+        self.lunch_schedule[self.timeslot_indices[self.lunch_timeslots.flatten()]] = True
+
+        #   Sections of 1 to 3 consecutive timeslots, within a day
+        self.section_schedules = numpy.zeros((self.num_sections, self.num_timeslots), dtype=numpy.bool)
+        for si in range(self.num_sections):
+            length = numpy.random.randint(1, 4)
+            day = numpy.random.randint(NUM_DAYS)
+            start = numpy.random.randint(TIMESLOTS_PER_DAY - length + 1)
+            self.section_schedules[si, day * TIMESLOTS_PER_DAY + start:day * TIMESLOTS_PER_DAY + start + length] = True
+        self.section_lengths = numpy.sum(self.section_schedules, 1)
+        self.section_capacities = numpy.random.randint(10, 40, self.num_sections).astype(numpy.uint32)
+
+        #   Classes of 1 to 4 sections
+        self.section_parent_classes = numpy.cumsum(numpy.random.randint(0, 4, self.num_sections) == 0)
+        self.section_overlap = (self.section_parent_classes[:, numpy.newaxis] == self.section_parent_classes[numpy.newaxis, :])
+
+        self.section_grade_min = numpy.random.randint(7, 10, self.num_sections).astype(numpy.uint32)
+        self.section_grade_max = numpy.random.randint(10, 13, self.num_sections).astype(numpy.uint32)
+        self.student_grades = numpy.random.randint(7, 13, self.num_students).astype(numpy.float)
+
+        #   Some sections are much more popular than others
+        popularity = numpy.random.pareto(1.5, self.num_sections) + 0.1
+        popularity /= numpy.sum(popularity)
+        self.interest = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
+        self.priority = numpy.zeros((self.num_students, self.num_sections), dtype=numpy.bool)
+        for i in range(self.num_students):
+            choices = numpy.random.choice(self.num_sections, INTEREST_PER_STUDENT + PRIORITY_PER_STUDENT, replace=False, p=popularity)
+            self.priority[i, choices[:PRIORITY_PER_STUDENT]] = True
+            self.interest[i, choices[PRIORITY_PER_STUDENT:]] = True
+        self.student_utility_weights = numpy.sum(self.interest, 1) + numpy.sum(self.priority, 1).astype(numpy.float)
+        self.student_utilities = numpy.zeros((self.num_students, ), dtype=numpy.float)
+        self.initialize_section_constraints()
+
+class LoopLotteryAssignmentController(SyntheticLotteryAssignmentController):
+    """ The same, with fill_section() filtering students the old way. """
+
+    def fill_section(self, si, priority=False):
+        timeslots = numpy.nonzero(self.section_schedules[si, :])[0]
+        num_spaces = self.section_capacities[si] - numpy.sum(self.student_sections[:, si])
+        if num_spaces == 0:
+            return True
+        if priority:
+            signup = self.priority
+            weight_factor = self.options['Kp']
+        else:
+            signup = self.interest
+            weight_factor = self.options['Ki']
+        lunch_overlap = self.lunch_schedule * self.section_schedules[si, :]
+        for i in range(self.lunch_timeslots.shape[0]):
+            if len(self.lunch_timeslots[i]) != 0 and numpy.sum(lunch_overlap[self.timeslot_indices[self.lunch_timeslots[i]]]) >= (self.lunch_timeslots.shape[1]):
+                return False
+
+        possible_students = numpy.copy(signup[:, si])
+        possible_students *= (self.student_grades >= self.section_grade_min[si])
+        possible_students *= (self.student_grades <= self.section_grade_max[si])
+        for i in range(timeslots.shape[0]):
+            possible_students *= ~self.student_schedules[:, timeslots[i]]
+        for sec_index in numpy.nonzero(self.section_overlap[:, si])[0]:
+            possible_students *= ~self.student_sections[:, sec_index]
+        for i in range(timeslots.shape[0]):
+            if numpy.sum(self.lunch_timeslots == self.timeslot_ids[timeslots[i]]) > 0:
+                lunch_day = numpy.nonzero(self.lunch_timeslots == self.timeslot_ids[timeslots[i]])[0][0]
+                for j in range(self.lunch_timeslots.shape[1]):
+                    timeslot_index = self.timeslot_indices[self.lunch_timeslots[lunch_day, j]]
+                    if timeslot_index != timeslots[i]:
+                        possible_students *= ~self.student_schedules[:, timeslot_index]
+
+        candidate_students = numpy.nonzero(possible_students)[0]
+        if candidate_students.shape[0] <= num_spaces:
+            selected_students = candidate_students
+            section_filled = False
+        else:
+            weights = self.student_weights[candidate_students]
+            weights /= numpy.sum(weights)
+            selected_students = numpy.random.choice(candidate_students, num_spaces, replace=False, p=weights)
+            section_filled = True
+
+        self.student_sections[selected_students, si] = True
+        for i in range(timeslots.shape[0]):
+            self.student_schedules[selected_students, timeslots[i]] = True
+            if priority:
+                self.student_utilities[selected_students] += 1.5
+            else:
+                self.student_utilities[selected_students] += 1
+        self.student_weights[selected_students] /= weight_factor
+        return section_filled
+
+def run(controller_class, seed):
+    """ Fill the sections with the given seed; returns the controller and
+        the best time over NUM_REPEATS runs. """
+    controller = controller_class(seed=0)
+    times = []
+    for i in range(NUM_REPEATS):
+        numpy.random.seed(seed)
+        start = time.time()
+        controller.compute_assignments(check_result=False)
+        times.append(time.time() - start)
+    controller.check_assignments()
+    return controller, min(times)
+
+print 'Synthetic lottery: %d students, %d sections, %d timeslots' % (NUM_STUDENTS, NUM_SECTIONS, NUM_DAYS * TIMESLOTS_PER_DAY)
+print '%-10s %12s %12s %10s' % ('seed', 'loops', 'vectorized', 'speedup')
+for seed in SEEDS:
+    old, old_time = run(LoopLotteryAssignmentController, seed)
+    new, new_time = run(SyntheticLotteryAssignmentController, seed)
+    assert (old.student_sections == new.student_sections).all()
+    assert (old.student_utilities == new.student_utilities).all()
+    print '%-10d %11.3fs %11.3fs %9.1fx' % (seed, old_time, new_time, old_time / new_time)
+print '%d enrollments for the last seed' % numpy.sum(new.student_sections)